@@ -55,6 +55,9 @@ class BaseITCExperiment:
         self.dh_file = dh_file
         self._shot_start = shot_start
 
+        # Bumped whenever the observed heats (or the shots used) change
+        self._obs_version = 0
+
         # Deal with units
         self._units = units
         try:
@@ -77,14 +80,23 @@ class BaseITCExperiment:
         self._read_heats_file()
 
         # Initialize model using information read from heats file
-        self._model = model(S_cell=self.stationary_cell_conc,
-                            T_syringe=self.titrant_syringe_conc,
-                            cell_volume=self.cell_volume,
-                            shot_volumes=self._shots,**model_kwargs)
+        self._initialize_model(model,model_kwargs)
 
         r = "".join([random.choice(string.ascii_letters) for i in range(20)])
         self._experiment_id = "{}_{}".format(self.dh_file,r)
 
+    def _initialize_model(self,model,model_kwargs):
+        """
+        Create the model from the information read from the heats file.  The
+        keyword arguments are kept so the experiment can be rebuilt (see
+        GlobalFit.load).
+        """
+
+        self._model_kwargs = dict(model_kwargs)
+        self._model = model(S_cell=self.stationary_cell_conc,
+                            T_syringe=self.titrant_syringe_conc,
+                            cell_volume=self.cell_volume,
+                            shot_volumes=self._shots,**model_kwargs)
 
     def _read_heats_file(self):
         """
@@ -100,10 +112,11 @@ class BaseITCExperiment:
         dictionary.
         """
 
-        if len(self._model.dQ) == 0:
+        dQ = self._model.dQ
+        if len(dQ) == 0:
             return np.array(())
 
-        return self._model.dQ[self._shot_start:]
+        return dQ[self._shot_start:]
 
     @property
     def dilution_heats(self):
@@ -112,10 +125,22 @@ class BaseITCExperiment:
         in params dictionary.
         """
 
-        if len(self._model.dilution_heats) == 0:
+        dilution_heats = self._model.dilution_heats
+        if len(dilution_heats) == 0:
             return np.array(())
 
-        return self._model.dilution_heats[self._shot_start:]
+        return dilution_heats[self._shot_start:]
+
+    @property
+    def dQ_jacobian(self):
+        """
+        Return the derivatives of the heats calculated by the model with
+        respect to each model parameter (dictionary of arrays).
+        """
+
+        jac = self._model.dQ_jacobian
+
+        return dict([(p,jac[p][self._shot_start:]) for p in jac.keys()])
 
     @property
     def param_values(self):
@@ -164,6 +189,7 @@ class BaseITCExperiment:
         """
 
         self._shot_start = value
+        self._obs_version += 1
 
     @property
     def heats(self):
@@ -179,6 +205,7 @@ class BaseITCExperiment:
         """
         
         self._heats[self._shot_start:] = heats[:]
+        self._obs_version += 1
 
     @property
     def heats_stdev(self):
@@ -195,6 +222,16 @@ class BaseITCExperiment:
         """
 
         self._heats_stdev[self._shot_start:] = heats_stdev[:]
+        self._obs_version += 1
+
+    @property
+    def obs_version(self):
+        """
+        Counter that is incremented whenever the starting shot, heats or heat
+        uncertainties change.
+        """
+
+        return self._obs_version
 
     @property
     def mole_ratio(self):
@@ -7,6 +7,14 @@ __author__ = "Michael J. Harms"
 
 import copy
 import numpy as np
+from scipy.special import expit, logit, log_expit
+
+# Transforms that may be applied to a parameter while fitting.
+AVAIL_TRANSFORMS = (None,"log","logit","softplus")
+
+# Log-transformed values are kept inside exp(+/-_MAX_LOG) so a wild step by the
+# fitter gives a huge (or tiny) but finite, nonzero value.
+_MAX_LOG = 700.0
 
 class FitParameter:
     """
@@ -14,7 +22,7 @@ class FitParameter:
     """
 
     def __init__(self,name,guess=None,guess_range=None,fixed=False,bounds=None,
-                 alias=None):
+                 alias=None,transform=None):
         """
         Initialize class.  Parameters:
 
@@ -31,14 +39,34 @@ class FitParameter:
                 bound, upper bound of 5.
         alias: alias for parameter name, for linking to global paramter names. (str)
                If None, no alias is made.
+        transform: transform applied to the parameter while fitting.  None
+                   (fit the parameter directly), "log" (fit log(value); value
+                   must be positive), "logit" (map the finite bounds onto the
+                   whole real line) or "softplus" (keep value above a finite
+                   lower bound).
         """
 
+        # Called with no arguments whenever the value changes.  Models use this
+        # to know when cached heats are stale.
+        self.on_change = None
+
+        # Called with no arguments whenever the parameter is fixed or unfixed,
+        # or its alias or transform changes.  Models use this to know when a
+        # global fit has to rebuild its parameter layout.
+        self.on_layout_change = None
+
+        # If bound (see bind), the value lives in array[index] rather than in
+        # self._value.
+        self._array = None
+        self._index = None
+
         self.name = name
         self.guess = guess
         self.guess_range = guess_range
         self.fixed = fixed
         self.bounds = bounds        
         self.alias = alias
+        self.transform = transform
         
         self.value = self.guess
 
@@ -46,6 +74,82 @@ class FitParameter:
         self._stdev = np.inf
         self._ninetyfive = [-np.inf,np.inf]
 
+    def __copy__(self):
+        """
+        Shallow copy of the parameter.  The copy is not attached to whatever
+        object was watching this parameter for changes.
+        """
+
+        new = self.__class__.__new__(self.__class__)
+        new.__dict__.update(self.__dict__)
+        new.on_change = None
+        new.on_layout_change = None
+        new._value = self.value
+        new._array = None
+        new._index = None
+
+        return new
+
+    def bind(self,array,index,on_change=None,on_layout_change=None):
+        """
+        Store the value of this parameter in array[index], so the owner can
+        read all of its parameter values as a single array.  The current value
+        is copied into the array.
+
+        Parameters
+        ----------
+
+        array : 1d numpy array of floats
+            array holding the parameter values.
+        index : int
+            position of this parameter in array.
+        on_change : callable or None
+            function called (with no arguments) whenever the value changes.
+        on_layout_change : callable or None
+            function called (with no arguments) whenever the parameter is
+            fixed or unfixed, or its alias or transform changes.
+        """
+
+        array[index] = self.value
+
+        self._array = array
+        self._index = index
+        self.on_change = on_change
+        self.on_layout_change = on_layout_change
+
+    def _get_state(self):
+        """
+        Settings and fit results of the parameter as plain python types (used
+        by GlobalFit.save).  The alias is not included; it is restored by
+        relinking.
+        """
+
+        def plain(x):
+            return None if x is None else float(x)
+
+        return {"guess":plain(self.guess),
+                "guess_range":[plain(g) for g in self.guess_range],
+                "fixed":self.fixed,
+                "bounds":[plain(b) for b in self.bounds],
+                "transform":self.transform,
+                "value":plain(self.value),
+                "stdev":plain(self.stdev),
+                "ninetyfive":[plain(n) for n in self.ninetyfive]}
+
+    def _set_state(self,state):
+        """
+        Restore settings and fit results written by _get_state.
+        """
+
+        self.bounds = state["bounds"]
+        self.guess_range = state["guess_range"]
+        self.guess = state["guess"]
+        self.fixed = state["fixed"]
+        self.transform = state["transform"]
+        self.value = state["value"]
+        self.stdev = state["stdev"]
+        self.ninetyfive = state["ninetyfive"]
+
     #--------------------------------------------------------------------------
     # parameter name
 
@@ -71,7 +175,10 @@ class FitParameter:
         Value of the parameter.
         """
 
-        return self._value
+        if self._array is None:
+            return self._value
+
+        return self._array[self._index]
 
     @value.setter
     def value(self,v):
@@ -80,9 +187,21 @@ class FitParameter:
         """
 
         if v != None:
-            self._value = v
+            self._set_value(v)
         else:
-            self._value = self.guess
+            self._set_value(self.guess)
+
+    def _set_value(self,v):
+        """
+        Store the value and notify whoever is watching this parameter.
+        """
+
+        self._value = v
+        if self._array is not None:
+            self._array[self._index] = v
+
+        if self.on_change is not None:
+            self.on_change()
 
     #--------------------------------------------------------------------------
     # parameter stdev
@@ -157,7 +276,7 @@ class FitParameter:
             else:
                 self._guess = 1.0
 
-        self._value = self._guess
+        self._set_value(self._guess)
 
     #--------------------------------------------------------------------------
     # parameter guess_range
@@ -212,8 +331,13 @@ class FitParameter:
         """
         Fix or unfix the parameter.
         """
-        
-        self._fixed = bool(bool_value)
+
+        fixed = bool(bool_value)
+        changed = fixed != getattr(self,"_fixed",False)
+
+        self._fixed = fixed
+        if changed:
+            self._layout_changed()
 
     #--------------------------------------------------------------------------
     # bounds for fit.
@@ -269,4 +393,209 @@ class FitParameter:
         except AttributeError:
             pass
 
+        changed = a != getattr(self,"_alias",None)
+
         self._alias = a
+        if changed:
+            self._layout_changed()
+
+    #--------------------------------------------------------------------------
+    # transform applied while fitting
+
+    @property
+    def transform(self):
+        """
+        Transform applied to the parameter while fitting: None, "log", "logit"
+        or "softplus".  Fitters work on the transformed parameter, but values,
+        guesses and bounds are always given untransformed.
+        """
+
+        return self._transform
+
+    @transform.setter
+    def transform(self,t):
+        """
+        Set the transform.
+        """
+
+        if t not in AVAIL_TRANSFORMS:
+            err = "transform must be one of:\n"
+            for a in AVAIL_TRANSFORMS:
+                err += "    {}\n".format(a)
+            raise ValueError(err)
+
+        changed = t != getattr(self,"_transform",None)
+
+        self._transform = t
+        if changed:
+            self._layout_changed()
+
+    def _layout_changed(self):
+        """
+        Notify whoever is watching this parameter that it was fixed or 
+        unfixed, or its alias or transform changed.
+        """
+
+        if self.on_layout_change is not None:
+            self.on_layout_change()
+
+    def _numeric_bounds(self):
+        """
+        Bounds as floats, with None replaced by -inf/inf.
+        """
+
+        lower, upper = self.bounds
+        if lower is None:
+            lower = -np.inf
+        if upper is None:
+            upper = np.inf
+
+        return float(lower), float(upper)
+
+    def _check_transform(self,x):
+        """
+        Make sure the transform can be applied given the bounds and x.
+        """
+
+        lower, upper = self._numeric_bounds()
+
+        if self._transform == "log":
+            ok = np.all(x > 0)
+            requirement = "positive values"
+
+        elif self._transform == "logit":
+            if not (np.isfinite(lower) and np.isfinite(upper)):
+                err = "logit transform of {} requires finite bounds.\n".format(self.name)
+                raise ValueError(err)
+            ok = np.all(x > lower) and np.all(x < upper)
+            requirement = "values strictly inside the bounds"
+
+        elif self._transform == "softplus":
+            if not np.isfinite(lower):
+                err = "softplus transform of {} requires a finite lower bound.\n".format(self.name)
+                raise ValueError(err)
+            ok = np.all(x > lower)
+            requirement = "values above the lower bound"
+
+        else:
+            ok = True
+
+        if not ok:
+            err = "{} transform of {} requires {}.\n".format(self._transform,
+                                                           self.name,
+                                                           requirement)
+            raise ValueError(err)
+
+    def to_fit_space(self,x):
+        """
+        Map a value (or array of values) into the space the fitter works in.
+        """
+
+        if self._transform is None:
+            return x
+
+        x = np.asarray(x,dtype=float)
+        self._check_transform(x)
+        lower, upper = self._numeric_bounds()
+
+        if self._transform == "log":
+            return np.log(x)
+
+        if self._transform == "logit":
+            return logit((x - lower)/(upper - lower))
+
+        # softplus: log(exp(y) - 1), written so it does not overflow
+        y = x - lower
+        return y + np.log(-np.expm1(-y))
+
+    def from_fit_space(self,u):
+        """
+        Map a value (or array of values) from the fitter's space back to the
+        parameter value.
+        """
+
+        if self._transform is None:
+            return u
+
+        u = np.asarray(u,dtype=float)
+        lower, upper = self._numeric_bounds()
+
+        if self._transform == "log":
+            return np.exp(np.clip(u,-_MAX_LOG,_MAX_LOG))
+
+        if self._transform == "logit":
+            return lower + (upper - lower)*expit(u)
+
+        return lower + np.logaddexp(0,u)
+
+    def fit_space_derivative(self,u):
+        """
+        Derivative of the parameter value with respect to the transformed
+        parameter u, evaluated at u.
+        """
+
+        if self._transform is None:
+            return np.ones(np.shape(u))
+
+        u = np.asarray(u,dtype=float)
+        lower, upper = self._numeric_bounds()
+
+        if self._transform == "log":
+            return np.exp(np.clip(u,-_MAX_LOG,_MAX_LOG))
+
+        if self._transform == "logit":
+            s = expit(u)
+            return (upper - lower)*s*(1 - s)
+
+        return expit(u)
+
+    def fit_space_log_derivative(self,u):
+        """
+        Log of the derivative of the parameter value with respect to the 
+        transformed parameter u, evaluated at u.  Calculated directly, so it
+        stays finite where the derivative itself underflows.
+        """
+
+        if self._transform is None:
+            return np.zeros(np.shape(u))
+
+        u = np.asarray(u,dtype=float)
+        lower, upper = self._numeric_bounds()
+
+        if self._transform == "log":
+            return np.clip(u,-_MAX_LOG,_MAX_LOG)
+
+        if self._transform == "logit":
+            return np.log(upper - lower) + log_expit(u) + log_expit(-u)
+
+        return log_expit(u)
+
+    @property
+    def fit_bounds(self):
+        """
+        Bounds in the space the fitter works in.
+        """
+
+        lower, upper = self._numeric_bounds()
+
+        if self._transform is None:
+            return lower, upper
+
+        if self._transform == "log":
+            if upper <= 0:
+                err = "log transform of {} requires a positive upper bound.\n".format(self.name)
+                raise ValueError(err)
+
+            if lower > 0:
+                lower = np.log(lower)
+            else:
+                lower = -np.inf
+            return lower, np.log(upper)
+
+        if self._transform == "logit":
+            return -np.inf, np.inf
+
+        if np.isfinite(upper):
+            upper = float(self.to_fit_space(upper))
+
+        return -np.inf, upper
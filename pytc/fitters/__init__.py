@@ -9,3 +9,4 @@ __all__ = []
 from .ml import MLFitter 
 from .bootstrap import BootstrapFitter 
 from .bayesian import BayesianFitter
+from .schur import SchurFitter
@@ -7,10 +7,49 @@ __date__ = "2017-05-10"
 
 import numpy as np
 import scipy.stats
+import scipy.sparse
 import scipy.optimize as optimize
+from scipy.optimize._numdiff import approx_derivative, group_columns
 import corner
 
-import re
+import re, functools, concurrent.futures
+
+# Copy of the fitter held by each worker process of a fitter's process pool;
+# set by _init_worker when the pool starts.
+_worker_fitter = None
+
+def _init_worker(fitter):
+    """
+    Store the fitter sent to a new worker process.
+    """
+
+    global _worker_fitter
+    _worker_fitter = fitter
+
+def _worker_call(method,arg):
+    """
+    Call method of the fitter held by a worker process with arg.
+    """
+
+    return getattr(_worker_fitter,method)(arg)
+
+def _worker_pool(fitter,num_workers):
+    """
+    Start a process pool whose workers each receive one pickled copy of 
+    fitter (including its model) when they start.  Tasks sent to the pool 
+    with _worker_function only carry their own arguments.
+    """
+
+    return concurrent.futures.ProcessPoolExecutor(max_workers=num_workers,
+                                                  initializer=_init_worker,
+                                                  initargs=(fitter,))
+
+def _worker_function(method):
+    """
+    Picklable function that calls method of the fitter held by a worker.
+    """
+
+    return functools.partial(_worker_call,method)
 
 class Fitter:
     """
@@ -50,15 +89,107 @@ class Fitter:
 
     def ln_like(self,param):
         """
-        Log likelihood as a function of fit parameters.
+        Log likelihood as a function of fit parameters.  The weighted
+        residuals are calculated in a scratch array that is reused between
+        calls.
         """
 
         y_calc = self._model(param)
-        sigma2 = self._y_err**2
 
-        return -0.5*(np.sum((self._y_obs - y_calc)**2/sigma2 + np.log(sigma2)))
+        r = self._scratch_residuals(len(self._y_obs))
+        np.subtract(self._y_obs,y_calc,out=r)
+        np.divide(r,self._y_err,out=r)
+
+        return -0.5*(np.dot(r,r) + 2*np.sum(np.log(np.abs(self._y_err))))
+
+    def _scratch_residuals(self,size):
+        """
+        Return a scratch array of length size, allocating it only if needed.
+        Only use it for values that do not outlive the call; least_squares,
+        for example, keeps the residual vectors it is given, so residual 
+        functions handed to it must return new arrays.
+        """
+
+        try:
+            if len(self._scratch) == size:
+                return self._scratch
+        except AttributeError:
+            pass
+
+        self._scratch = np.empty(size,dtype=float)
+
+        return self._scratch
+
+    def _grouped_jacobian(self,residuals,jac_sparsity,bounds,sparse=False):
+        """
+        Build a function estimating the jacobian of residuals by one-sided
+        differences.  Parameters that never affect the same residual are 
+        perturbed together, so a block-sparse global fit needs a few residual
+        evaluations per jacobian rather than one per parameter.  The 
+        differences are taken by scipy's approx_derivative (which 
+        least_squares uses for its own "2-point" jacobians), so steps are 
+        chosen and kept inside the bounds exactly as least_squares does.  By
+        default the jacobian is returned as a dense array so least_squares 
+        keeps using its exact trust region solver; given a sparse jacobian
+        (or jac_sparsity), it would switch to the iterative lsmr solver.
+
+        Returns two functions, fun and jac.  fun wraps residuals, remembering
+        its last value; give it to the optimizer in place of residuals so jac
+        can reuse the residuals at the point where the jacobian is taken
+        rather than recalculating them.
+
+        Parameters
+        ----------
 
-    def fit(self,model,parameters,bounds,y_obs,y_err=None,param_names=None):
+        residuals : callable
+            function taking the parameters and returning the residuals
+        jac_sparsity : array-like or sparse matrix
+            num_obs x num_param pattern of non-zero jacobian entries
+        bounds : list
+            list of two lists containing lower and upper bounds
+        sparse : bool
+            return the jacobian as a scipy.sparse csr matrix with the 
+            non-zero pattern of jac_sparsity
+        """
+
+        pattern = scipy.sparse.csc_matrix(jac_sparsity,dtype=bool)
+        groups = group_columns(pattern)
+        bounds = (np.asarray(bounds[0],dtype=float),
+                  np.asarray(bounds[1],dtype=float))
+
+        last_param = None
+        last_f = None
+
+        def fun(param,*args,**kwargs):
+
+            nonlocal last_param, last_f
+
+            f = residuals(param,*args,**kwargs)
+            last_param = np.array(param,dtype=float)
+            last_f = np.array(f)
+
+            return f
+
+        def jac(param,*args,**kwargs):
+
+            param = np.asarray(param,dtype=float)
+            if last_param is not None and np.array_equal(param,last_param):
+                f0 = last_f
+            else:
+                f0 = np.array(residuals(param))
+
+            J = approx_derivative(residuals,param,method="2-point",f0=f0,
+                                  bounds=bounds,sparsity=(pattern,groups))
+
+            if sparse:
+                return J
+
+            return J.toarray()
+
+        return fun, jac
+
+    def fit(self,model,parameters,bounds,y_obs,y_err=None,param_names=None,
+            jacobian=None,jac_sparsity=None,x_scale=None,log_jacobian=None):
         """
         Fit the parameters.       
         Should be redefined in subclasses.
@@ -68,7 +199,9 @@ class Fitter:
 
         model : callable
             model to fit.  model should take "parameters" as its only argument.
-            this should (usually) be GlobalFit._y_calc
+            this should (usually) be GlobalFit._y_calc_into.  the array it 
+            returns may be overwritten by the next call, so copy it if it 
+            needs to be kept.
         parameters : array of floats
             parameters to be optimized.  usually constructed by GlobalFit._prep_fit
         bounds : list
@@ -80,6 +213,25 @@ class Fitter:
             is assigned an error of 1/num_obs
         param_names : array of str
             names of parameters.  If None, parameters assigned names p0,p1,..pN
+        jacobian : callable or None
+            function taking "parameters" and returning the jacobian of model
+            (num_obs x num_param array).  If None, the jacobian is estimated
+            by finite differences.
+        jac_sparsity : array-like, sparse matrix or None
+            num_obs x num_param pattern of the non-zero entries in the 
+            jacobian (usually built by GlobalFit._prep_fit).  Only used when
+            the jacobian is estimated by finite differences, letting groups
+            of independent parameters be perturbed at once.
+        x_scale : array of floats, "jac" or None
+            characteristic scale of each parameter, passed to least_squares.
+            If None, use least_squares' default (1.0 for every parameter).
+        log_jacobian : callable or None
+            function taking "parameters" (or a 2d array with one set of 
+            parameters per row) and returning the log of the jacobian 
+            determinant of the map from the parameters back to the values 
+            they stand for.  GlobalFit passes it when some parameters are fit
+            in a transformed space.  Fitters with a prior add it to the log
+            prior.
         """
 
         pass
@@ -108,6 +260,23 @@ class Fitter:
 
         return self._ninetyfive
 
+    @property
+    def covariance(self):
+        """
+        Covariance matrix of the parameter estimates.  Estimated from the 
+        samples for stochastic fits; None if it is not available.
+        """
+
+        try:
+            return self._covariance
+        except AttributeError:
+            pass
+
+        if len(self.samples) > 1:
+            return np.cov(self.samples,rowvar=False)
+
+        return None
+
     @property
     def fit_result(self):
         """
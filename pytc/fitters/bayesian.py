@@ -5,7 +5,7 @@ Fitter subclass for performing bayesian (MCMC) fits.
 __author__ = "Michael J. Harms"
 __date__ = "2017-05-10"
 
-from .base import Fitter
+from .base import Fitter, _worker_pool, _worker_function
 
 import emcee, corner
 
@@ -14,11 +14,47 @@ import scipy.optimize as optimize
 
 import multiprocessing
 
+class _WalkerPool:
+    """
+    Evaluates ln_prob for batches of walkers in worker processes.  Each 
+    worker receives a copy of the fitter (and its model) once, when the pool
+    starts; each step only sends the walker positions.
+    """
+
+    def __init__(self,fitter,num_workers):
+
+        self._num_workers = num_workers
+        self._executor = _worker_pool(fitter,num_workers)
+
+    def ln_prob(self,positions):
+        """
+        Return the log posterior of each row of positions, splitting the rows
+        into one batch per worker.  Handed to emcee as a vectorized ln_prob.
+        """
+
+        positions = np.asarray(positions)
+        batches = np.array_split(positions,min(self._num_workers,len(positions)))
+
+        ln_prob = []
+        for batch in self._executor.map(_worker_function("_ln_prob_batch"),batches):
+            ln_prob.extend(batch)
+
+        return np.array(ln_prob)
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+
+        self._executor.shutdown()
+
 class BayesianFitter(Fitter):
     """
     """
     def __init__(self,num_walkers=100,initial_walker_spread=1e-4,ml_guess=True,
-                 num_steps=100,burn_in=0.1,num_threads=1):
+                 num_steps=100,burn_in=0.1,num_threads=1,vectorize=None,
+                 target_ess=None,check_every=100,max_steps=10000,tau_rtol=0.01,
+                 min_tau_multiple=50):
         """
         Initialize the bayesian fitter
 
@@ -38,8 +74,40 @@ class BayesianFitter(Fitter):
         burn_in : float between 0 and 1
             fraction of samples to discard from the start of the run
         num_threads : int or `"max"`
-            number of threads to use.  if `"max"`, use the total number of 
-            cpus. [NOT YET IMPLEMENTED] 
+            number of processes used to calculate the posterior probability
+            of the walkers.  if `"max"`, use the total number of cpus.  The 
+            model (usually the GlobalFit) is pickled and sent to each process
+            once per fit.
+        vectorize : bool or None
+            calculate the posterior probability of many walkers in one call.
+            The model must then accept a 2d array of parameters (one set per 
+            row) and return one row of calculated values per set, as 
+            GlobalFit._y_calc_into does.  If None, vectorize only if the 
+            model is a GlobalFit method (a method of an object with a 
+            _y_calc_batch method).
+        target_ess : int or None
+            if set, run the chains until they hold about this many 
+            independent samples rather than for num_steps.  Every 
+            check_every steps the integrated autocorrelation time (tau) of 
+            every parameter is estimated with emcee, after dropping a burn in
+            of 2*tau steps (tau from the previous check).  Sampling stops 
+            once tau has changed by less than tau_rtol since the last check,
+            the chains are longer than min_tau_multiple*tau after the burn 
+            in, and the effective sample size, 
+            num_walkers*(steps - burn in)/max(tau), reaches target_ess.  The
+            burn in (2*tau steps) and thinning (tau/2 steps) are then chosen
+            from tau, and num_steps and burn_in are ignored.
+        check_every : int
+            number of steps between convergence checks
+        max_steps : int
+            stop after this many steps even if the chains have not converged.
+            The fit is then reported as unsuccessful.
+        tau_rtol : float
+            largest relative change in tau between checks for tau to be 
+            considered stable
+        min_tau_multiple : float
+            minimum length of the chains after the burn in, in units of tau,
+            for the estimate of tau to be trusted
         """
 
         Fitter.__init__(self)
@@ -50,43 +118,65 @@ class BayesianFitter(Fitter):
         self._num_steps = num_steps
         self._burn_in = burn_in
 
+        self._target_ess = target_ess
+        self._check_every = check_every
+        self._max_steps = max_steps
+        self._tau_rtol = tau_rtol
+        self._min_tau_multiple = min_tau_multiple
+        self._diagnostics = {}
+
+        self._vectorize = vectorize
+        self._vectorized = False
         self._num_threads = num_threads
         if self._num_threads == "max":
             self._num_threads = multiprocessing.cpu_count()
 
-        if not type(self._num_threads) == int and self._num_threads > 0:
+        if type(self._num_threads) != int or self._num_threads < 1:
             err = "num_threads must be 'max' or a positive integer\n"
             raise ValueError(err)
 
-        if self._num_threads != 1:
-            err = "multithreading has not yet been (fully) implemented.\n"
-            raise NotImplementedError(err)
+        self._log_jacobian = None
 
         self.fit_type = "bayesian"
 
     def ln_prior(self,param):
         """
         Log prior of fit parameters.  Priors are uniform between bounds and 
-        set to -np.inf outside of bounds.
+        set to -np.inf outside of bounds.  If the fit was given a log 
+        jacobian (parameters fit in a transformed space), it is added so the
+        prior is uniform in the untransformed parameters.
 
         Parameters
         ----------
 
         param : array of floats
-            parameters to fit
+            parameters to fit, or a 2d array with one set of parameters per 
+            row
 
         Returns
         -------
 
-        float value for log of priors. 
+        float value for log of priors (an array with one value per row if 
+        param is 2d). 
         """
 
+        param = np.asarray(param)
+
         # If a paramter falls outside of the bounds, make the prior -infinity
-        if np.sum(param < self._bounds[0,:]) > 0 or np.sum(param > self._bounds[1,:]) > 0:
+        # otherwise, uniform
+        outside = np.any((param < self._bounds[0,:]) | (param > self._bounds[1,:]),axis=-1)
+
+        prior = 0.0
+        if self._log_jacobian is not None:
+            prior = self._log_jacobian(param)
+
+        if param.ndim == 2:
+            return np.where(outside,-np.inf,prior)
+
+        if outside:
             return -np.inf
 
-        # otherwise, uniform
-        return 0.0
+        return prior
 
     def ln_prob(self,param):
         """
@@ -96,14 +186,19 @@ class BayesianFitter(Fitter):
         ----------
 
         param : array of floats
-            parameters to fit
+            parameters to fit, or a 2d array with one set of parameters per 
+            row
 
         Returns
         -------
 
-        float value for log posterior proability
+        float value for log posterior proability (an array with one value 
+        per row if param is 2d)
         """
 
+        if np.ndim(param) == 2:
+            return self._ln_prob_vectorized(param)
+
         # Calcualte prior.  If not finite, this solution has an -infinity log 
         # likelihood
         ln_prior = self.ln_prior(param)
@@ -119,7 +214,46 @@ class BayesianFitter(Fitter):
         # log posterior is log prior plus log likelihood 
         return ln_prior + ln_like
 
-    def fit(self,model,parameters,bounds,y_obs,y_err=None,param_names=None):
+    def _ln_prob_vectorized(self,param):
+        """
+        Posterior probability of each row of param, calculating the model 
+        for every row inside the bounds in a single call.
+        """
+
+        param = np.asarray(param,dtype=float)
+
+        ln_prob = self.ln_prior(param)
+        inside = np.isfinite(ln_prob)
+        if not np.any(inside):
+            return ln_prob
+
+        y_calc = np.asarray(self._model(param[inside]))
+        if y_calc.shape != (np.sum(inside),len(self._y_obs)):
+            err = "the model did not return one row of values for each row of\n"
+            err += "parameters.  Use vectorize=False for models that only take\n"
+            err += "one set of parameters.\n"
+            raise ValueError(err)
+
+        r = (self._y_obs - y_calc)/self._y_err
+        ln_like = -0.5*(np.sum(r*r,axis=1) + 2*np.sum(np.log(np.abs(self._y_err))))
+
+        ln_prob[inside] += np.where(np.isfinite(ln_like),ln_like,-np.inf)
+
+        return ln_prob
+
+    def _ln_prob_batch(self,positions):
+        """
+        Posterior probability of each row of positions (used by worker 
+        processes).
+        """
+
+        if self._vectorized:
+            return self._ln_prob_vectorized(positions)
+
+        return [self.ln_prob(p) for p in positions]
+
+    def fit(self,model,parameters,bounds,y_obs,y_err=None,param_names=None,
+            jacobian=None,jac_sparsity=None,x_scale=None,log_jacobian=None):
         """
         Fit the parameters.       
  
@@ -128,7 +262,7 @@ class BayesianFitter(Fitter):
 
         model : callable
             model to fit.  model should take "parameters" as its only argument.
-            this should (usually) be GlobalFit._y_calc
+            this should (usually) be GlobalFit._y_calc_into
         parameters : array of floats
             parameters to be optimized.  usually constructed by GlobalFit._prep_fit
         bounds : list
@@ -140,13 +274,37 @@ class BayesianFitter(Fitter):
             is assigned an error of 1/num_obs 
         param_names : array of str
             names of parameters.  If None, parameters assigned names p0,p1,..pN
+        jacobian : callable or None
+            function taking "parameters" and returning the jacobian of model
+            (num_obs x num_param array).  If None, the jacobian is estimated
+            by finite differences.
+        jac_sparsity : array-like, sparse matrix or None
+            num_obs x num_param pattern of the non-zero entries in the 
+            jacobian (usually built by GlobalFit._prep_fit).  Only used when
+            the jacobian is estimated by finite differences, letting groups
+            of independent parameters be perturbed at once.
+        x_scale : array of floats, "jac" or None
+            characteristic scale of each parameter, passed to least_squares.
+            If None, use least_squares' default (1.0 for every parameter).
+        log_jacobian : callable or None
+            log jacobian of the map from the parameters back to the values
+            they stand for (see Fitter.fit).  It is added to the log prior, so
+            the prior is uniform in the untransformed parameters.  If None, 
+            nothing is added.
         """
 
         self._model = model
         self._y_obs = y_obs
 
+        # Only models known to take 2d arrays of parameters are vectorized by
+        # default
+        self._vectorized = self._vectorize
+        if self._vectorized is None:
+            self._vectorized = hasattr(getattr(model,"__self__",None),"_y_calc_batch")
+
         # Convert the bounds (list of lower and upper lists) into a 2d numpy array
         self._bounds = np.array(bounds)
+        self._log_jacobian = log_jacobian
 
         # If no error is specified, assign the error as 1/N, identical for all
         # points 
@@ -162,7 +320,15 @@ class BayesianFitter(Fitter):
         # Make initial guess (ML or just whatever the paramters sent in were)
         if self._ml_guess:
             fn = lambda *args: -self.weighted_residuals(*args)
-            ml_fit = optimize.least_squares(fn,x0=parameters,bounds=self._bounds)
+            jac = "2-point"
+            if jacobian is not None:
+                jac = lambda *args: jacobian(*args)/self._y_err[:,np.newaxis]
+            elif jac_sparsity is not None:
+                fn, jac = self._grouped_jacobian(fn,jac_sparsity,self._bounds)
+            if x_scale is None:
+                x_scale = 1.0
+            ml_fit = optimize.least_squares(fn,x0=parameters,bounds=self._bounds,jac=jac,
+                                            x_scale=x_scale)
             self._initial_guess = np.copy(ml_fit.x)
         else:
             self._initial_guess = np.copy(parameters)
@@ -176,14 +342,42 @@ class BayesianFitter(Fitter):
         pos = [self._initial_guess + np.random.randn(ndim)*perturb_size
                for i in range(self._num_walkers)]
 
-        # Sample using walkers
-        self._fit_result = emcee.EnsembleSampler(self._num_walkers, ndim, self.ln_prob,
-                                                 threads=self._num_threads)
-        self._fit_result.run_mcmc(pos, self._num_steps)
+        # Sample using walkers.  Workers get a copy of the fitter, so drop the
+        # sampler from any previous fit before starting them.  emcee passes
+        # every walker to a vectorized ln_prob at once.
+        self._fit_result = None
+        pool = None
+        ln_prob = self.ln_prob
+        vectorize = self._vectorized
+        if self._num_threads > 1:
+            pool = _WalkerPool(self,self._num_threads)
+            ln_prob = pool.ln_prob
+            vectorize = True
+
+        try:
+            self._fit_result = emcee.EnsembleSampler(self._num_walkers, ndim, ln_prob,
+                                                     vectorize=vectorize)
+            if self._target_ess is None:
+                self._fit_result.run_mcmc(pos, self._num_steps)
+                converged = True
+            else:
+                converged = self._run_adaptive(pos)
+        finally:
+            if pool is not None:
+                pool.close()
+
+        # The sampler keeps the pool's ln_prob, which cannot be pickled
+        if pool is not None:
+            self._fit_result.log_prob_fn = None
 
         # Create list of samples
-        to_discard = int(round(self._burn_in*self._num_steps,0))
-        self._samples = self._fit_result.chain[:,to_discard:,:].reshape((-1,ndim))
+        if self._target_ess is None:
+            to_discard = int(round(self._burn_in*self._num_steps,0))
+            self._samples = self._fit_result.chain[:,to_discard:,:].reshape((-1,ndim))
+        else:
+            chain = self._fit_result.get_chain(discard=self._diagnostics["Burn in steps"],
+                                               thin=self._diagnostics["Thinning"])
+            self._samples = np.swapaxes(chain,0,1).reshape((-1,ndim))
         self._lnprob = self._fit_result.lnprobability[:,:].reshape(-1)
 
         # Get mean and standard deviation 
@@ -200,7 +394,70 @@ class BayesianFitter(Fitter):
 
         self._ninetyfive = np.array(self._ninetyfive)
 
-        self._success = True
+        self._success = converged
+
+    def _run_adaptive(self,pos):
+        """
+        Run the sampler until the effective sample size reaches target_ess 
+        with a stable autocorrelation time, or until max_steps.  Records the
+        diagnostics and the burn in and thinning chosen from the 
+        autocorrelation time.  Returns whether the chains converged.
+        """
+
+        converged = False
+        old_tau = np.inf
+        tau = None
+        for state in self._fit_result.sample(pos,iterations=self._max_steps):
+
+            steps = self._fit_result.iteration
+            if steps % self._check_every != 0:
+                continue
+
+            tau = self._autocorr_time(tau)
+            burn_in = int(np.ceil(2*tau))
+            ess = self._num_walkers*max(steps - burn_in,0)/tau
+
+            stable = np.abs(old_tau - tau) < self._tau_rtol*tau
+            long_enough = steps - burn_in > self._min_tau_multiple*tau
+            old_tau = tau
+            if stable and long_enough and ess >= self._target_ess:
+                converged = True
+                break
+
+        steps = self._fit_result.iteration
+        if tau is None or steps % self._check_every != 0:
+            tau = self._autocorr_time(tau)
+
+        # Keep at least one step if the chains never got past the burn in
+        burn_in = min(int(np.ceil(2*tau)),steps - 1)
+        thin = max(int(tau/2),1)
+
+        self._diagnostics = {}
+        self._diagnostics["Steps run"] = steps
+        self._diagnostics["Autocorrelation time"] = float(tau)
+        self._diagnostics["Effective sample size"] = float(self._num_walkers*(steps - burn_in)/tau)
+        self._diagnostics["Burn in steps"] = burn_in
+        self._diagnostics["Thinning"] = thin
+        self._diagnostics["Converged"] = converged
+
+        return converged
+
+    def _autocorr_time(self,tau=None):
+        """
+        Largest integrated autocorrelation time of the parameters in the 
+        chains run so far.  A burn in of 2*tau steps (tau from the previous
+        estimate, but at most half of the chains) is dropped first.
+        """
+
+        chain = self._fit_result.get_chain()
+
+        burn_in = 0
+        if tau is not None:
+            burn_in = min(int(np.ceil(2*tau)),len(chain)//2)
+
+        # The length of the chains is checked by the caller
+        return np.max(emcee.autocorr.integrated_time(chain[burn_in:],c=5,tol=0,
+                                                     quiet=True))
 
     @property
     def fit_info(self):
@@ -212,10 +469,16 @@ class BayesianFitter(Fitter):
         output["Num walkers"] = self._num_walkers
         output["Initial walker spread"] = self._initial_walker_spread
         output["Use ML guess"] = self._ml_guess
-        output["Num steps"] = self._num_steps
-        output["Burn in"] = self._burn_in
+        if self._target_ess is None:
+            output["Num steps"] = self._num_steps
+            output["Burn in"] = self._burn_in
+        else:
+            output["Target ESS"] = self._target_ess
+            for k, v in self._diagnostics.items():
+                output[k] = v
         output["Final sample number"] = len(self._samples[:,0])
         output["Num threads"] = self._num_threads
+        output["Vectorized"] = self._vectorized
         
         return output
 
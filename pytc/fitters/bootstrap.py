@@ -5,19 +5,21 @@ Fitter subclass for performing bootstrap fits.
 __author__ = "Michael J. Harms"
 __date__ = "2017-05-11"
 
-from .base import Fitter
+from .base import Fitter, _worker_pool, _worker_function
 
 import numpy as np
 import scipy.optimize
 
-import sys
+import sys, multiprocessing
 
 class BootstrapFitter(Fitter):
     """
     Perform the fit many times, sampling from uncertainty in each measured heat. 
     """
 
-    def __init__(self,num_bootstrap=100,perturb_size=1.0,exp_err=False,verbose=False):
+    def __init__(self,num_bootstrap=100,perturb_size=1.0,exp_err=False,verbose=False,
+                 num_workers=1,seed=None,warm_start=False,max_nfev=None,
+                 ftol=1e-8,xtol=1e-8,gtol=1e-8):
         """
         Perform the fit many times, sampling from uncertainty in each measured
         heat. 
@@ -35,18 +37,60 @@ class BootstrapFitter(Fitter):
             perturb_size.
         verbose : bool
             Give verbose output.
+        num_workers : int or `"max"`
+            number of processes used to fit replicates.  if `"max"`, use the 
+            total number of cpus.  The model (usually the GlobalFit) is 
+            pickled and sent to each process.
+        seed : int, np.random.SeedSequence or None
+            seed for the random perturbations.  Each replicate draws from its
+            own stream spawned from this seed, so the samples do not depend 
+            on num_workers.  If None, a fresh seed is drawn for each fit and
+            reported in fit_info.
+        warm_start : bool or "scale"
+            If True, first fit the unperturbed data and start every replicate
+            from that optimum rather than from the initial guesses.  If 
+            "scale", also give each replicate the parameter scaling implied
+            by the jacobian at the optimum (least_squares' x_scale="jac").
+        max_nfev : int or None
+            maximum number of function evaluations for each replicate.  If 
+            None, use least_squares' default.
+        ftol, xtol, gtol : float
+            least_squares tolerances for each replicate.  Replicates that 
+            start from the optimum can usually use looser tolerances than 
+            the initial fit.
         """
         
         Fitter.__init__(self)
 
+        if num_workers == "max":
+            num_workers = multiprocessing.cpu_count()
+
+        if type(num_workers) != int or num_workers < 1:
+            err = "num_workers must be 'max' or a positive integer\n"
+            raise ValueError(err)
+
+        if warm_start not in [False,True,"scale"]:
+            err = "warm_start must be True, False, or \"scale\"\n"
+            raise ValueError(err)
+
         self._num_bootstrap = num_bootstrap
         self._perturb_size = perturb_size
         self._exp_err = exp_err
         self._verbose = verbose
+        self._num_workers = num_workers
+        self._seed = seed
+        self._entropy = None
+        self._warm_start = warm_start
+        self._max_nfev = max_nfev
+        self._ftol = ftol
+        self._xtol = xtol
+        self._gtol = gtol
+        self._nfev = None
 
         self.fit_type = "bootstrap"
 
-    def fit(self,model,parameters,bounds,y_obs,y_err=None,param_names=None):
+    def fit(self,model,parameters,bounds,y_obs,y_err=None,param_names=None,
+            jacobian=None,jac_sparsity=None,x_scale=None,log_jacobian=None):
         """
         Fit the parameters.       
  
@@ -55,7 +99,7 @@ class BootstrapFitter(Fitter):
 
         model : callable
             model to fit.  model should take "parameters" as its only argument.
-            this should (usually) be GlobalFit._y_calc
+            this should (usually) be GlobalFit._y_calc_into
         parameters : array of floats
             parameters to be optimized.  usually constructed by GlobalFit._prep_fit
         bounds : list
@@ -67,6 +111,20 @@ class BootstrapFitter(Fitter):
             is assigned an error of 1/num_obs 
         param_names : array of str
             names of parameters.  If None, parameters assigned names p0,p1,..pN
+        jacobian : callable or None
+            function taking "parameters" and returning the jacobian of model
+            (num_obs x num_param array).  If None, the jacobian is estimated
+            by finite differences.
+        jac_sparsity : array-like, sparse matrix or None
+            num_obs x num_param pattern of the non-zero entries in the 
+            jacobian (usually built by GlobalFit._prep_fit).  Only used when
+            the jacobian is estimated by finite differences, letting groups
+            of independent parameters be perturbed at once.
+        x_scale : array of floats, "jac" or None
+            characteristic scale of each parameter, passed to least_squares.
+            If None, use least_squares' default (1.0 for every parameter).
+        log_jacobian : callable or None
+            ignored; least squares fits have no prior.
         """
    
         self._model = model
@@ -87,27 +145,65 @@ class BootstrapFitter(Fitter):
         self._samples = np.zeros((self._num_bootstrap,len(parameters)),
                                  dtype=float)
 
-        original_y_obs = np.copy(self._y_obs)
+        # Everything a replicate needs, so it can be fit here or in a worker
+        self._parameters = np.array(parameters,dtype=float)
+        self._original_y_obs = np.copy(self._y_obs)
+        self._noise = y_err
+        self._jacobian = jacobian
+        self._jac_sparsity = jac_sparsity
+        self._x_scale = x_scale
+        if x_scale is None:
+            self._x_scale = 1.0
+        self._functions = None
+
+        # Replicates start from the initial guesses, or from the optimum of 
+        # the unperturbed data
+        self._start = self._parameters
+        self._replicate_x_scale = self._x_scale
+        self._start_nfev = 0
+        if self._warm_start:
+            fun, jac = self._replicate_functions()
+            fit = scipy.optimize.least_squares(fun,
+                                               x0=self._parameters,
+                                               bounds=self._bounds,
+                                               jac=jac,
+                                               x_scale=self._x_scale)
+            self._start = fit.x
+            self._start_nfev = fit.nfev
+
+            if self._warm_start == "scale":
+                norms = np.sqrt(np.sum(fit.jac*fit.jac,axis=0))
+                norms[norms == 0] = 1.0
+                self._replicate_x_scale = 1/norms
+
+        # One independent random stream per replicate
+        seed_seq = self._seed
+        if not isinstance(seed_seq,np.random.SeedSequence):
+            seed_seq = np.random.SeedSequence(seed_seq)
+        self._entropy = seed_seq.entropy
+        seeds = seed_seq.spawn(self._num_bootstrap)
 
         # Go through bootstrap reps
-        for i in range(self._num_bootstrap):
-
-            if self._verbose and i != 0 and i % 100 == 0:
-                print("Bootstrap {} of {}".format(i,self._num_bootstrap))
-                sys.stdout.flush()
-
-            # Add random error to each sample
-            self._y_obs = original_y_obs + np.random.normal(0.0,y_err)
-            
-            # Do the fit
-            fit = scipy.optimize.least_squares(self.unweighted_residuals,
-                                               x0=parameters,
-                                               bounds=bounds)
-    
-            # record the fit results
-            self._samples[i,:] = fit.x
+        if self._num_workers > 1 and self._num_bootstrap > 1:
+            with _worker_pool(self,self._num_workers) as executor:
+                chunksize = max(1,self._num_bootstrap//(4*self._num_workers))
+                replicates = []
+                for i, result in enumerate(executor.map(_worker_function("_replicate"),
+                                                        seeds,chunksize=chunksize)):
+                    self._report_progress(i)
+                    replicates.append(result)
+        else:
+            replicates = []
+            for i in range(self._num_bootstrap):
+                self._report_progress(i)
+                replicates.append(self._replicate(seeds[i]))
 
-        self._y_obs = np.copy(original_y_obs)
+        self._nfev = np.zeros(self._num_bootstrap,dtype=int)
+        for i, (x, nfev) in enumerate(replicates):
+            self._samples[i,:] = x
+            self._nfev[i] = nfev
+
+        self._y_obs = np.copy(self._original_y_obs)
 
         self._fit_result = self._samples
 
@@ -127,6 +223,73 @@ class BootstrapFitter(Fitter):
          
         self._success = True 
 
+    def _report_progress(self,i):
+        """
+        Print progress every 100 replicates if verbose.
+        """
+
+        if self._verbose and i != 0 and i % 100 == 0:
+            print("Bootstrap {} of {}".format(i,self._num_bootstrap))
+            sys.stdout.flush()
+
+    def _replicate_functions(self):
+        """
+        Unweighted residual and jacobian functions passed to least_squares.
+        """
+
+        # Residuals are y_obs - y_calc, so their jacobian is -jacobian.  The
+        # functions cannot be pickled, so they are built by each process that
+        # needs them.
+        if self._functions is None:
+            self._functions = (self.unweighted_residuals,"2-point")
+            if self._jacobian is not None:
+                jacobian = self._jacobian
+                self._functions = (self.unweighted_residuals,
+                                   lambda *args: -jacobian(*args))
+            elif self._jac_sparsity is not None:
+                self._functions = self._grouped_jacobian(self.unweighted_residuals,
+                                                         self._jac_sparsity,
+                                                         self._bounds)
+
+        return self._functions
+
+    def _replicate(self,seed):
+        """
+        Fit one bootstrap replicate, perturbing the observations with random
+        error drawn from the stream seeded by seed.  Returns the fit 
+        parameters and the number of function evaluations used.
+        """
+
+        fun, jac = self._replicate_functions()
+
+        # Add random error to each sample
+        rng = np.random.default_rng(seed)
+        self._y_obs = self._original_y_obs + rng.normal(0.0,self._noise)
+
+        # Do the fit
+        fit = scipy.optimize.least_squares(fun,
+                                           x0=self._start,
+                                           bounds=self._bounds,
+                                           jac=jac,
+                                           x_scale=self._replicate_x_scale,
+                                           max_nfev=self._max_nfev,
+                                           ftol=self._ftol,
+                                           xtol=self._xtol,
+                                           gtol=self._gtol)
+
+        return fit.x, fit.nfev
+
+    def __getstate__(self):
+        """
+        Residual and jacobian functions built by the fitter cannot be pickled;
+        they are rebuilt when next needed.
+        """
+
+        state = self.__dict__.copy()
+        state["_functions"] = None
+
+        return state
+
     @property
     def fit_info(self):
         """
@@ -138,6 +301,10 @@ class BootstrapFitter(Fitter):
         output["Num bootstrap"] = self._num_bootstrap
         output["Perturb size"] = self._perturb_size
         output["Use experimental error"] = self._exp_err
+        output["Seed"] = self._entropy
+        output["Warm start"] = self._warm_start
+        if self._nfev is not None:
+            output["Mean replicate nfev"] = np.mean(self._nfev)
 
         return output
 
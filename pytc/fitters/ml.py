@@ -30,7 +30,8 @@ class MLFitter(Fitter):
        
         self.fit_type = "maximum likelihood"    
 
-    def fit(self,model,parameters,bounds,y_obs,y_err,param_names=None):
+    def fit(self,model,parameters,bounds,y_obs,y_err,param_names=None,
+            jacobian=None,jac_sparsity=None,x_scale=None,log_jacobian=None):
         """
         Fit the parameters.       
  
@@ -39,7 +40,7 @@ class MLFitter(Fitter):
 
         model : callable
             model to fit.  model should take "parameters" as its only argument.
-            this should (usually) be GlobalFit._y_calc
+            this should (usually) be GlobalFit._y_calc_into
         parameters : array of floats
             parameters to be optimized.  usually constructed by GlobalFit._prep_fit
         bounds : list
@@ -51,6 +52,20 @@ class MLFitter(Fitter):
             is assigned an error of 1/num_obs 
         param_names : array of str
             names of parameters.  If None, parameters assigned names p0,p1,..pN
+        jacobian : callable or None
+            function taking "parameters" and returning the jacobian of model
+            (num_obs x num_param array).  If None, the jacobian is estimated
+            by finite differences.
+        jac_sparsity : array-like, sparse matrix or None
+            num_obs x num_param pattern of the non-zero entries in the 
+            jacobian (usually built by GlobalFit._prep_fit).  Only used when
+            the jacobian is estimated by finite differences, letting groups
+            of independent parameters be perturbed at once.
+        x_scale : array of floats, "jac" or None
+            characteristic scale of each parameter, passed to least_squares.
+            If None, use least_squares' default (1.0 for every parameter).
+        log_jacobian : callable or None
+            ignored; least squares fits have no prior.
         """
 
         self._model = model
@@ -71,9 +86,20 @@ class MLFitter(Fitter):
 
         # Do the actual fit 
         fn = lambda *args: -self.weighted_residuals(*args)
+        jac = "2-point"
+        if jacobian is not None:
+            jac = lambda *args: jacobian(*args)/self._y_err[:,np.newaxis]
+        elif jac_sparsity is not None:
+            fn, jac = self._grouped_jacobian(fn,jac_sparsity,self._bounds)
+
+        if x_scale is None:
+            x_scale = 1.0
+
         self._fit_result = optimize.least_squares(fn,
                                                   x0=parameters,
-                                                  bounds=self._bounds)
+                                                  bounds=self._bounds,
+                                                  jac=jac,
+                                                  x_scale=x_scale)
         self._estimate = self._fit_result.x
 
         # Extract standard error on the fit parameter from the covariance
@@ -82,6 +108,7 @@ class MLFitter(Fitter):
 
         J = self._fit_result.jac
         cov = np.linalg.inv(2*np.dot(J.T,J))
+        self._covariance = cov
 
         self._stdev = np.sqrt(np.diagonal(cov)) #variance)
 
@@ -0,0 +1,374 @@
+__description__ = \
+"""
+Fitter subclass that solves the least squares problem one experiment block at
+a time, eliminating local parameters with a Schur complement.
+"""
+
+from .base import Fitter
+
+import numpy as np
+import scipy.stats
+import scipy.sparse
+import scipy.optimize as optimize
+
+class SchurFitter(Fitter):
+    """
+    Fit the model to the data using a Levenberg-Marquardt iteration that
+    exploits the block structure of a global fit.
+
+    Parameters that only affect one experiment (local parameters) are
+    eliminated from each damped Gauss-Newton step with a Schur complement, so
+    each iteration solves one small system per experiment plus one system
+    for the parameters shared between experiments (global parameters).  The
+    cost of an iteration grows linearly with the number of experiments,
+    rather than cubically with the total number of parameters as it does for
+    MLFitter.
+
+    The blocks are read from the jac_sparsity pattern built by GlobalFit:
+    observations whose rows have the same non-zero pattern form a block,
+    parameters that touch a single block are local to it and all other
+    parameters are global.  Bounds are enforced by clipping each step.
+
+    Standard deviation and ninety-five percent confidence intervals are
+    estimated from the jacobian as in MLFitter.  Only the diagonal of the
+    covariance matrix is calculated.
+    """
+
+    def __init__(self,max_iter=200,ftol=1e-10,xtol=1e-10,gtol=1e-10,
+                 initial_lambda=1e-3):
+        """
+        Initialize the fitter.
+
+        Parameters
+        ----------
+
+        max_iter : int
+            maximum number of (accepted or rejected) Levenberg-Marquardt steps
+        ftol : float
+            stop when a step lowers the cost by less than ftol*cost
+        xtol : float
+            stop when the step is smaller than xtol*(xtol + |parameters|)
+        gtol : float
+            stop when the largest gradient entry is below gtol
+        initial_lambda : float
+            starting Levenberg-Marquardt damping
+        """
+
+        Fitter.__init__(self)
+
+        self._max_iter = max_iter
+        self._ftol = ftol
+        self._xtol = xtol
+        self._gtol = gtol
+        self._initial_lambda = initial_lambda
+
+        self.fit_type = "maximum likelihood (schur)"
+
+    def fit(self,model,parameters,bounds,y_obs,y_err=None,param_names=None,
+            jacobian=None,jac_sparsity=None,x_scale=None,log_jacobian=None):
+        """
+        Fit the parameters.
+
+        Parameters
+        ----------
+
+        model : callable
+            model to fit.  model should take "parameters" as its only argument.
+            this should (usually) be GlobalFit._y_calc_into
+        parameters : array of floats
+            parameters to be optimized.  usually constructed by GlobalFit._prep_fit
+        bounds : list
+            list of two lists containing lower and upper bounds
+        y_obs : array of floats
+            observations in an concatenated array
+        y_err : array of floats or None
+            standard deviation of each observation.  if None, each observation
+            is assigned an error of 1/num_obs
+        param_names : array of str
+            names of parameters.  If None, parameters assigned names p0,p1,..pN
+        jacobian : callable or None
+            function taking "parameters" and returning the jacobian of model
+            (num_obs x num_param array).  If None, the jacobian is estimated
+            by finite differences.
+        jac_sparsity : array-like, sparse matrix or None
+            num_obs x num_param pattern of the non-zero entries in the
+            jacobian (usually built by GlobalFit._prep_fit).  Defines the
+            experiment blocks.  If None, every parameter is treated as
+            global and the fit is an ordinary Levenberg-Marquardt fit.
+        x_scale : array of floats, "jac" or None
+            ignored; the damping is always scaled by the diagonal of J^T J.
+            Accepted so the fitter can be used with warm starts.
+        log_jacobian : callable or None
+            ignored; least squares fits have no prior.
+        """
+
+        self._model = model
+        self._bounds = bounds
+        self._y_obs = y_obs
+
+        # If no error is specified, assign the error as 1/N, identical for all
+        # points
+        self._y_err = y_err
+        if y_err is None:
+            self._y_err = np.array([1/len(self._y_obs) for i in range(len(self._y_obs))])
+
+        if param_names is None:
+            self._param_names = ["p{}".format(i) for i in range(len(parameters))]
+        else:
+            self._param_names = param_names[:]
+
+        lower = np.asarray(self._bounds[0],dtype=float)
+        upper = np.asarray(self._bounds[1],dtype=float)
+
+        fn = lambda *args: -self.weighted_residuals(*args)
+        if jacobian is not None:
+            jac = lambda *args: jacobian(*args)/self._y_err[:,np.newaxis]
+        elif jac_sparsity is not None:
+            fn, jac = self._grouped_jacobian(fn,jac_sparsity,self._bounds,sparse=True)
+        else:
+            fn, jac = self._grouped_jacobian(fn,np.ones((len(self._y_obs),len(parameters))),
+                                             self._bounds)
+
+        self._blocks, self._global = self._find_blocks(jac_sparsity,
+                                                       len(self._y_obs),
+                                                       len(parameters))
+
+        x = np.clip(np.array(parameters,dtype=float),lower,upper)
+        r = fn(x)
+        cost = 0.5*np.dot(r,r)
+        lam = self._initial_lambda
+        nfev = 1
+        njev = 0
+
+        status = 0
+        message = "maximum number of iterations reached"
+        nit = 0
+        new_jacobian = True
+        while nit < self._max_iter:
+
+            if new_jacobian:
+                J = jac(x)
+                njev += 1
+                system = self._normal_equations(J,r)
+                grad = system[-1]
+                if np.max(np.abs(grad)) < self._gtol:
+                    status = 1
+                    message = "gradient tolerance reached"
+                    break
+
+            nit += 1
+            step = self._solve(system,lam)
+            x_new = np.clip(x + step,lower,upper)
+            if np.linalg.norm(x_new - x) < self._xtol*(self._xtol + np.linalg.norm(x)):
+                status = 3
+                message = "step tolerance reached"
+                break
+
+            r_new = fn(x_new)
+            cost_new = 0.5*np.dot(r_new,r_new)
+            nfev += 1
+
+            # Rejected step: damp harder and try again with the same jacobian
+            if not np.isfinite(cost_new) or cost_new >= cost:
+                new_jacobian = False
+                lam = lam*4
+                if lam > 1e16:
+                    status = -1
+                    message = "could not find a step that lowers the cost"
+                    break
+                continue
+
+            reduction = cost - cost_new
+            x, r, cost = x_new, r_new, cost_new
+            lam = max(lam/3,1e-12)
+            new_jacobian = True
+
+            if reduction < self._ftol*cost:
+                status = 2
+                message = "cost tolerance reached"
+                break
+
+        self._fit_result = optimize.OptimizeResult(x=x,cost=cost,fun=r,
+                                                   nfev=nfev,njev=njev,nit=nit,
+                                                   status=status,message=message,
+                                                   success=status > 0)
+        self._estimate = x
+
+        # Extract standard error on the fit parameter from the covariance
+        N = len(self._y_obs)
+        P = len(x)
+
+        variance = self._covariance_diagonal(self._normal_equations(jac(x),r))
+        self._stdev = np.sqrt(variance/2)
+
+        # 95% confidence intervals from standard error
+        z = scipy.stats.t(N-P-1).ppf(0.975)
+        c1 = self._estimate - z*self._stdev
+        c2 = self._estimate + z*self._stdev
+
+        self._ninetyfive = []
+        for i in range(P):
+            self._ninetyfive.append([c1[i],c2[i]])
+        self._ninetyfive = np.array(self._ninetyfive)
+
+        self._success = self._fit_result.success
+
+    def _find_blocks(self,jac_sparsity,num_obs,num_param):
+        """
+        Split the observations and parameters into blocks using the jacobian
+        sparsity pattern.  Returns a list of (rows,local_columns) tuples, one
+        per block, and an array of global columns.
+        """
+
+        if jac_sparsity is None:
+            return [(np.arange(num_obs),np.zeros(0,dtype=int))], np.arange(num_param)
+
+        pattern = scipy.sparse.csr_matrix(jac_sparsity,dtype=bool)
+        pattern.sort_indices()
+
+        # Rows with the same non-zero columns belong to the same block
+        keys = {}
+        row_block = np.zeros(num_obs,dtype=int)
+        for i in range(num_obs):
+            key = pattern.indices[pattern.indptr[i]:pattern.indptr[i+1]].tobytes()
+            row_block[i] = keys.setdefault(key,len(keys))
+
+        # Columns touching one block are local to it
+        pattern = pattern.tocsc()
+        pattern.sort_indices()
+        col_block = np.full(num_param,-1,dtype=int)
+        for i in range(num_param):
+            touched = np.unique(row_block[pattern.indices[pattern.indptr[i]:pattern.indptr[i+1]]])
+            if len(touched) == 1:
+                col_block[i] = touched[0]
+
+        blocks = []
+        for b in range(len(keys)):
+            blocks.append((np.flatnonzero(row_block == b),np.flatnonzero(col_block == b)))
+
+        return blocks, np.flatnonzero(col_block == -1)
+
+    def _normal_equations(self,J,r):
+        """
+        Build the pieces of J^T J and J^T r for each block.  Returns a list of
+        (A,B,g) tuples (local-local, local-global and local gradient for each
+        block), the global-global matrix and the full gradient.
+        """
+
+        if scipy.sparse.issparse(J):
+            J = J.tocsr()
+            take = lambda rows,cols: J[rows][:,cols].toarray()
+        else:
+            take = lambda rows,cols: J[np.ix_(rows,cols)]
+
+        num_global = len(self._global)
+        C = np.zeros((num_global,num_global),dtype=float)
+        grad = np.zeros(J.shape[1],dtype=float)
+
+        pieces = []
+        for rows, local in self._blocks:
+
+            J_local = take(rows,local)
+            J_global = take(rows,self._global)
+            r_block = r[rows]
+
+            A = np.dot(J_local.T,J_local)
+            B = np.dot(J_local.T,J_global)
+            g = np.dot(J_local.T,r_block)
+
+            C += np.dot(J_global.T,J_global)
+            grad[local] = g
+            grad[self._global] += np.dot(J_global.T,r_block)
+
+            pieces.append((A,B,g))
+
+        return pieces, C, grad
+
+    def _solve(self,system,lam):
+        """
+        Solve the damped normal equations (J^T J + lam*D) step = -J^T r,
+        eliminating the local parameters of each block.  D is the diagonal
+        of J^T J.
+        """
+
+        pieces, C, grad = system
+
+        damp = lambda M: M + lam*np.diag(np.maximum(np.diagonal(M),1e-12))
+
+        g_global = grad[self._global]
+        S = damp(C)
+        rhs = -g_global
+
+        eliminated = []
+        for A, B, g in pieces:
+            A = damp(A)
+            A_inv_B = np.linalg.solve(A,B)
+            A_inv_g = np.linalg.solve(A,g)
+            S -= np.dot(B.T,A_inv_B)
+            rhs += np.dot(B.T,A_inv_g)
+            eliminated.append((A_inv_B,A_inv_g))
+
+        step = np.zeros(len(grad),dtype=float)
+        if len(self._global) > 0:
+            step[self._global] = np.linalg.solve(S,rhs)
+
+        for (rows, local), (A_inv_B, A_inv_g) in zip(self._blocks,eliminated):
+            step[local] = -A_inv_g - np.dot(A_inv_B,step[self._global])
+
+        return step
+
+    def _covariance_diagonal(self,system):
+        """
+        Diagonal of (J^T J)^-1, built from the inverse of each local block and
+        of the Schur complement for the global parameters.
+        """
+
+        pieces, C, grad = system
+
+        S = np.array(C)
+        inverted = []
+        for A, B, g in pieces:
+            A_inv = self._scaled_inverse(A)
+            A_inv_B = np.dot(A_inv,B)
+            S -= np.dot(B.T,A_inv_B)
+            inverted.append((A_inv,A_inv_B))
+
+        S_inv = self._scaled_inverse(S)
+
+        variance = np.zeros(len(grad),dtype=float)
+        variance[self._global] = np.diagonal(S_inv)
+        for (rows, local), (A_inv, A_inv_B) in zip(self._blocks,inverted):
+            variance[local] = np.diagonal(A_inv) + \
+                              np.einsum("ij,jk,ik->i",A_inv_B,S_inv,A_inv_B)
+
+        return variance
+
+    def _scaled_inverse(self,M):
+        """
+        Pseudo-inverse of the symmetric matrix M.  M is scaled to a unit 
+        diagonal first, so parameters on very different scales (such as K 
+        and fx_competent) are not lost to the pseudo-inverse cutoff.
+        """
+
+        d = np.sqrt(np.abs(np.diagonal(M)))
+        d[d == 0] = 1.0
+        scale = np.outer(d,d)
+
+        return np.linalg.pinv(M/scale,hermitian=True)/scale
+
+    @property
+    def fit_info(self):
+        """
+        Return information about the fit.
+        """
+
+        output = {}
+        try:
+            output["Num iterations"] = self._fit_result.nit
+            output["Num blocks"] = len(self._blocks)
+            output["Num global params"] = len(self._global)
+            output["Stop reason"] = self._fit_result.message
+        except AttributeError:
+            pass
+
+        return output
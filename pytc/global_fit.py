@@ -14,10 +14,97 @@ from . global_connectors import GlobalConnector
 import numpy as np
 import scipy
 import scipy.optimize as optimize
+import scipy.sparse
 from matplotlib import pyplot as plt
 from matplotlib import gridspec
 
-import copy, inspect, warnings, sys, datetime
+import copy, inspect, warnings, sys, datetime, multiprocessing, os, json, importlib
+import concurrent.futures
+
+# Version of the format written by GlobalFit.save
+SAVE_FORMAT_VERSION = 1
+
+# Fitter arrays with more elements than this (e.g. samples) are saved as their
+# own .npy files so they can be memory-mapped on load
+SAVE_MMAP_SIZE = 100000
+
+def _object_path(cls):
+    """
+    Importable name of a class ("module.Class").
+    """
+
+    return "{}.{}".format(cls.__module__,cls.__name__)
+
+def _import_object(path):
+    """
+    Import an object given its importable name ("module.Class").
+    """
+
+    module, name = path.rsplit(".",1)
+
+    return getattr(importlib.import_module(module),name)
+
+def _plain(value):
+    """
+    Convert value to plain python types that can be written to json, raising
+    TypeError if that is not possible.
+    """
+
+    if value is None or isinstance(value,str):
+        return value
+    if isinstance(value,(bool,np.bool_)):
+        return bool(value)
+    if isinstance(value,(int,np.integer)):
+        return int(value)
+    if isinstance(value,(float,np.floating)):
+        return float(value)
+    if isinstance(value,(list,tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value,dict) and all([type(k) == str for k in value.keys()]):
+        return dict([(k,_plain(v)) for k, v in value.items()])
+
+    err = "{} cannot be saved.\n".format(type(value))
+    raise TypeError(err)
+
+def _object_state(obj,skip=()):
+    """
+    Split the attributes of obj into those that can be written to json and
+    numeric numpy arrays.  Anything else (and attributes in skip) is ignored.
+    """
+
+    attributes = {}
+    arrays = {}
+    for k, v in obj.__dict__.items():
+
+        if k in skip:
+            continue
+
+        if isinstance(v,np.ndarray):
+            if v.dtype != object:
+                arrays[k] = v
+            continue
+
+        try:
+            attributes[k] = _plain(v)
+        except TypeError:
+            pass
+
+    return attributes, arrays
+
+def _restore_object(class_path,attributes,arrays=None):
+    """
+    Create an instance of class_path without calling __init__, restoring
+    attributes written by _object_state.
+    """
+
+    cls = _import_object(class_path)
+
+    obj = cls.__new__(cls)
+    obj.__dict__.update(attributes)
+    if arrays is not None:
+        obj.__dict__.update(arrays)
+
+    return obj
 
 class FitNotRunError(Exception):
     """
@@ -33,13 +120,39 @@ class GlobalFit:
     Class for regressing models against an arbitrary number of ITC experiments.
     """
 
-    def __init__(self):
+    def __init__(self,n_workers=1):
         """
         Set up the main binding model to fit.
+
+        Parameters
+        ----------
+
+        n_workers : int or `"max"`
+            number of threads used to calculate the heats of experiments 
+            whose parameters changed.  if `"max"`, use the total number of 
+            cpus.  Each experiment has its own model, so experiments can be
+            calculated concurrently; the compiled binding polynomial releases
+            the GIL while it runs.  The threads are started when first 
+            needed and run until close is called (or the with block using 
+            the GlobalFit ends).
         """
 
-        # Objects for holding global parameters
-        self._global_param_keys = []
+        if n_workers == "max":
+            n_workers = multiprocessing.cpu_count()
+
+        if type(n_workers) != int or n_workers < 1:
+            err = "n_workers must be 'max' or a positive integer\n"
+            raise ValueError(err)
+
+        self._n_workers = n_workers
+        self._executor = None
+
+        # Objects for holding global parameters.  _global_params maps each
+        # global parameter (a name or GlobalConnector method) to its 
+        # FitParameter or GlobalConnector, in the order they were created.
+        # _global_param_mapping maps each global parameter to a dictionary of
+        # the experiments linked to it, keyed to the linked experiment 
+        # parameter.  The reverse links are the aliases stored on each model.
         self._global_params = {}
         self._global_param_mapping = {}
 
@@ -47,6 +160,49 @@ class GlobalFit:
         self._expt_dict = {}
         self._expt_list_stable_order = []
 
+        # Parts of the fit layout that _prep_fit has to rebuild
+        self._stale_params = True
+        self._stale_obs = True
+        self._prep_layout_versions = None
+        self._prep_global_layout = None
+        self._prep_obs_versions = None
+
+        # Estimates (keyed by FitParameter) and least_squares scales (keyed by
+        # FitParameter, as (transform,scale)) from previous fits, used to warm
+        # start later fits
+        self._warm_start_values = {}
+        self._warm_start_scales = {}
+
+    def __getstate__(self):
+        """
+        The thread pool cannot be pickled or copied; a new one is created 
+        when it is next needed.
+        """
+
+        state = self.__dict__.copy()
+        state["_executor"] = None
+
+        return state
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self,*args):
+
+        self.close()
+
+    def close(self):
+        """
+        Shut down the threads used to calculate experiments concurrently 
+        (see n_workers).  The GlobalFit can still be used; a new pool is 
+        started when it is next needed.
+        """
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
     def add_experiment(self,experiment):
         """
         Add an experiment to the fit
@@ -63,6 +219,9 @@ class GlobalFit:
         self._expt_dict[name] = experiment
         self._expt_list_stable_order.append(name)
 
+        self._stale_params = True
+        self._stale_obs = True
+
     def remove_experiment(self,experiment):
         """
         Remove an experiment from the analysis.
@@ -75,20 +234,24 @@ class GlobalFit:
 
         expt_name = experiment.experiment_id
 
-        # Go through all global parameters
-        for k in self._global_param_mapping.keys():
+        # Go through the global parameters this experiment links to
+        for expt_param, k in self._expt_dict[expt_name].model.param_aliases.items():
+
+            if k not in self._global_param_mapping:
+                continue
 
-            # If the experiment links to that
-            for expt in self._global_param_mapping[k]:
-                if expt_name == expt[0]:
-                    self._global_param_mapping[k].remove(expt)
+            if self._global_param_mapping[k].get(expt_name) == expt_param:
+                self._global_param_mapping[k].pop(expt_name)
 
-                    if len(self._global_param_mapping[k]) == 0:
-                        self.remove_global(k)
+                if len(self._global_param_mapping[k]) == 0:
+                    self.remove_global(k)
 
         self._expt_dict.pop(expt_name)
         self._expt_list_stable_order.remove(expt_name)
 
+        self._stale_params = True
+        self._stale_obs = True
+
     def link_to_global(self,expt,expt_param,global_param_name):
         """
         Link a local experimental fitting parameter to a global fitting
@@ -117,17 +280,18 @@ class GlobalFit:
             err = "Parameter {} not in experiment {}\n".format(expt_param,expt_name)
             raise ValueError(err)
 
+        self._stale_params = True
+
         # Update the alias from the experiment side
         self._expt_dict[expt_name].model.update_aliases({expt_param:
                                                          global_param_name})
 
         # Update the alias from the global side
         e = self._expt_dict[expt_name]
-        if global_param_name not in self._global_param_keys:
+        if global_param_name not in self._global_params:
 
             # Make new global parameter and create link
-            self._global_param_keys.append(global_param_name)
-            self._global_param_mapping[global_param_name] = [(expt_name,expt_param)]
+            self._global_param_mapping[global_param_name] = {expt_name:expt_param}
 
             # If this is a "dumb" global parameter, store a FitParameter
             # instance with the data in it.
@@ -145,8 +309,8 @@ class GlobalFit:
 
         else:
             # Only add link, but do not make a new global parameter
-            if expt_name not in [m[0] for m in self._global_param_mapping[global_param_name]]:
-                self._global_param_mapping[global_param_name].append((expt_name,expt_param))
+            if expt_name not in self._global_param_mapping[global_param_name]:
+                self._global_param_mapping[global_param_name][expt_name] = expt_param
 
     def unlink_from_global(self,expt,expt_param):
         """
@@ -171,13 +335,16 @@ class GlobalFit:
         global_name = self._expt_dict[expt_name].model.parameters[expt_param].alias
 
         # remove global --> expt link
-        self._global_param_mapping[global_name].remove((expt_name,expt_param))
+        if self._global_param_mapping[global_name].get(expt_name) == expt_param:
+            self._global_param_mapping[global_name].pop(expt_name)
         if len(self._global_param_mapping[global_name]) == 0:
             self.remove_global(global_name)
 
         # remove expt --> global link
         self._expt_dict[expt_name].model.update_aliases({expt_param:None})
 
+        self._stale_params = True
+
     def remove_global(self,global_param_name):
         """
         Remove a global parameter, unlinking all local parameters.
@@ -186,29 +353,23 @@ class GlobalFit:
             global parameter name
         """
 
-        if global_param_name not in self._global_param_keys:
+        if global_param_name not in self._global_params:
             err = "Global parameter {} not defined.\n".format(global_param_name)
             raise ValueError(err)
 
-        # Remove expt->global mapping from each experiment
-        for k in self._global_param_mapping.keys():
-
-            for expt in self._global_param_mapping[k]:
-
-                expt_name = expt[0]
-                expt_params = self._expt_dict[expt_name].model.param_aliases.keys()
-                for p in expt_params:
-                    if self._expt_dict[expt_name].model.param_aliases[p] == global_param_name:
-                        self._expt_dict[expt_name].model.update_aliases({p:None})
-                        break
+        # Remove expt->global mapping from each linked experiment
+        for expt_name, expt_param in self._global_param_mapping[global_param_name].items():
+            model = self._expt_dict[expt_name].model
+            if model.parameters[expt_param].alias == global_param_name:
+                model.update_aliases({expt_param:None})
 
         # Remove global data
-        self._global_param_keys.remove(global_param_name)
         self._global_param_mapping.pop(global_param_name)
         self._global_params.pop(global_param_name)
 
+        self._stale_params = True
 
-    def fit(self,fitter=fitters.MLFitter):
+    def fit(self,fitter=fitters.MLFitter,use_jacobian=True,warm_start=False):
         """
         Public function that performs the fit. 
         
@@ -220,11 +381,29 @@ class GlobalFit:
             maximum-likelihood method.  If the subclass is passed, it is
             initialized with default parameters.  If an instance of the 
             subclass is passed, it will be used as-is. 
-        """
+        use_jacobian : bool
+            If True and every model defines an analytic jacobian, give the 
+            fitter the analytic jacobian of the calculated heats rather than
+            having it estimate the jacobian by finite differences.
+        warm_start : bool or "scale"
+            If True, start each floating parameter from its estimate in the
+            last fit that floated it (rather than its guess).  Parameters 
+            that have not been fit yet start from their guesses.  If "scale",
+            also give least_squares the parameter scaling implied by the last
+            fit's jacobian.
+        """
+
+        if warm_start not in [False,True,"scale"]:
+            err = "warm_start must be True, False, or \"scale\"\n"
+            raise ValueError(err)
 
         # Prep the fit (creating arrays that properly map between the the
         # Mapper instance and numpy arrays for regression).
         self._prep_fit()
+
+        x_scale = None
+        if warm_start:
+            x_scale = self._warm_start(warm_start == "scale")
        
         # If the fitter is not intialized, initialize it 
         if inspect.isclass(fitter):
@@ -232,28 +411,163 @@ class GlobalFit:
         else:
             self._fitter = fitter
 
+        # Use the analytic jacobian if all models can provide one.  Otherwise
+        # the fitter estimates it by finite differences, using the sparsity
+        # of the jacobian to perturb independent parameters together.
+        jacobian = None
+        if use_jacobian and self._analytic_jacobian:
+            jacobian = self._y_jac
+
+        # Fitters with a prior (BayesianFitter) add the log jacobian of the
+        # transforms to it, so the prior is uniform in the parameter values
+        # rather than in the transformed parameters.
+        log_jacobian = None
+        if len(self._flat_transformed) > 0:
+            log_jacobian = self._fit_space_log_jacobian
+
         # Perform the fit.
-        self._fitter.fit(self._y_calc,
+        self._fitter.fit(self._y_calc_into,
                          self._flat_param,
                          self._flat_param_bounds,
                          self._y_obs,
                          self._y_err,
-                         self._flat_param_name)
+                         self._flat_param_name,
+                         jacobian=jacobian,
+                         jac_sparsity=self._jac_sparsity,
+                         x_scale=x_scale,
+                         log_jacobian=log_jacobian)
 
         # Take the output of the fit (numpy arrays) and map it back to specific
         # parameters using Mapper.
         self._parse_fit()
 
+        self._record_warm_start()
+
+    def fit_continuation(self,updates,fitter=fitters.MLFitter,use_jacobian=True,
+                         warm_start="scale"):
+        """
+        Refit along a series of settings, starting each fit from the optimum
+        of the fit before it.
+
+        Parameters
+        ----------
+
+        updates : iterable of callables (or None)
+            before each fit, the next entry is called with this GlobalFit 
+            as its only argument to change the settings (for example
+            lambda g: g.update_fixed("fx",0.9)).  None fits without changes.
+        fitter : subclass of fitters.Fitter or instance
+            fitter to use (see fit).  A subclass is initialized anew for every
+            fit.
+        use_jacobian : bool
+            see fit
+        warm_start : True or "scale"
+            how to warm start each fit (see fit)
+
+        Returns a list with one dictionary per fit, holding its fit_param,
+        fit_stdev, fit_stats and fit_success.
+        """
+
+        results = []
+        for update in updates:
+
+            if update is not None:
+                update(self)
+
+            self.fit(fitter=fitter,use_jacobian=use_jacobian,warm_start=warm_start)
+
+            results.append({"fit_param":self.fit_param,
+                            "fit_stdev":self.fit_stdev,
+                            "fit_stats":self.fit_stats,
+                            "fit_success":self.fit_success})
+
+        return results
+
     def _prep_fit(self):
         """
         Prep the fit, creating all appropriate parameter mappings etc.
+
+        The layout of the fit is cached between calls.  The flat parameter 
+        layout is rebuilt only if experiments were added or removed, links
+        changed, or a local or global parameter was fixed, unfixed or given a
+        new transform (through the update methods or directly on its 
+        FitParameter).  The layout of the observed heats is rebuilt only if experiments were
+        added or removed, or an experiment's heats or starting shot changed.
+        Guesses, bounds, fixed global values and the observed heats themselves
+        (which can be edited in place through ITCExperiment.heats) are cheap
+        to collect and are re-read every time.
+        """
+
+        # Catch changes made directly on the models, global parameters or 
+        # experiments
+        layout_versions = [e.model.layout_version for e in self._expt_dict.values()]
+        global_layout = self._global_layout()
+        obs_versions = [e.obs_version for e in self._expt_dict.values()]
+        if layout_versions != self._prep_layout_versions or \
+           global_layout != self._prep_global_layout:
+            self._stale_params = True
+        if obs_versions != self._prep_obs_versions:
+            self._stale_obs = True
+
+        stale = self._stale_params or self._stale_obs
+
+        if self._stale_params:
+            self._prep_params()
+            self._stale_params = False
+
+        if self._stale_obs:
+            self._prep_obs()
+            self._stale_obs = False
+        else:
+            self._read_obs()
+
+        if stale:
+            self._compile_scatter_plan()
+
+            # _prep_params can fix local parameters, so record the versions
+            # after it has run
+            self._prep_layout_versions = [e.model.layout_version for e in self._expt_dict.values()]
+            self._prep_global_layout = global_layout
+            self._prep_obs_versions = [e.obs_version for e in self._expt_dict.values()]
+
+        self._prep_values()
+
+        # Recalculate every experiment on the next call to _y_calc
+        self._last_param = None
+
+    def _global_layout(self):
+        """
+        Whether each global (and global connector) parameter is fixed, and
+        its transform.  Global parameters belong to no model, so _prep_fit
+        compares this list between calls to catch edits made directly on
+        them.
+        """
+
+        layout = []
+        for k in self._global_param_mapping.keys():
+            if type(k) == str:
+                params = [self._global_params[k]]
+            else:
+                params = self._global_params[k].params.values()
+
+            layout.extend([(p.fixed,p.transform) for p in params])
+
+        return layout
+
+    def _prep_params(self):
+        """
+        Build the flat parameter layout: which parameters float and how they
+        map onto the experiments and global parameters.
         """
 
-        self._flat_param = []
-        self._flat_param_bounds = [[],[]]
         self._flat_param_mapping = []
         self._flat_param_type = []
         self._flat_param_name = []
+        self._flat_param_obj = []
+
+        # (global parameter,experiment,experiment parameter) for fixed global
+        # parameters, whose values are written into the experiments
+        self._fixed_global_links = []
 
         self._flat_global_connectors_seen = []
 
@@ -289,35 +603,20 @@ class GlobalFit:
                 # then skip
                 if enumerate_over[e].fixed:
                     fixed_value = enumerate_over[e].value
-                    for expt, expt_param in self._global_param_mapping[k]:
+                    for expt, expt_param in self._global_param_mapping[k].items():
                         self._expt_dict[expt].model.update_fixed({expt_param:fixed_value}) 
+                        self._fixed_global_links.append((enumerate_over[e],expt,expt_param))
                     continue
 
-                self._flat_param.append(enumerate_over[e].guess)
-                self._flat_param_bounds[0].append(enumerate_over[e].bounds[0])
-                self._flat_param_bounds[1].append(enumerate_over[e].bounds[1])
-                self._flat_param_mapping.append((k,e))
-                self._flat_param_type.append(param_type)
-                self._flat_param_name.append(e)
+                self._append_flat_param(enumerate_over[e],(k,e),param_type,e)
 
                 flat_param_counter += 1
 
         # Go through every experiment
-        units = None
-        y_obs = []
         for k in self._expt_dict.keys():                                       
 
             e = self._expt_dict[k]                                             
 
-            # Sanity check: does every experiment have the same units?
-            if units is None:
-                units = e.units
-            else:
-                if units != e.units:
-                    err = "All experiments should have the same units.\n"
-                    raise ValueError(err)
-
-
             for p in e.model.param_names:
 
                 # If the parameter is fixed, ignore it.
@@ -333,84 +632,544 @@ class GlobalFit:
 
                 # If not fixed or global, append the parameter to the list of
                 # floating parameters
-                self._flat_param.append(e.model.param_guesses[p])
-                self._flat_param_bounds[0].append(e.model.bounds[p][0])
-                self._flat_param_bounds[1].append(e.model.bounds[p][1])
-                self._flat_param_mapping.append((k,p))
-                self._flat_param_type.append(0)
-                self._flat_param_name.append(p)
+                self._append_flat_param(e.model.parameters[p],(k,p),0,p)
 
                 flat_param_counter += 1
 
-        # Create observed y and y err arrays for the likelihood function
-        y_obs = []
-        y_err = []
+        # Analytic jacobians are only usable if every model defines one
+        self._analytic_jacobian = all([e.model.analytic_jacobian
+                                       for e in self._expt_dict.values()])
+
+        # Flat parameters the fitter sees in a transformed space
+        self._flat_transformed = [i for i, fp in enumerate(self._flat_param_obj)
+                                  if fp.transform is not None]
+
+    def _prep_obs(self):
+        """
+        Record which slice of the observed y and y err arrays belongs to each
+        experiment and create the arrays.
+        """
+
+        # Sanity check: does every experiment have the same units?
+        units = None
+        for e in self._expt_dict.values():
+            if units is None:
+                units = e.units
+            else:
+                if units != e.units:
+                    err = "All experiments should have the same units.\n"
+                    raise ValueError(err)
+
+        self._expt_slices = {}
+        num_obs = 0
         for k in self._expt_dict.keys():                                       
-            y_obs.extend(self._expt_dict[k].heats)
-            y_err.extend(self._expt_dict[k].heats_stdev)
+            start = num_obs
+            num_obs += len(self._expt_dict[k].heats)
+            self._expt_slices[k] = slice(start,num_obs)
 
-        self._y_obs = np.array(y_obs)
-        self._y_err = np.array(y_err)
+        self._read_obs()
 
-    def _y_calc(self,param=None):
+        # Buffer that _y_calc_into writes the heats into
+        self._y_calc_buffer = np.zeros(len(self._y_obs),dtype=float)
+
+    def _read_obs(self):
         """
-        Calculate heats using the model given parameters.
+        Create observed y and y err arrays for the likelihood function from
+        the current heats and heat uncertainties of each experiment.
         """
-        
-        # Update parameters
-        for i in range(len(param)):
+
+        keys = list(self._expt_dict.keys())
+        self._y_obs = np.concatenate([np.zeros(0)] + [self._expt_dict[k].heats for k in keys])
+        self._y_err = np.concatenate([np.zeros(0)] + [self._expt_dict[k].heats_stdev for k in keys])
+
+    def _prep_values(self):
+        """
+        Collect the current guesses and bounds of the floating parameters (in
+        the space the fitter works in, see FitParameter.transform) and write 
+        fixed global values into the experiments.
+        """
+
+        self._flat_param = []
+        self._flat_param_bounds = [[],[]]
+        for fit_param in self._flat_param_obj:
+            bounds = fit_param.fit_bounds
+            self._flat_param.append(fit_param.to_fit_space(fit_param.guess))
+            self._flat_param_bounds[0].append(bounds[0])
+            self._flat_param_bounds[1].append(bounds[1])
+
+        for fit_param, expt, expt_param in self._fixed_global_links:
+            self._expt_dict[expt].model.update_fixed({expt_param:fit_param.value})
+
+    def _warm_start(self,reuse_scale=False):
+        """
+        Replace the starting values of the flat parameters with the estimates
+        from previous fits, clipped into the current bounds.  If reuse_scale
+        is True, return the least_squares x_scale from the last fit of each 
+        parameter (1.0 for parameters without one); otherwise return None.
+        """
+
+        x_scale = np.ones(len(self._flat_param_obj),dtype=float)
+        for i, fit_param in enumerate(self._flat_param_obj):
+
+            try:
+                value = self._warm_start_values[fit_param]
+            except KeyError:
+                continue
+
+            value = fit_param.to_fit_space(value)
+            value = min(max(value,self._flat_param_bounds[0][i]),self._flat_param_bounds[1][i])
+            if np.isfinite(value):
+                self._flat_param[i] = value
+
+            # Scales are only meaningful in the same fitting space
+            try:
+                transform, scale = self._warm_start_scales[fit_param]
+                if transform == fit_param.transform:
+                    x_scale[i] = scale
+            except KeyError:
+                pass
+
+        if reuse_scale:
+            return x_scale
+
+        return None
+
+    def _record_warm_start(self):
+        """
+        Record the estimates of the last fit and, if the fitter exposes the
+        final jacobian (as least_squares does), the scale of each parameter
+        used by least_squares' x_scale="jac".
+        """
+
+        estimate = self._from_fit_space(self._fitter.estimate)
+        for fit_param, value in zip(self._flat_param_obj,estimate):
+            self._warm_start_values[fit_param] = value
+
+        try:
+            J = np.asarray(self._fitter.fit_result.jac)
+        except AttributeError:
+            return
+
+        if J.ndim != 2 or J.shape[1] != len(self._flat_param_obj):
+            return
+
+        norms = np.sqrt(np.sum(J*J,axis=0))
+        norms[norms == 0] = 1.0
+        for fit_param, norm in zip(self._flat_param_obj,norms):
+            self._warm_start_scales[fit_param] = (fit_param.transform,1/norm)
+
+    def _compile_scatter_plan(self):
+        """
+        Work out, once per fit, how the flat parameter vector maps onto the
+        models so _y_calc does not have to.  This creates:
+
+        _expt_plan: list with one (experiment_name,model,model_indices,
+            flat_indices,connector_calls) entry per experiment.  Local and 
+            vanilla global parameters are written with
+            model_param_array[model_indices] = param[flat_indices].
+            connector_calls is a list of (connector_function,experiment,
+            model_index) giving the model parameters set by connector 
+            functions.
+        _connector_plan: list of (connector,flat_indices,param_names) used to
+            update the parameters of each GlobalConnector.
+        _dependency: boolean num_flat_param x num_experiments array recording
+            which experiments depend on each flat parameter (directly or via
+            a connector).
+        _jac_sparsity: sparse num_obs x num_flat_param matrix with ones where
+            the jacobian of the heats can be non-zero.
+        """
+
+        expt_names = list(self._expt_dict.keys())
+        expt_position = dict([(k,j) for j, k in enumerate(expt_names)])
+
+        flat_src = dict([(k,[]) for k in expt_names])
+        model_dst = dict([(k,[]) for k in expt_names])
+        connector_params = {}
+
+        self._dependency = np.zeros((len(self._flat_param_obj),len(expt_names)),dtype=bool)
+
+        for i in range(len(self._flat_param_obj)):
 
             # local variable
             if self._flat_param_type[i] == 0:
                 experiment = self._flat_param_mapping[i][0]
                 parameter_name = self._flat_param_mapping[i][1]
-                self._expt_dict[experiment].model.update_values({parameter_name:param[i]})    
+                model = self._expt_dict[experiment].model
+                flat_src[experiment].append(i)
+                model_dst[experiment].append(model.param_names.index(parameter_name))
+                self._dependency[i,expt_position[experiment]] = True
 
             # Vanilla global variable
             elif self._flat_param_type[i] == 1:
                 param_key = self._flat_param_mapping[i][0]
-                for experiment, parameter_name in self._global_param_mapping[param_key]:
-                    self._expt_dict[experiment].model.update_values({parameter_name:param[i]}) 
+                for experiment, parameter_name in self._global_param_mapping[param_key].items():
+                    model = self._expt_dict[experiment].model
+                    flat_src[experiment].append(i)
+                    model_dst[experiment].append(model.param_names.index(parameter_name))
+                    self._dependency[i,expt_position[experiment]] = True
 
             # Global connector global variable
             elif self._flat_param_type[i] == 2:
                 connector = self._flat_param_mapping[i][0].__self__
                 param_name = self._flat_param_mapping[i][1]
-                connector.update_values({param_name:param[i]})
+                if connector not in connector_params:
+                    connector_params[connector] = ([],[])
+                connector_params[connector][0].append(i)
+                connector_params[connector][1].append(param_name)
 
             else:
                 err = "Paramter type {} not recongized.\n".format(self._flat_param_type[i])
                 raise ValueError(err) 
 
-        # Look for connector functions
-        for connector_function in self._global_param_keys:            
+        self._connector_plan = []
+        for connector in connector_params.keys():
+            indices, names = connector_params[connector]
+            self._connector_plan.append((connector,np.array(indices,dtype=int),names))
+
+        # Connector functions, and the experiments that depend on every
+        # parameter of the connector
+        connector_calls = dict([(k,[]) for k in expt_names])
+        for connector_function in self._global_params.keys():
 
             if type(connector_function) == str:
                 continue
 
-            # If this is a method of GlobalConnector...
             if issubclass(connector_function.__self__.__class__,GlobalConnector):
+                connector = connector_function.__self__
+                for expt, param in self._global_param_mapping[connector_function].items():
+                    e = self._expt_dict[expt]
+                    connector_calls[expt].append((connector_function,e,
+                                                  e.model.param_names.index(param)))
+
+                    if connector in connector_params:
+                        self._dependency[connector_params[connector][0],expt_position[expt]] = True
+
+        # Jacobian sparsity: each experiment's rows can only depend on the
+        # flat parameters it depends on.
+        rows = []
+        cols = []
+        for j, k in enumerate(expt_names):
+            expt_rows = np.arange(self._expt_slices[k].start,self._expt_slices[k].stop)
+            expt_cols = np.flatnonzero(self._dependency[:,j])
+            rows.append(np.repeat(expt_rows,len(expt_cols)))
+            cols.append(np.tile(expt_cols,len(expt_rows)))
+
+        rows = np.concatenate(rows) if len(rows) > 0 else np.zeros(0,dtype=int)
+        cols = np.concatenate(cols) if len(cols) > 0 else np.zeros(0,dtype=int)
+        self._jac_sparsity = scipy.sparse.csr_matrix((np.ones(len(rows)),(rows,cols)),
+                                                     shape=(len(self._y_obs),len(self._flat_param_obj)))
+
+        self._expt_plan = []
+        for k in expt_names:
+            self._expt_plan.append((k,self._expt_dict[k].model,
+                                    np.array(model_dst[k],dtype=int),
+                                    np.array(flat_src[k],dtype=int),
+                                    connector_calls[k]))
+
+        # The parameters last written into the models and the model parameter
+        # versions at that point.  None forces everything to be recalculated.
+        self._last_param = None
+        self._expt_versions = [None for k in expt_names]
+
+    def _append_flat_param(self,fit_param,mapping,param_type,name):
+        """
+        Add a floating parameter to the flat parameter layout.  Its guess and
+        bounds are collected by _prep_values.
+        """
+
+        self._flat_param_mapping.append(mapping)
+        self._flat_param_type.append(param_type)
+        self._flat_param_obj.append(fit_param)
+
+        if fit_param.transform is None:
+            self._flat_param_name.append(name)
+        else:
+            self._flat_param_name.append("{}({})".format(fit_param.transform,name))
+
+    def _from_fit_space(self,param):
+        """
+        Map flat parameters (a 1d array, or a 2d array with one row per sample)
+        from the space the fitter works in back to parameter values.
+        """
+
+        if len(self._flat_transformed) == 0:
+            return param
+
+        param = np.array(param,dtype=float)
+        for i in self._flat_transformed:
+            param[...,i] = self._flat_param_obj[i].from_fit_space(param[...,i])
+
+        return param
+
+    def _fit_space_log_jacobian(self,param):
+        """
+        Log of the jacobian determinant of the map from the fitter's space
+        back to parameter values, for flat parameters param (a 1d array, or a
+        2d array with one row per sample).  Only transformed parameters 
+        contribute.
+        """
 
-                # Update experiments with the value spit out by the connector function
-                for expt, param in self._global_param_mapping[connector_function]: 
-                    e = self._expt_dict[expt]                                                 
-                    value = connector_function(e)
-                    self._expt_dict[expt].model.update_values({param:value})                  
+        param = np.asarray(param,dtype=float)
+
+        out = np.zeros(param.shape[:-1],dtype=float)
+        for i in self._flat_transformed:
+            out += self._flat_param_obj[i].fit_space_log_derivative(param[...,i])
+
+        return out[()]
+
+    def _y_calc(self,param=None):
+        """
+        Calculate heats using the model given parameters.  Returns a new 
+        array; see _y_calc_into for how the heats are calculated.  If param
+        is a 2d array (one parameter set per row), the heats for all rows are
+        calculated at once by _y_calc_batch.
+        """
+
+        if np.ndim(param) == 2:
+            return self._y_calc_batch(param)
+
+        return np.array(self._y_calc_into(param))
+
+    def _y_calc_into(self,param=None):
+        """
+        Calculate heats using the model given parameters, writing them into a
+        buffer.  Parameters are written into the models using the plan 
+        compiled by _prep_fit.  This is the model GlobalFit gives the fitters.
+
+        Only experiments that depend on a parameter that changed since the
+        last call (directly or through a GlobalConnector), or whose model 
+        was changed by something else, are recalculated.  When a
+        finite-difference jacobian perturbs one local parameter, only that
+        experiment is recalculated.
+
+        The heats are written into a buffer allocated by _prep_fit, and that
+        buffer is returned, so no array is allocated per call.  The buffer is
+        overwritten by the next call (to _y_calc_into or _y_calc), so copy it
+        if it needs to be kept.  Do not modify it: slices belonging to 
+        experiments that did not change are not rewritten.
+
+        If param is a 2d array (one parameter set per row), the heats for all
+        rows are calculated at once by _y_calc_batch.
+        """
+
+        if np.ndim(param) == 2:
+            return self._y_calc_batch(param)
         
-        # Calculate using the model         
-        y_calc = []
-        for k in self._expt_dict.keys(): 
-            y_calc.extend(self._expt_dict[k].dQ)
+        param = np.array(self._from_fit_space(param),dtype=float)
+
+        # Which flat parameters changed since the last call
+        if self._last_param is None:
+            changed = np.ones(len(param),dtype=bool)
+            dirty = np.ones(len(self._expt_plan),dtype=bool)
+        else:
+            changed = param != self._last_param
+            dirty = np.any(self._dependency[changed],axis=0)
+
+        # Update global connector parameters
+        for connector, indices, names in self._connector_plan:
+            values = param[indices].tolist()
+            if np.any(changed[indices]) or \
+               values != [connector.params[n].value for n in names]:
+                connector.update_values(dict(zip(names,values)))
+
+        to_calc = []
+        for j, plan in enumerate(self._expt_plan):
+
+            expt_name, model, model_indices, flat_indices, connector_calls = plan
+
+            # Skip experiments whose inputs did not change
+            if not dirty[j] and model.param_version == self._expt_versions[j]:
+                continue
+
+            # Local and vanilla global parameters
+            model._update_param_array(model_indices,param[flat_indices])
+
+            # Update experiments with the values spit out by connector functions
+            for connector_function, e, index in connector_calls:
+                model._update_param_array(index,connector_function(e))
+
+            to_calc.append(j)
+
+        # Calculate the heats, concurrently if more than one worker was 
+        # requested.  list() forces any exception to be raised here.
+        if self._n_workers > 1 and len(to_calc) > 1:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._n_workers)
+            list(self._executor.map(self._calc_expt_heats,to_calc))
+        else:
+            for j in to_calc:
+                self._calc_expt_heats(j)
+
+        for j in to_calc:
+            self._expt_versions[j] = self._expt_plan[j][1].param_version
+
+        self._last_param = param
+
+        return self._y_calc_buffer
+
+    def _y_calc_batch(self,param):
+        """
+        Calculate heats for many sets of flat parameters (the rows of param)
+        at once with each model's vectorized dQ_batch.  Returns a new 
+        num_samples x num_obs array.  The values of the model parameters are
+        not changed.
+        """
+
+        model_param = self._batch_model_param(param)
+
+        y_calc = np.zeros((len(param),len(self._y_obs)),dtype=float)
+        for j, plan in enumerate(self._expt_plan):
+            expt_name, model = plan[:2]
+            e = self._expt_dict[expt_name]
+            y_calc[:,self._expt_slices[expt_name]] = model.dQ_batch(model_param[j])[:,e.shot_start:]
+
+        return y_calc
+
+    def _batch_model_param(self,param):
+        """
+        Build the model parameters for many sets of flat parameters (the rows
+        of param).  Returns a list with a num_samples x num_model_params array
+        for each experiment in the plan, with columns in the order of 
+        model.param_names.  The values of the model parameters are not 
+        changed.
+        """
+
+        param = np.array(self._from_fit_space(param),dtype=float)
+        num_samples = param.shape[0]
+
+        # Connector functions are evaluated one parameter set at a time, then
+        # the connector parameters are restored.
+        connector_values = {}
+        if any([len(plan[4]) > 0 for plan in self._expt_plan]):
+
+            current = [(connector,names,[connector.params[n].value for n in names])
+                       for connector, indices, names in self._connector_plan]
+            try:
+                for i in range(num_samples):
+                    for connector, indices, names in self._connector_plan:
+                        connector.update_values(dict(zip(names,param[i,indices].tolist())))
+
+                    for j, plan in enumerate(self._expt_plan):
+                        for connector_function, e, index in plan[4]:
+                            key = (j,index)
+                            if key not in connector_values:
+                                connector_values[key] = np.zeros(num_samples,dtype=float)
+                            connector_values[key][i] = connector_function(e)
+            finally:
+                for connector, names, values in current:
+                    connector.update_values(dict(zip(names,values)))
+
+        model_param = []
+        for j, plan in enumerate(self._expt_plan):
+
+            expt_name, model, model_indices, flat_indices, connector_calls = plan
+
+            # Start from the current values so fixed parameters are kept
+            this_param = np.tile(list(model.param_values.values()),(num_samples,1))
+            this_param[:,model_indices] = param[:,flat_indices]
+            for connector_function, experiment, index in connector_calls:
+                this_param[:,index] = connector_values[(j,index)]
+
+            model_param.append(this_param)
+
+        return model_param
+
+    def _calc_expt_heats(self,j):
+        """
+        Calculate the heats for the jth experiment in the plan, writing them 
+        into that experiment's slice of the _y_calc_into buffer.  Experiments have
+        their own models and disjoint slices, so different experiments can be
+        calculated in different threads.
+        """
+
+        expt_name = self._expt_plan[j][0]
+        self._y_calc_buffer[self._expt_slices[expt_name]] = self._expt_dict[expt_name].dQ
+
+    def _y_jac(self,param):
+        """
+        Calculate the jacobian of the heats with respect to the flat parameters
+        by chaining each model's analytic dQ_jacobian through the global
+        parameter mapping.  GlobalConnector functions are differentiated
+        numerically.
+        """
+
+        # Make sure every model is evaluated at param
+        self._y_calc_into(param)
+
+        expt_jac = {}
+        for k in self._expt_dict.keys():
+            expt_jac[k] = self._expt_dict[k].dQ_jacobian
+
+        J = np.zeros((len(self._y_obs),len(param)),dtype=float)
+        for i in range(len(param)):
+
+            # local variable
+            if self._flat_param_type[i] == 0:
+                experiment = self._flat_param_mapping[i][0]
+                parameter_name = self._flat_param_mapping[i][1]
+                J[self._expt_slices[experiment],i] = expt_jac[experiment][parameter_name]
+
+            # Vanilla global variable
+            elif self._flat_param_type[i] == 1:
+                param_key = self._flat_param_mapping[i][0]
+                for experiment, parameter_name in self._global_param_mapping[param_key].items():
+                    J[self._expt_slices[experiment],i] += expt_jac[experiment][parameter_name]
+
+            # Global connector global variable.  Chain through every connector
+            # function of this connector.
+            elif self._flat_param_type[i] == 2:
+                connector = self._flat_param_mapping[i][0].__self__
+                param_name = self._flat_param_mapping[i][1]
+
+                for connector_function in self._global_params.keys():
+                    if type(connector_function) == str:
+                        continue
+                    if connector_function.__self__ is not connector:
+                        continue
+
+                    for experiment, parameter_name in self._global_param_mapping[connector_function].items():
+                        d = self._connector_derivative(connector_function,param_name,experiment)
+                        J[self._expt_slices[experiment],i] += d*expt_jac[experiment][parameter_name]
+
+            else:
+                err = "Paramter type {} not recongized.\n".format(self._flat_param_type[i])
+                raise ValueError(err) 
+
+        # Chain rule for parameters fit in a transformed space
+        for i in self._flat_transformed:
+            J[:,i] *= self._flat_param_obj[i].fit_space_derivative(param[i])
+
+        return J
+
+    def _connector_derivative(self,connector_function,param_name,expt_name):
+        """
+        Derivative of a GlobalConnector function, evaluated for one experiment,
+        with respect to one of the connector parameters (central difference).
+        """
+
+        connector = connector_function.__self__
+        e = self._expt_dict[expt_name]
 
-        return np.array(y_calc)
+        value = connector.params[param_name].value
+        h = 1e-6*max(abs(value),1.0)
+
+        connector.update_values({param_name:value + h})
+        up = connector_function(e)
+        connector.update_values({param_name:value - h})
+        down = connector_function(e)
+        connector.update_values({param_name:value})
+
+        return (up - down)/(2*h)
 
     def _parse_fit(self):
         """
         Parse the fit results.
         """
 
+        estimate, stdev, ninetyfive = self._fit_results_to_param_space()
+
         # Store the result
-        for i in range(len(self._fitter.estimate)):
+        for i in range(len(estimate)):
                 
             # local variable
             if self._flat_param_type[i] == 0:
@@ -418,19 +1177,19 @@ class GlobalFit:
                 experiment = self._flat_param_mapping[i][0]
                 parameter_name = self._flat_param_mapping[i][1]
 
-                self._expt_dict[experiment].model.update_values({parameter_name:self._fitter.estimate[i]})
-                self._expt_dict[experiment].model.update_stdevs({parameter_name:self._fitter.stdev[i]})
-                self._expt_dict[experiment].model.update_ninetyfives({parameter_name:self._fitter.ninetyfive[i]})
+                self._expt_dict[experiment].model.update_values({parameter_name:estimate[i]})
+                self._expt_dict[experiment].model.update_stdevs({parameter_name:stdev[i]})
+                self._expt_dict[experiment].model.update_ninetyfives({parameter_name:ninetyfive[i]})
 
             # Vanilla global variable
             elif self._flat_param_type[i] == 1:
 
                 param_key = self._flat_param_mapping[i][0]
-                for k, p in self._global_param_mapping[param_key]:
-                    self._expt_dict[k].model.update_values({p:self._fitter.estimate[i]})
-                    self._global_params[param_key].value = self._fitter.estimate[i]
-                    self._global_params[param_key].stdev = self._fitter.stdev[i]
-                    self._global_params[param_key].ninetyfive = self._fitter.ninetyfive[i]
+                for k, p in self._global_param_mapping[param_key].items():
+                    self._expt_dict[k].model.update_values({p:estimate[i]})
+                    self._global_params[param_key].value = estimate[i]
+                    self._global_params[param_key].stdev = stdev[i]
+                    self._global_params[param_key].ninetyfive = ninetyfive[i]
 
             # Global connector global variable
             elif self._flat_param_type[i] == 2:
@@ -442,13 +1201,44 @@ class GlobalFit:
                 # thermodynamic-y stuff of interest via .__dict__ rather than 
                 # directly via params.  So, this has to use the .update_values
                 # method.
-                connector.update_values({param_name:self._fitter.estimate[i]})
-                connector.params[param_name].stdev = self._fitter.stdev[i]
-                connector.params[param_name].ninetyfive = self._fitter.ninetyfive[i]
+                connector.update_values({param_name:estimate[i]})
+                connector.params[param_name].stdev = stdev[i]
+                connector.params[param_name].ninetyfive = ninetyfive[i]
 
             else:
                 err = "Paramter type {} not recognized.\n".format(self._flat_param_type[i])
-                raise ValueError(err) 
+                raise ValueError(err)
+
+    def _fit_results_to_param_space(self):
+        """
+        Estimates, standard deviations and 95% confidence intervals from the
+        fitter, mapped back from the space the fitter works in.  Intervals are
+        transformed endpoint by endpoint.  If the fitter has samples, the 
+        estimate and standard deviation are the mean and standard deviation
+        of the samples mapped back to parameter values (not the mapped mean,
+        which would be a geometric mean for "log").  Otherwise the estimate 
+        is mapped back and the standard deviation is propagated to first 
+        order (delta method).
+        """
+
+        estimate = self._from_fit_space(self._fitter.estimate)
+        stdev = np.array(self._fitter.stdev,dtype=float)
+        ninetyfive = np.array(self._fitter.ninetyfive,dtype=float)
+
+        samples = self._fitter.samples
+        for i in self._flat_transformed:
+            fp = self._flat_param_obj[i]
+
+            if len(samples) > 0:
+                values = fp.from_fit_space(samples[:,i])
+                estimate[i] = np.mean(values)
+                stdev[i] = np.std(values)
+            else:
+                stdev[i] = stdev[i]*fp.fit_space_derivative(self._fitter.estimate[i])
+
+            ninetyfive[i] = fp.from_fit_space(ninetyfive[i])
+
+        return estimate, stdev, ninetyfive
 
 
     def plot(self,correct_molar_ratio=False,subtract_dilution=False,
@@ -533,36 +1323,47 @@ class GlobalFit:
         else:
             alpha = 0.1
 
-        for i, s in enumerate(these_samples):
+        # Calculate the heats (and the parameters needed to correct them) for
+        # all samples at once
+        these_samples = np.atleast_2d(np.array(these_samples,dtype=float))
+        model_param = self._batch_model_param(these_samples)
+        plan_index = dict([(plan[0],j) for j, plan in enumerate(self._expt_plan)])
+
+        for j, expt_name in enumerate(self._expt_list_stable_order):
+
+            # Extract fit info for this experiment
+            e = self._expt_dict[expt_name]
+            model = e.model
+            param = dict([(p,model_param[plan_index[expt_name]][:,k:k+1])
+                          for k, p in enumerate(model.param_names)])
+
+            calc = model.dQ_batch(model_param[plan_index[expt_name]])[:,e.shot_start:]
+            dilution = model._dilution_heats(param)[:,e.shot_start:]
 
-            # Update calculation for this sample
-            self._y_calc(s)
-            for j, expt_name in enumerate(self._expt_list_stable_order):
+            for i in range(len(these_samples)):
 
-                # Extract fit info for this experiment
-                e = self._expt_dict[expt_name]
                 mr = e.mole_ratio
                 heats = e.heats
-                calc = self._expt_dict[expt_name].dQ
+                this_calc = calc[i]
 
-                if len(calc) > 0:
+                if len(this_calc) > 0:
 
                     # Try to correct molar ratio for competent fraction
                     if correct_molar_ratio:
                         try:
-                            mr = mr/e.param_values["fx_competent"]
+                            mr = mr/param["fx_competent"][i,0]
                         except KeyError:
                             pass
 
                     # Subtract dilution is requested
                     if subtract_dilution:
-                        heats = heats - e.dilution_heats
-                        calc = calc - e.dilution_heats
+                        heats = heats - dilution[i]
+                        this_calc = this_calc - dilution[i]
 
                 # Draw fit lines and residuals
-                if len(e.dQ) > 0:
-                    ax[0].plot(mr,calc,color=color_list[j],linewidth=linewidth,alpha=alpha)
-                    ax[1].plot(mr,(calc-heats),data_symbol,color=color_list[j],alpha=alpha,markersize=8)     
+                if len(this_calc) > 0:
+                    ax[0].plot(mr,this_calc,color=color_list[j],linewidth=linewidth,alpha=alpha)
+                    ax[1].plot(mr,(this_calc-heats),data_symbol,color=color_list[j],alpha=alpha,markersize=8)     
 
                 # If this is the last sample, plot the experimental data
                 if i == len(these_samples) - 1:
@@ -679,7 +1480,199 @@ class GlobalFit:
 
 
         return "".join(out)
- 
+
+    def save(self,path):
+        """
+        Save the experiments, links, parameters and fit results to the 
+        directory path, which is created if needed.  The directory holds
+        manifest.json (settings, links and parameter state), arrays.npz
+        (experimental heats and small fitter arrays) and one .npy file for
+        each large fitter array (such as samples).  Reload with 
+        GlobalFit.load.
+
+        Experiments are rebuilt from the saved heats, so the original heats
+        files are not needed.  Attributes added to experiments (for example
+        ionization_enthalpy) are saved if they are plain python types or
+        numpy arrays.
+
+        Parameters
+        ----------
+
+        path : string
+            directory to write
+        """
+
+        os.makedirs(path,exist_ok=True)
+
+        manifest = {"format_version":SAVE_FORMAT_VERSION,
+                    "n_workers":self._n_workers}
+        arrays = {}
+
+        # Experiments, with the keyword arguments used to build their models
+        manifest["experiments"] = []
+        expt_index = {}
+        for i, k in enumerate(self._expt_dict.keys()):
+
+            e = self._expt_dict[k]
+            try:
+                _plain(e._model_kwargs)
+            except TypeError:
+                err = "model keyword arguments for {} cannot be saved.\n".format(k)
+                raise ValueError(err)
+
+            attributes, expt_arrays = _object_state(e,skip=("_model",))
+            for a in expt_arrays.keys():
+                arrays["expt{}{}".format(i,a)] = expt_arrays[a]
+
+            model = e.model
+            manifest["experiments"].append({"class":_object_path(e.__class__),
+                                            "model":_object_path(model.__class__),
+                                            "attributes":attributes,
+                                            "arrays":list(expt_arrays.keys()),
+                                            "params":dict([(p,model.parameters[p]._get_state())
+                                                           for p in model.param_names])})
+            expt_index[k] = i
+
+        # Global parameters and connectors, in the order they were created
+        manifest["connectors"] = []
+        manifest["globals"] = []
+        connector_index = {}
+        for k in self._global_params.keys():
+
+            links = [[expt_index[e],p] for e, p in self._global_param_mapping[k].items()]
+
+            if type(k) == str:
+                manifest["globals"].append({"name":k,
+                                            "param":self._global_params[k]._get_state(),
+                                            "links":links})
+                continue
+
+            connector = k.__self__
+            if connector not in connector_index:
+                attributes, _ = _object_state(connector,skip=("_param_dict",))
+                connector_index[connector] = len(manifest["connectors"])
+                manifest["connectors"].append({"class":_object_path(connector.__class__),
+                                               "attributes":attributes,
+                                               "params":dict([(n,p._get_state())
+                                                              for n, p in connector.params.items()])})
+
+            manifest["globals"].append({"connector":connector_index[connector],
+                                        "method":k.__name__,
+                                        "links":links})
+
+        # Fit results
+        manifest["fitter"] = None
+        if hasattr(self,"_fitter"):
+
+            attributes, fitter_arrays = _object_state(self._fitter,
+                                                      skip=("_fit_result","_model","_scratch",
+                                                            "_y_obs"))
+            manifest["fitter"] = {"class":_object_path(self._fitter.__class__),
+                                  "attributes":attributes,
+                                  "arrays":[],
+                                  "mmap_arrays":[]}
+
+            for a in fitter_arrays.keys():
+                if fitter_arrays[a].size > SAVE_MMAP_SIZE:
+                    np.save(os.path.join(path,"fitter{}.npy".format(a)),fitter_arrays[a])
+                    manifest["fitter"]["mmap_arrays"].append(a)
+                else:
+                    arrays["fitter{}".format(a)] = fitter_arrays[a]
+                    manifest["fitter"]["arrays"].append(a)
+
+        np.savez(os.path.join(path,"arrays.npz"),**arrays)
+        with open(os.path.join(path,"manifest.json"),"w") as f:
+            json.dump(manifest,f,indent=1)
+
+    @classmethod
+    def load(cls,path):
+        """
+        Load a GlobalFit written by GlobalFit.save.  Large fitter arrays 
+        (such as samples) are memory-mapped read-only rather than read.
+
+        Parameters
+        ----------
+
+        path : string
+            directory written by GlobalFit.save
+        """
+
+        with open(os.path.join(path,"manifest.json"),"r") as f:
+            manifest = json.load(f)
+
+        if manifest["format_version"] != SAVE_FORMAT_VERSION:
+            err = "{} was saved in an unsupported format (version {}).\n".format(path,manifest["format_version"])
+            raise ValueError(err)
+
+        arrays = np.load(os.path.join(path,"arrays.npz"))
+
+        g = cls(n_workers=manifest["n_workers"])
+
+        # Experiments
+        experiments = []
+        for i, state in enumerate(manifest["experiments"]):
+            expt_arrays = dict([(a,arrays["expt{}{}".format(i,a)]) for a in state["arrays"]])
+            e = _restore_object(state["class"],state["attributes"],expt_arrays)
+            e._initialize_model(_import_object(state["model"]),e._model_kwargs)
+
+            g.add_experiment(e)
+            experiments.append(e)
+
+        # Connectors 
+        connectors = []
+        for state in manifest["connectors"]:
+            connector = _restore_object(state["class"],state["attributes"])
+            connector._update_name_dicts()
+            for n, param_state in state["params"].items():
+                connector.params[n]._set_state(param_state)
+                connector.update_values({n:param_state["value"]})
+            connectors.append(connector)
+
+        # Links to global parameters
+        for state in manifest["globals"]:
+
+            if "name" in state:
+                global_param = state["name"]
+            else:
+                global_param = getattr(connectors[state["connector"]],state["method"])
+
+            for i, expt_param in state["links"]:
+                g.link_to_global(experiments[i],expt_param,global_param)
+
+            if "name" in state:
+                g._global_params[global_param]._set_state(state["param"])
+
+        # Parameters of each experiment
+        for e, state in zip(experiments,manifest["experiments"]):
+            for p, param_state in state["params"].items():
+                e.model.parameters[p]._set_state(param_state)
+
+        # Fit results
+        if manifest["fitter"] is not None:
+
+            fitter_arrays = dict([(a,arrays["fitter{}".format(a)])
+                                  for a in manifest["fitter"]["arrays"]])
+            for a in manifest["fitter"]["mmap_arrays"]:
+                fitter_arrays[a] = np.load(os.path.join(path,"fitter{}.npy".format(a)),
+                                           mmap_mode="r")
+
+            g._fitter = _restore_object(manifest["fitter"]["class"],
+                                        manifest["fitter"]["attributes"],
+                                        fitter_arrays)
+            g._prep_fit()
+            if list(g._flat_param_name) != list(g._fitter._param_names):
+                err = "the saved fit results do not match the saved parameters.\n"
+                raise ValueError(err)
+
+            # Reattach the fitter to the model and data
+            g._fitter._fit_result = None
+            g._fitter._model = g._y_calc_into
+            g._fitter._y_obs = g._y_obs
+
+            g._record_warm_start()
+
+        return g
+
 
     @property
     def global_param(self):
@@ -691,7 +1684,7 @@ class GlobalFit:
 
         # Global parameters
         global_param = {}
-        for g in self._global_param_keys:
+        for g in self._global_params.keys():
             if type(g) == str:
                 global_param[g] = self._global_params[g]
             else:
@@ -810,13 +1803,11 @@ class GlobalFit:
         output["df"] = self.fit_num_obs - self.fit_num_param
  
         # Create a vector of calcluated and observed values.  
-        y_obs = [] 
-        y_estimate = []
+        y_obs = np.empty(len(self._y_obs),dtype=float)
+        y_estimate = np.empty(len(self._y_obs),dtype=float)
         for k in self._expt_dict:
-            y_obs.extend(self._expt_dict[k].heats)
-            y_estimate.extend(self._expt_dict[k].dQ)
-        y_estimate= np.array(y_estimate)
-        y_obs = np.array(y_obs)
+            y_obs[self._expt_slices[k]] = self._expt_dict[k].heats
+            y_estimate[self._expt_slices[k]] = self._expt_dict[k].dQ
 
         P = self.fit_num_param
         N = self.fit_num_obs
@@ -914,12 +1905,15 @@ class GlobalFit:
         is a map between experiment number and global parameter names.
         """
 
+        global_to_expt = dict([(k,list(v.items()))
+                               for k, v in self._global_param_mapping.items()])
+
         expt_to_global = []
         for expt_name in self._expt_list_stable_order:
             e = self._expt_dict[expt_name]
             expt_to_global.append(copy.deepcopy(e.model.param_aliases))
 
-        return self._global_param_mapping, expt_to_global
+        return global_to_expt, expt_to_global
 
 
 
@@ -1095,6 +2089,8 @@ class GlobalFit:
         else:
             self._expt_dict[expt.experiment_id].model.update_fixed({param_name:param_value})
 
+        self._stale_params = True
+
 
     #--------------------------------------------------------------------------
     # parameter bounds
@@ -1155,6 +2151,48 @@ class GlobalFit:
         else:
             self._expt_dict[expt.experiment_id].model.update_bounds({param_name:param_bounds})
 
+    #--------------------------------------------------------------------------
+    # parameter transforms
+
+    def update_transform(self,param_name,transform,expt=None):
+        """
+        Update the transform applied to a parameter while fitting.  If the
+        experiment is None, set a global parameter.  Otherwise, set the
+        specified experiment.
+
+        Fitters work on the transformed parameter, but guesses, bounds and 
+        results are given for the parameter itself.  The transform does not
+        change the statistics:  BayesianFitter adds the log jacobian of the
+        transform to its prior, so the prior stays uniform in the parameter, 
+        and sample-based estimates (BootstrapFitter, BayesianFitter) are the
+        means of the samples mapped back to parameter values.  Confidence 
+        intervals are mapped back endpoint by endpoint, so they can be 
+        asymmetric.
+
+        Parameters
+        ----------
+
+        param_name: string 
+            name of parameter to set
+        transform: None, "log", "logit" or "softplus"
+            transform to apply.  "log" fits the logarithm of a positive 
+            parameter (e.g. K or beta); "logit" and "softplus" keep a parameter
+            inside its bounds (both bounds or the lower bound, respectively).
+        expt_name: ITCExperiment instance OR None
+            experiment to update transform of
+        """
+
+        if expt == None:
+            try:
+                self.global_param[param_name].transform = transform
+            except KeyError:
+                err = "param \"{}\" is not global.  You must specify an experiment.\n".format(param_name)
+                raise KeyError(err)
+        else:
+            self._expt_dict[expt.experiment_id].model.update_transforms({param_name:transform})
+
+        self._stale_params = True
+
     #--------------------------------------------------------------------------
     # Functions for updating values directly (used in gui)
 
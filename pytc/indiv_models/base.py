@@ -7,13 +7,47 @@ Base class for other itc model description.
 __author__ = "Michael J. Harms"
 __date__ = "2016-06-22"
 
-import inspect
+import inspect, functools
 import numpy as np
 from .. import fit_param
 
+@functools.lru_cache(maxsize=4096)
+def _titration_grid(cell_volume,shot_volumes,cell_conc,syringe_conc):
+    """
+    Concentration of a species across a titration (see 
+    ITCModel._titrate_species).  shot_volumes is a tuple so the arguments can
+    be hashed.  Results are cached, keeping the most recently used grids, so
+    experiments run with the same injection protocol share a single 
+    read-only concentration array.
+    """
+
+    shot_volumes = np.array(shot_volumes,dtype=float)
+
+    # Cumulative product of the fraction of the cell left behind after each
+    # shot.  Entry i is the product over shots 0..i.
+    shot_ratio_prod = np.cumprod(1 - shot_volumes/cell_volume)
+
+    out_conc = np.zeros(len(shot_volumes)+1)
+    out_conc[0] = cell_conc
+
+    injected = syringe_conc*(1 - shot_ratio_prod)
+    diluted = cell_conc*shot_ratio_prod
+    out_conc[1:] = injected + diluted
+
+    # The array is shared by every model with the same protocol, so make
+    # sure nobody can modify it in place.
+    out_conc.setflags(write=False)
+
+    return out_conc
+
 class ITCModel:
     """
     Base class from which all ITC models should be sub-classed.
+
+    The concentration arrays self._S_conc and self._T_conc are shared between
+    models with the same injection protocol and are read-only.  Subclasses 
+    that need to change them should replace them with a copy first, e.g.
+    self._S_conc = np.array(self._S_conc).
     """
 
     def __init__(self,
@@ -44,6 +78,16 @@ class ITCModel:
         self._S_conc = self._titrate_species(self._S_cell,self._S_syringe)
         self._T_conc = self._titrate_species(self._T_cell,self._T_syringe)
 
+        # Parameter version, bumped whenever a parameter value changes.  Heats
+        # are cached against it.
+        self._param_version = 0
+        self._heat_cache = {}
+
+        # Layout version, bumped whenever a parameter is fixed/unfixed, 
+        # aliased or transformed.  GlobalFit uses it to decide whether its
+        # parameter layout needs to be rebuilt.
+        self._layout_version = 0
+
         self._initialize_param()
 
     def param_definition(self):
@@ -51,8 +95,156 @@ class ITCModel:
 
     @property
     def dQ(self):
+        """
+        Heats calculated by the model for the current parameter values.  The
+        result is cached (read-only) until a parameter value changes.
+        """
+
+        return self._cached_heats("dQ",self._calc_dQ)
+
+    def _calc_dQ(self):
+        """
+        Calculate the heats for the current parameter values.  Models should
+        redefine this method.
+        """
+
         return np.array(())
 
+    def _cached_heats(self,key,calc_function):
+        """
+        Return the array calculated by calc_function, recalculating it only if
+        the parameters have changed since it was last calculated.
+        """
+
+        try:
+            version, heats = self._heat_cache[key]
+            if version == self._param_version:
+                return heats
+        except KeyError:
+            pass
+
+        heats = np.asarray(calc_function(),dtype=float)
+        heats.setflags(write=False)
+        self._heat_cache[key] = (self._param_version,heats)
+
+        return heats
+
+    def _param_changed(self):
+        """
+        Record that a parameter value has changed, invalidating cached heats.
+        """
+
+        self._param_version += 1
+
+    def _layout_changed(self):
+        """
+        Record that a parameter was fixed or unfixed, or its alias or 
+        transform changed.
+        """
+
+        self._layout_version += 1
+
+    @property
+    def param_version(self):
+        """
+        Counter that is incremented whenever a parameter value changes.
+        """
+
+        return self._param_version
+
+    @property
+    def layout_version(self):
+        """
+        Counter that is incremented whenever a parameter is fixed or unfixed,
+        or its alias or transform changes.
+        """
+
+        return self._layout_version
+
+    @property
+    def dQ_jacobian(self):
+        """
+        Derivatives of dQ with respect to each parameter.  This is a dictionary
+        keying parameter names to arrays with one entry per shot.  Models that
+        can calculate these analytically should redefine this property.
+        """
+
+        err = "{} does not define an analytic dQ_jacobian.\n".format(self.__class__.__name__)
+        raise NotImplementedError(err)
+
+    @property
+    def analytic_jacobian(self):
+        """
+        Whether dQ_jacobian is defined analytically for this model.  The
+        jacobian is only trusted if it is defined by the same class that
+        defines dQ (or one of its subclasses), so a subclass that redefines
+        dQ without redefining dQ_jacobian does not inherit a stale jacobian.
+        """
+
+        mro = type(self).__mro__
+        dQ_cls = next(c for c in mro
+                      if "dQ" in c.__dict__ or "_calc_dQ" in c.__dict__)
+        jac_cls = next(c for c in mro if "dQ_jacobian" in c.__dict__)
+
+        return jac_cls is not ITCModel and issubclass(jac_cls,dQ_cls)
+
+    def _dilution_jacobian(self):
+        """
+        Derivatives of the heat of dilution with respect to the dilution
+        parameters.
+        """
+
+        return {"dilution_heat":np.array(self._T_conc[1:]),
+                "dilution_intercept":np.ones(len(self._T_conc)-1)}
+
+    def dQ_batch(self,param_array):
+        """
+        Calculate the heats for many parameter sets in a single call.
+
+        Parameters
+        ----------
+
+        param_array : 2d array of floats
+            num_samples x num_params array of parameter values.  Columns must
+            be in the same order as self.param_names.
+
+        Returns a num_samples x num_shots array of heats.
+        """
+
+        param_array = np.atleast_2d(np.asarray(param_array,dtype=float))
+        if param_array.ndim != 2 or param_array.shape[1] != len(self._param_names):
+            err = "param_array must be a 2d array with one column for each of the\n"
+            err += "{} parameters in the model.\n".format(len(self._param_names))
+            raise ValueError(err)
+
+        # Each parameter becomes a (num_samples,1) column so it broadcasts
+        # against the (num_shots,) concentration arrays.
+        param = dict([(p,param_array[:,i:i+1])
+                      for i, p in enumerate(self._param_names)])
+
+        return self._dQ_batch(param)
+
+    def _dQ_batch(self,param):
+        """
+        Calculate heats given a dictionary of parameter values.  Values may be
+        scalars or (num_samples,1) arrays.  This generic version loops over the
+        samples, setting the parameters and calling self.dQ.  Subclasses should
+        redefine it with a vectorized calculation.
+        """
+
+        num_samples = len(param[self._param_names[0]])
+        current_values = self.param_values
+
+        out = []
+        try:
+            for i in range(num_samples):
+                self.update_values(dict([(p,param[p][i,0]) for p in self._param_names]))
+                out.append(np.array(self.dQ))
+        finally:
+            self.update_values(current_values)
+
+        return np.array(out)
+
     # --------------------------------------------------------------------------
 
     def _titrate_species(self,cell_conc,syringe_conc):
@@ -67,24 +259,15 @@ class ITCModel:
         these two groups is the total concentration of whatever was titrated.
         The shot_ratio_product method is described on p. 134 of Freire et al.
         (2009) Meth Enzymology 455:127-155
-        """
-
-        volume = np.zeros(len(self._shot_volumes)+1)
-        out_conc = np.zeros(len(self._shot_volumes)+1)
-
-        volume[0] = self._cell_volume
-        out_conc[0] = cell_conc
 
-        shot_ratio = (1 - self._shot_volumes/self._cell_volume)
-        for i in range(len(self._shot_volumes)):
-
-            shot_ratio_prod = np.prod(shot_ratio[:(i+1)])
-            injected = syringe_conc*(1 - shot_ratio_prod)
-            diluted = cell_conc*shot_ratio_prod
-
-            out_conc[i+1] = injected + diluted
+        Titration grids depend only on the injection protocol and the starting
+        concentrations, so they are cached at the module level and shared
+        (read-only) between all models built with the same protocol.
+        """
 
-        return out_conc
+        return _titration_grid(float(self._cell_volume),
+                               tuple(self._shot_volumes.tolist()),
+                               float(cell_conc),float(syringe_conc))
 
     @property
     def mole_ratio(self):
@@ -101,10 +284,20 @@ class ITCModel:
     @property
     def dilution_heats(self):
         """
-        Return the heat of dilution.
+        Return the heat of dilution.  Cached (read-only) until a parameter value
+        changes.
+        """
+
+        return self._cached_heats("dilution_heats",
+                                  lambda: self._dilution_heats(self.param_values))
+
+    def _dilution_heats(self,param):
+        """
+        Heat of dilution given a dictionary of parameter values.  Values may be
+        scalars or (num_samples,1) arrays.
         """
 
-        return self._T_conc[1:]*self.param_values["dilution_heat"] + self.param_values["dilution_intercept"]
+        return self._T_conc[1:]*param["dilution_heat"] + param["dilution_intercept"]
 
     def _initialize_param(self,param_names=None,param_guesses=None):
         """
@@ -119,7 +312,7 @@ class ITCModel:
             param_guesses = []
 
         # Grab parameter names and guesses from the self.param_definition function
-        a = inspect.getargspec(self.param_definition)
+        a = inspect.getfullargspec(self.param_definition)
 
         if type(a.args) != None:
 
@@ -148,6 +341,15 @@ class ITCModel:
         self._param_names = param_names[:]
         self._param_names.sort()
 
+        # Parameter values live in one contiguous array (in param_names order)
+        # that the FitParameter objects read and write.  _pidx maps parameter
+        # names to positions in the array.
+        self._pidx = dict([(p,i) for i, p in enumerate(self._param_names)])
+        self._pvals = np.zeros(len(self._param_names),dtype=float)
+        for p in self._param_names:
+            self._params[p].bind(self._pvals,self._pidx[p],self._param_changed,
+                                 self._layout_changed)
+
 
     # -------------------------------------------------------------------------
     # parameter names
@@ -180,7 +382,7 @@ class ITCModel:
         Values for each parameter in the model.
         """
 
-        return dict([(p,self._params[p].value) for p in self._param_names])  
+        return dict(zip(self._param_names,self._pvals.tolist()))
  
 
     def update_values(self,param_values):
@@ -192,6 +394,20 @@ class ITCModel:
         for p in param_values.keys():
             self._params[p].value = param_values[p]
 
+    def _update_param_array(self,indices,values):
+        """
+        Write values straight into the parameter array.  indices are positions
+        in self.param_names.  This is the fast path used by GlobalFit while
+        fitting.  If none of the values actually change, the parameter version
+        is left alone so cached heats are reused.
+        """
+
+        if np.array_equal(self._pvals[indices],values):
+            return
+
+        self._pvals[indices] = values
+        self._param_changed()
+
     # -------------------------------------------------------------------------
     # parameter stdev
 
@@ -294,7 +510,7 @@ class ITCModel:
         """
 
         for p in fixed_param.keys():
-        
+
             if fixed_param[p] == None:
                 self._params[p].fixed = False
             else:
@@ -322,6 +538,27 @@ class ITCModel:
         for p in bounds.keys():
             self._params[p].bounds = bounds[p]
 
+    # -------------------------------------------------------------------------
+    # parameter transforms
+
+    @property
+    def param_transforms(self):
+        """
+        Return the transform applied to each parameter while fitting.
+        """
+
+        return dict([(p,self._params[p].transform) for p in self._param_names])
+
+    def update_transforms(self,param_transforms):
+        """
+        Update the transforms applied to parameters while fitting.
+        param_transforms is a dictionary of parameters keyed to None, "log",
+        "logit" or "softplus".
+        """
+
+        for p in param_transforms.keys():
+            self._params[p].transform = param_transforms[p]
+
     # -------------------------------------------------------------------------
     # parameter aliases
 
@@ -7,18 +7,26 @@ Models subclassed from ITCModel used to model (and fit) ITC data.
 __author__ = "Michael J. Harms"
 __date__ = "2016-06-22"
 
-import inspect
+import inspect, multiprocessing
 import numpy as np
 import scipy.optimize
 from .base import ITCModel
+from . import bp_numpy
 
-from . import bp_ext
+# The compiled extension is optional; without it, models use the numpy engine.
+try:
+    from . import bp_ext
+except ImportError:
+    bp_ext = None
 
 class BindingPolynomial(ITCModel):
     """
     Base class for a binding polynomial fit.
     """
 
+    AVAIL_SOLVERS = ("brent","newton")
+    AVAIL_ENGINES = ("c","numpy")
+
     def param_definition(fx_competent=1.0): 
         """
         Define fraction competent.  The binding polynomial parameters are built
@@ -32,7 +40,8 @@ class BindingPolynomial(ITCModel):
                  S_cell=100e-6,S_syringe=0.0,
                  T_cell=0.0,   T_syringe=1000e-6,
                  cell_volume=300.0,
-                 shot_volumes=[2.5 for i in range(30)]):
+                 shot_volumes=[2.5 for i in range(30)],
+                 num_threads=1,solver="newton",engine=None):
 
         """
         num_sites: number of sites in the binding polynomial
@@ -42,9 +51,60 @@ class BindingPolynomial(ITCModel):
         T_syringe: titrant concentration syringe in M
         cell_volume: cell volume, in uL
         shot_volumes: list of shot volumes, in uL.
+        num_threads: number of threads used when calculating heats for many
+                     parameter sets at once (dQ_batch).  If "max", use the
+                     total number of cpus.
+        solver: how to solve for the free titrant concentration at each shot.
+                "newton" (default) warm-starts each shot from the previous
+                shot's root and takes Newton steps using the analytic
+                derivative of the binding polynomial, falling back to Brent's
+                method if a step leaves the bracket.  "brent" solves every
+                shot from scratch with Brent's method.  Only used by the "c"
+                engine.
+        engine: how to calculate the heats.  "c" uses the compiled bp_ext
+                extension.  "numpy" solves all shots (and, in dQ_batch, all
+                parameter sets) at once with vectorized, safeguarded Newton
+                steps in numpy; num_threads is ignored.  If None, use "c" if
+                the extension is available and "numpy" otherwise.
         """
 
         self._num_sites = num_sites
+
+        self._num_threads = num_threads
+        if self._num_threads == "max":
+            self._num_threads = multiprocessing.cpu_count()
+
+        if type(self._num_threads) != int or self._num_threads < 1:
+            err = "num_threads must be 'max' or a positive integer\n"
+            raise ValueError(err)
+
+        if solver not in self.AVAIL_SOLVERS:
+            err = "solver must be one of:\n"
+            for k in self.AVAIL_SOLVERS:
+                err += "    {}\n".format(k)
+            err += "\n"
+
+            raise ValueError(err)
+
+        if engine is None:
+            engine = "numpy" if bp_ext is None else "c"
+
+        if engine not in self.AVAIL_ENGINES:
+            err = "engine must be one of:\n"
+            for k in self.AVAIL_ENGINES:
+                err += "    {}\n".format(k)
+            err += "\n"
+
+            raise ValueError(err)
+
+        if engine == "c" and bp_ext is None:
+            err = "the compiled bp_ext extension is not available.  Use engine=\"numpy\".\n"
+            raise ValueError(err)
+
+        self._engine = engine
+        if self._engine == "c":
+            self._solver = getattr(bp_ext,"SOLVER_{}".format(solver.upper()))
+
         super().__init__(S_cell,S_syringe,T_cell,T_syringe,cell_volume,shot_volumes)
 
     def _initialize_param(self):
@@ -67,30 +127,178 @@ class BindingPolynomial(ITCModel):
         self._fit_dH_array   = np.zeros(self._num_sites,dtype=float)
         self._fit_beta_list  = ["beta{}".format(i+1) for i in range(self._num_sites)]
         self._fit_dH_list    = ["dH{}".format(i+1) for i in range(self._num_sites)]
+        self._fit_beta_idx   = np.array([self._pidx[p] for p in self._fit_beta_list])
+        self._fit_dH_idx     = np.array([self._pidx[p] for p in self._fit_dH_list])
 
-        self._T_conc_free = np.zeros(len(self._S_conc),dtype=float)
+        # Scratch space for the compiled binding polynomial, allocated once for
+        # this number of shots and reused on every dQ call.
+        if self._engine == "c":
+            self._workspace = bp_ext.workspace(len(self._S_conc))
+        else:
+            self._T_conc_free = np.zeros(len(self._S_conc),dtype=float)
 
-    @property
-    def dQ(self):
+    def __getstate__(self):
+        """
+        The compiled workspace cannot be pickled (it only holds scratch
+        space); a new one is allocated when the model is unpickled.
+        """
+
+        state = self.__dict__.copy()
+        state.pop("_workspace",None)
+
+        return state
+
+    def __setstate__(self,state):
+        """
+        Restore a pickled model, allocating a new compiled workspace.  The new
+        workspace holds no free titrant concentrations, so cached heats are
+        dropped and the next dQ solves again.
+        """
+
+        self.__dict__.update(state)
+        self._heat_cache = {}
+        if self._engine == "c":
+            self._workspace = bp_ext.workspace(len(self._S_conc))
+
+    def _calc_dQ(self):
         """
         Calculate the heats that would be observed across shots for a given set
         of enthalpies and binding constants for each reaction.  This will work
         for an arbitrary-order binding polynomial.
         """
 
-        # Populate fitting parameter arrays
+        # Populate fitting parameter arrays straight from the parameter array
+        np.take(self._pvals,self._fit_beta_idx,out=self._fit_beta_array)
+        np.take(self._pvals,self._fit_dH_idx,out=self._fit_dH_array)
+
+        S_conc_corr = self._S_conc*self._pvals[self._pidx["fx_competent"]]
+
+        if self._engine == "numpy":
+            heats, T_free = bp_numpy.dQ(self._cell_volume,self._fit_beta_array,
+                                        self._fit_dH_array,S_conc_corr,
+                                        self._T_conc,self.dilution_heats)
+            self._T_conc_free = T_free[0]
+            return heats[0]
+
+        final_array = np.empty((len(S_conc_corr)-1),dtype=float)
+
+        bp_ext.dQ(self._workspace, self._cell_volume, self.dilution_heats,
+            self._fit_beta_array, self._fit_dH_array, S_conc_corr, self._T_conc,
+            final_array, self._solver)
+
+        return final_array
+
+    @property
+    def dQ_jacobian(self):
+        """
+        Derivatives of dQ with respect to each parameter.  The free titrant
+        concentration x satisfies f(x) = x + S*N(x)/P(x) - T = 0, where P is
+        the binding polynomial and N = sum(i*beta_i*x**i), so its derivatives
+        come from implicit differentiation: dx/dp = -(df/dp)/(df/dx).
+        """
+
+        # Solve for the free titrant at the current parameter values.  Solve
+        # even if dQ is cached: the cached heats do not guarantee the free
+        # titrant concentrations are still in the workspace.
+        self._calc_dQ()
+        x = self.T_conc_free[:,np.newaxis]
+
+        param = self.param_values
+        fx = param["fx_competent"]
+        S_conc_corr = self._S_conc*fx
+
+        site = np.arange(1,self._num_sites + 1)
+        beta = np.array([param[b] for b in self._fit_beta_list])
+        dH = np.array([param[d] for d in self._fit_dH_list])
+
+        # num_shots x num_sites arrays of beta_i*x**i and beta_i*x**(i-1)
+        x_power = x**site
+        bx = beta*x_power
+        bx_prime = beta*x**(site - 1)
+
+        P = 1 + np.sum(bx,axis=1)
+        N = np.sum(site*bx,axis=1)
+        H = np.sum(dH*bx,axis=1)
+        avg_dH = H/P
+
+        dP_dx = np.sum(site*bx_prime,axis=1)
+        dN_dx = np.sum(site*site*bx_prime,axis=1)
+        dH_dx = np.sum(site*dH*bx_prime,axis=1)
+
+        df_dx = 1 + S_conc_corr*(dN_dx*P - N*dP_dx)/P**2
+        davg_dx = (dH_dx*P - H*dP_dx)/P**2
+
+        scale = self._cell_volume*S_conc_corr[1:]
+
+        out = self._dilution_jacobian()
         for i in range(self._num_sites):
-            self._fit_beta_array[i] = self.param_values[self._fit_beta_list[i]]
-            self._fit_dH_array[i] = self.param_values[self._fit_dH_list[i]]
 
-        S_conc_corr = self._S_conc*self.param_values["fx_competent"]
-        num_shots = len(S_conc_corr)
-        size_T = self._T_conc.size
+            df_dbeta = S_conc_corr*x_power[:,i]*((i + 1)*P - N)/P**2
+            dx_dbeta = -df_dbeta/df_dx
+
+            davg_dbeta = x_power[:,i]*(dH[i] - avg_dH)/P + davg_dx*dx_dbeta
+            out[self._fit_beta_list[i]] = scale*(davg_dbeta[1:] - davg_dbeta[:-1])
+
+            davg_ddH = bx[:,i]/P
+            out[self._fit_dH_list[i]] = scale*(davg_ddH[1:] - davg_ddH[:-1])
+
+        dx_dfx = -(self._S_conc*N/P)/df_dx
+        davg_dfx = davg_dx*dx_dfx
+        out["fx_competent"] = self._cell_volume*self._S_conc[1:]*(avg_dH[1:] - avg_dH[:-1]) + \
+                              scale*(davg_dfx[1:] - davg_dfx[:-1])
+
+        return out
+
+    @property
+    def T_conc_free(self):
+        """
+        Free titrant concentration at each shot found by the last dQ
+        calculation.
+        """
+
+        if self._engine == "numpy":
+            return np.array(self._T_conc_free)
+
+        return bp_ext.free_titrant(self._workspace)
+
+    @property
+    def engine(self):
+        """
+        Engine used to calculate heats ("c" or "numpy").
+        """
+
+        return self._engine
+
+    def _dQ_batch(self,param):
+        """
+        Calculate heats for (num_samples,1) arrays of parameter values.  All
+        samples are solved in one call to the compiled binding polynomial,
+        which releases the GIL and splits them over self._num_threads threads,
+        or in one vectorized solve by the numpy engine.
+        """
+
+        if self._engine == "numpy":
+            fit_beta = np.hstack([param[b] for b in self._fit_beta_list])
+            fit_dH = np.hstack([param[d] for d in self._fit_dH_list])
+            heats, T_free = bp_numpy.dQ(self._cell_volume,fit_beta,fit_dH,
+                                        self._S_conc*param["fx_competent"],
+                                        self._T_conc,self._dilution_heats(param))
+            return heats
+
+        fit_beta = np.ascontiguousarray(np.hstack([param[b] for b in self._fit_beta_list]))
+        fit_dH = np.ascontiguousarray(np.hstack([param[d] for d in self._fit_dH_list]))
+        num_samples = fit_beta.shape[0]
+        num_shots = len(self._S_conc)
 
-        final_array = np.zeros((num_shots-1),dtype=float)
+        S_conc_corr = np.ascontiguousarray(np.broadcast_to(self._S_conc*param["fx_competent"],
+                                                           (num_samples,num_shots)))
+        T_conc = np.ascontiguousarray(np.broadcast_to(self._T_conc,(num_samples,num_shots)))
+        dilution_heats = np.ascontiguousarray(np.broadcast_to(self._dilution_heats(param),
+                                                              (num_samples,num_shots-1)))
+        cell_volume = np.ones(num_samples,dtype=float)*self._cell_volume
 
-        bp_ext.dQ(self._cell_volume, num_shots, size_T, self._num_sites, self.dilution_heats, 
-            self._fit_beta_array, self._fit_dH_array, S_conc_corr, self._T_conc, self._T_conc_free, 
-            final_array)
+        final_array = np.zeros((num_samples,num_shots-1),dtype=float)
+        bp_ext.dQ_batch(cell_volume, fit_beta, fit_dH, S_conc_corr, T_conc,
+                        dilution_heats, final_array, self._num_threads, self._solver)
 
         return final_array
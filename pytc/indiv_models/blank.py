@@ -21,8 +21,7 @@ class Blank(ITCModel):
     def param_definition():
         pass
     
-    @property
-    def dQ(self):
+    def _calc_dQ(self):
         """
         Calculate heat of dilution as a function of titrant concentration in
         the cell.
@@ -31,3 +30,20 @@ class Blank(ITCModel):
         to_return = self.dilution_heats
 
         return to_return
+
+    def _dQ_batch(self,param):
+        """
+        Calculate heats for parameter values that are either scalars or
+        (num_samples,1) arrays.
+        """
+
+        return self._dilution_heats(param)
+
+    @property
+    def dQ_jacobian(self):
+        """
+        Derivatives of dQ with respect to each parameter.
+        """
+
+        return self._dilution_jacobian()
+
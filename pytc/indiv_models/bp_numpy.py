@@ -0,0 +1,159 @@
+__description__ = \
+"""
+bp_numpy.py
+
+Pure numpy version of the binding polynomial calculation done by the compiled
+bp_ext module.  The free titrant concentration is solved for every shot (and
+every parameter set) at once with a vectorized, safeguarded Newton iteration.
+"""
+
+import numpy as np
+
+# Same convergence criteria as the compiled solver: |step| < (XTOL + RTOL*|x|)/2
+XTOL = 2e-12
+RTOL = 8.8817841970012523e-16
+MAX_ITER = 200
+
+# Total titrant concentrations below this are treated as zero
+TOLERANCE = 1e-12
+
+def _bp_eval(T_free,S_total,T_total,fit_beta):
+    """
+    Evaluate f = T_free + S_total*N/P - T_total and df/dT_free, where P is the
+    binding polynomial 1 + sum_i beta_i*T_free**i and N = sum_i i*beta_i*T_free**i.
+    fit_beta is num_samples x num_sites; the other arrays are num_samples x
+    num_shots.
+    """
+
+    P_acc = np.zeros(T_free.shape)
+    N_acc = np.zeros(T_free.shape)
+    dN_acc = np.zeros(T_free.shape)
+
+    # Horner's rule.  P' is N_acc.
+    for i in range(fit_beta.shape[1],0,-1):
+        b = fit_beta[:,i-1:i]
+        P_acc = P_acc*T_free + b
+        N_acc = N_acc*T_free + i*b
+        dN_acc = dN_acc*T_free + i*i*b
+
+    P = 1 + T_free*P_acc
+    N = T_free*N_acc
+
+    f = T_free + S_total*N/P - T_total
+    df = 1 + S_total*(dN_acc*P - N*N_acc)/(P*P)
+
+    return f, df
+
+def free_titrant(fit_beta,S_conc_corr,T_conc):
+    """
+    Solve for the free titrant concentration.
+
+    Parameters
+    ----------
+
+    fit_beta : 2d array
+        num_samples x num_sites array of binding constants
+    S_conc_corr : 2d array
+        num_samples x num_shots array of (competent) stationary concentrations
+    T_conc : 2d array
+        num_samples x num_shots array of total titrant concentrations
+
+    Returns a num_samples x num_shots array of free titrant concentrations.
+
+    The residual is increasing in T_free and brackets the root on
+    [0,T_conc].  Every entry takes Newton steps, falling back to bisection of
+    its current bracket if a step leaves the bracket.
+    """
+
+    S_conc_corr = np.asarray(S_conc_corr,dtype=float)
+    T_conc = np.asarray(T_conc,dtype=float)
+
+    # Bring everything to num_samples x num_shots
+    shape = np.broadcast_shapes(S_conc_corr.shape,T_conc.shape,(fit_beta.shape[0],1))
+    S_conc_corr = np.broadcast_to(S_conc_corr,shape)
+    T_conc = np.broadcast_to(T_conc,shape)
+
+    lo = np.zeros(T_conc.shape)
+    hi = np.array(T_conc)
+
+    # Same handling as the compiled code when the ends of the bracket have the
+    # same sign: put the root at whichever end the compiled code would.
+    f_lo = -T_conc
+    f_hi, df = _bp_eval(hi,S_conc_corr,T_conc,fit_beta)
+    bad = f_lo*f_hi > 0
+    pick_T = np.where(f_hi < 0,f_hi >= f_lo,f_hi < f_lo)
+    no_titrant = np.abs(T_conc) < TOLERANCE
+
+    x = np.zeros(T_conc.shape)
+    done = bad | no_titrant
+    for i in range(MAX_ITER):
+
+        f, df = _bp_eval(x,S_conc_corr,T_conc,fit_beta)
+
+        # Tighten brackets
+        lo = np.where(f < 0,x,lo)
+        hi = np.where(f > 0,x,hi)
+
+        with np.errstate(divide="ignore",invalid="ignore"):
+            x_new = x - f/df
+
+        # Bisect wherever Newton left the bracket
+        bisect = ~(df > 0) | ~((x_new > lo) & (x_new < hi))
+        x_new = np.where(bisect,(lo + hi)/2,x_new)
+
+        converged = (f == 0) | (np.abs(x_new - x) < (XTOL + RTOL*np.abs(x_new))/2)
+        x = np.where(done | (f == 0),x,x_new)
+        done = done | converged
+
+        if np.all(done):
+            break
+
+    x = np.where(bad,np.where(pick_T,T_conc,0.0),x)
+    x = np.where(no_titrant,0.0,x)
+
+    # numerical problems sometimes make T slightly bigger than the total
+    # concentration, so bring down to the correct value
+    return np.minimum(x,T_conc)
+
+def dQ(cell_volume,fit_beta,fit_dH,S_conc_corr,T_conc,dilution_heats):
+    """
+    Calculate heats for many parameter sets at once.
+
+    Parameters
+    ----------
+
+    cell_volume : float or 1d array
+        cell volume (one per sample if an array)
+    fit_beta, fit_dH : 2d arrays
+        num_samples x num_sites arrays of binding constants and enthalpies
+    S_conc_corr, T_conc : 2d arrays
+        num_samples x num_shots arrays of stationary and titrant concentrations
+    dilution_heats : 2d array
+        num_samples x (num_shots - 1) array of dilution heats
+
+    Returns num_samples x (num_shots - 1) heats and the num_samples x num_shots
+    free titrant concentrations.
+    """
+
+    fit_beta = np.atleast_2d(np.asarray(fit_beta,dtype=float))
+    fit_dH = np.atleast_2d(np.asarray(fit_dH,dtype=float))
+    S_conc_corr = np.atleast_2d(np.asarray(S_conc_corr,dtype=float))
+
+    T_free = free_titrant(fit_beta,S_conc_corr,T_conc)
+
+    # average enthalpy change, building up powers of T_free
+    numerator = np.zeros(T_free.shape)
+    denominator = np.ones(T_free.shape)
+    T_power = np.ones(T_free.shape)
+    for i in range(fit_beta.shape[1]):
+        T_power = T_power*T_free
+        bt = fit_beta[:,i:i+1]*T_power
+        numerator += fit_dH[:,i:i+1]*bt
+        denominator += bt
+
+    avg_dH = numerator/denominator
+
+    cell_volume = np.reshape(cell_volume,(-1,1))
+    heats = cell_volume*S_conc_corr[:,1:]*(avg_dH[:,1:] - avg_dH[:,:-1]) + dilution_heats
+
+    return heats, T_free
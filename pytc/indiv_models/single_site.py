@@ -19,23 +19,68 @@ class SingleSite(ITCModel):
     def param_definition(K=1e6,dH=-4000.0,fx_competent=1.0):
         pass
 
-    @property
-    def dQ(self):
+    def _calc_dQ(self):
         """
         Calculate the heats that would be observed across shots for a given set
         of enthalpies and binding constants for each reaction.
         """
 
+        return self._dQ_batch(self.param_values)
+
+    def _dQ_batch(self,param):
+        """
+        Calculate heats for parameter values that are either scalars or
+        (num_samples,1) arrays.
+        """
+
         # ----- Determine mole fractions -----
-        S_conc_corr = self._S_conc*self.param_values["fx_competent"]
-        b = S_conc_corr + self._T_conc + 1/self.param_values["K"]
+        S_conc_corr = self._S_conc*param["fx_competent"]
+        b = S_conc_corr + self._T_conc + 1/param["K"]
         ST = (b - np.sqrt((b)**2 - 4*S_conc_corr*self._T_conc))/2
 
         mol_fx_st = ST/S_conc_corr
 
         # ---- Relate mole fractions to heat -----
-        X = self.param_values["dH"]*(mol_fx_st[1:] - mol_fx_st[:-1])
+        X = param["dH"]*(mol_fx_st[...,1:] - mol_fx_st[...,:-1])
    
-        to_return = self._cell_volume*S_conc_corr[1:]*X + self.dilution_heats
+        to_return = self._cell_volume*S_conc_corr[...,1:]*X + self._dilution_heats(param)
 
         return to_return
+
+    @property
+    def dQ_jacobian(self):
+        """
+        Derivatives of dQ with respect to each parameter.
+        """
+
+        param = self.param_values
+        fx = param["fx_competent"]
+        K = param["K"]
+        dH = param["dH"]
+
+        S_conc_corr = self._S_conc*fx
+        b = S_conc_corr + self._T_conc + 1/K
+        root = np.sqrt((b)**2 - 4*S_conc_corr*self._T_conc)
+        ST = (b - root)/2
+
+        mol_fx_st = ST/S_conc_corr
+
+        # Derivatives of the bound concentration with respect to b and the
+        # (competent) stationary concentration
+        dST_db = (1 - b/root)/2
+        dST_dS = (1 - (b - 2*self._T_conc)/root)/2
+
+        dmol_dK = -dST_db/(K**2)/S_conc_corr
+        dmol_dfx = (dST_dS - mol_fx_st)/fx
+
+        scale = self._cell_volume*S_conc_corr[1:]
+        delta = mol_fx_st[1:] - mol_fx_st[:-1]
+
+        out = self._dilution_jacobian()
+        out["K"] = scale*dH*(dmol_dK[1:] - dmol_dK[:-1])
+        out["dH"] = scale*delta
+        out["fx_competent"] = self._cell_volume*self._S_conc[1:]*dH*delta + \
+                              scale*dH*(dmol_dfx[1:] - dmol_dfx[:-1])
+
+        return out
+
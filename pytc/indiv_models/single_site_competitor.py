@@ -52,18 +52,25 @@ class SingleSiteCompetitor(ITCModel):
         self._C_conc = self._titrate_species(self._C_cell,self._C_syringe)
 
 
-    @property
-    def dQ(self):
+    def _calc_dQ(self):
         """
         Calculate the heats that would be observed across shots for a given set
         of enthalpies and binding constants for each reaction.
         """
 
+        return self._dQ_batch(self.param_values)
+
+    def _dQ_batch(self,param):
+        """
+        Calculate heats for parameter values that are either scalars or
+        (num_samples,1) arrays.
+        """
+
         # ----- Determine mole fractions -----
-        S_conc_corr = self._S_conc*self.param_values["fx_competent"]
+        S_conc_corr = self._S_conc*param["fx_competent"]
 
-        c_a = self.param_values["K"]*S_conc_corr
-        c_b = self.param_values["Kcompetitor"]*S_conc_corr
+        c_a = param["K"]*S_conc_corr
+        c_b = param["Kcompetitor"]*S_conc_corr
         r_a = self._T_conc/S_conc_corr
         r_b = self._C_conc/S_conc_corr
 
@@ -77,9 +84,86 @@ class SingleSiteCompetitor(ITCModel):
         mol_fx_sc = r_b*mol_fx_s/(1/c_b + mol_fx_s)
 
         # ---- Relate mole fractions to heat -----
-        X = self.param_values["dH"]*(mol_fx_st[1:] - mol_fx_st[:-1])
-        Y = self.param_values["dHcompetitor"]*(mol_fx_sc[1:] - mol_fx_sc[:-1])
+        X = param["dH"]*(mol_fx_st[...,1:] - mol_fx_st[...,:-1])
+        Y = param["dHcompetitor"]*(mol_fx_sc[...,1:] - mol_fx_sc[...,:-1])
 
-        to_return = self._cell_volume*S_conc_corr[1:]*(X + Y) + self.dilution_heats
+        to_return = self._cell_volume*S_conc_corr[...,1:]*(X + Y) + self._dilution_heats(param)
 
         return to_return
+
+    @property
+    def dQ_jacobian(self):
+        """
+        Derivatives of dQ with respect to each parameter.  The free stationary
+        mole fraction x is a root of x**3 + alpha*x**2 + beta*x + gamma, so its
+        derivatives follow from implicit differentiation of that cubic.
+        """
+
+        param = self.param_values
+        fx = param["fx_competent"]
+
+        S_conc_corr = self._S_conc*fx
+
+        c_a = param["K"]*S_conc_corr
+        c_b = param["Kcompetitor"]*S_conc_corr
+        r_a = self._T_conc/S_conc_corr
+        r_b = self._C_conc/S_conc_corr
+
+        alpha = 1/c_a + 1/c_b + r_a + r_b - 1
+        beta = (r_a - 1)/c_b + (r_b - 1)/c_a + 1/(c_a*c_b)
+        gamma = -1/(c_a*c_b)
+        theta = np.arccos((-2*alpha**3 + 9*alpha*beta - 27*gamma)/(2*np.sqrt((alpha**2 - 3*beta)**3)))
+
+        mol_fx_s = (2*np.sqrt(alpha**2 - 3*beta) * np.cos(theta/3) - alpha)/3
+        mol_fx_st = r_a*mol_fx_s/(1/c_a + mol_fx_s)
+        mol_fx_sc = r_b*mol_fx_s/(1/c_b + mol_fx_s)
+
+        x = mol_fx_s
+        dcubic_dx = 3*x**2 + 2*alpha*x + beta
+
+        def mol_fx_derivs(dc_a,dc_b,dr_a,dr_b):
+            """
+            Derivatives of mol_fx_st and mol_fx_sc given derivatives of c_a,
+            c_b, r_a and r_b with respect to some parameter.
+            """
+
+            dcab = dc_a*c_b + c_a*dc_b
+
+            dalpha = -dc_a/c_a**2 - dc_b/c_b**2 + dr_a + dr_b
+            dbeta = dr_a/c_b - (r_a - 1)*dc_b/c_b**2 + \
+                    dr_b/c_a - (r_b - 1)*dc_a/c_a**2 - dcab/(c_a*c_b)**2
+            dgamma = dcab/(c_a*c_b)**2
+
+            dx = -(x**2*dalpha + x*dbeta + dgamma)/dcubic_dx
+
+            u_a = 1/c_a + x
+            u_b = 1/c_b + x
+            dst = (dr_a*x + r_a*dx)/u_a - r_a*x*(dx - dc_a/c_a**2)/u_a**2
+            dsc = (dr_b*x + r_b*dx)/u_b - r_b*x*(dx - dc_b/c_b**2)/u_b**2
+
+            return dst, dsc
+
+        zero = np.zeros(len(S_conc_corr))
+        dst_dK, dsc_dK = mol_fx_derivs(S_conc_corr,zero,zero,zero)
+        dst_dKc, dsc_dKc = mol_fx_derivs(zero,S_conc_corr,zero,zero)
+        dst_dfx, dsc_dfx = mol_fx_derivs(c_a/fx,c_b/fx,-r_a/fx,-r_b/fx)
+
+        dH = param["dH"]
+        dHc = param["dHcompetitor"]
+        scale = self._cell_volume*S_conc_corr[1:]
+
+        def heat_deriv(dst,dsc):
+            return scale*(dH*(dst[1:] - dst[:-1]) + dHc*(dsc[1:] - dsc[:-1]))
+
+        out = self._dilution_jacobian()
+        out["K"] = heat_deriv(dst_dK,dsc_dK)
+        out["Kcompetitor"] = heat_deriv(dst_dKc,dsc_dKc)
+        out["dH"] = scale*(mol_fx_st[1:] - mol_fx_st[:-1])
+        out["dHcompetitor"] = scale*(mol_fx_sc[1:] - mol_fx_sc[:-1])
+        out["fx_competent"] = heat_deriv(dst_dfx,dsc_dfx) + \
+                              self._cell_volume*self._S_conc[1:]* \
+                              (dH*(mol_fx_st[1:] - mol_fx_st[:-1]) +
+                               dHc*(mol_fx_sc[1:] - mol_fx_sc[:-1]))
+
+        return out
+
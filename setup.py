@@ -10,10 +10,19 @@ from setuptools import setup, find_packages
 from setuptools.extension import Extension
 import numpy.distutils.misc_util
 
-# set up binding polynomial C extension
+# set up binding polynomial C extension.  The batch entry point uses pthreads
+# on everything but Windows.  The extension is optional: if it does not build,
+# BindingPolynomial falls back to its numpy engine.
+thread_args = []
+if sys.platform != "win32":
+    thread_args = ["-pthread"]
+
 ext = Extension('pytc.indiv_models.bp_ext', 
       ['src/binding_polynomial.c',
-       'src/_bp_ext.c'])
+       'src/_bp_ext.c'],
+      extra_compile_args=thread_args,
+      extra_link_args=thread_args,
+      optional=True)
 
 # Need to add all dependencies to setup as we go!
 setup(name='pytc-fitter',
@@ -3,19 +3,47 @@
 #include <numpy/arrayobject.h>
 #include "binding_polynomial.h"
 #include <stdio.h>
+#include <string.h>
+
+#define WORKSPACE_NAME "bp_ext.workspace"
 
 // docstrings
 static char module_docstring[] = 
     "calculate binding polynomial fit";
 
 static char dQ_docstring[] = 
-    "Calculate the heats that would be observed across shots for a given set of enthalpies and binding constants for each reaction. This will work for an arbitrary-order binding polynomial.";
+    "dQ(workspace, cell_volume, dilution_heats, fit_beta, fit_dH, S_conc_corr, T_conc, final_array, solver)\n\n"
+    "Calculate the heats that would be observed across shots for a given set of enthalpies and binding constants for each reaction. This will work for an arbitrary-order binding polynomial. "
+    "final_array must be a writable, C-contiguous float64 array and is filled in place. An optional final argument selects the free titrant solver (SOLVER_BRENT or SOLVER_NEWTON).";
+
+static char workspace_docstring[] = 
+    "workspace(num_shots)\n\n"
+    "Create an opaque workspace holding the scratch buffers dQ needs for num_shots shots. Create it once and pass it to every dQ call.";
+
+static char free_titrant_docstring[] = 
+    "free_titrant(workspace)\n\n"
+    "Return a copy of the free titrant concentrations found by the last dQ call that used workspace.";
 
+static char dQ_batch_docstring[] = 
+    "dQ_batch(cell_volume, fit_beta, fit_dH, S_conc_corr, T_conc, dilution_heats, final_array, num_threads, solver)\n\n"
+    "Calculate heats for many stacked parameter sets or experiments at once. fit_beta and fit_dH are "
+    "num_samples x num_sites; S_conc_corr and T_conc are num_samples x num_shots; dilution_heats and "
+    "final_array are num_samples x (num_shots - 1); cell_volume has num_samples entries. final_array "
+    "must be a writable, C-contiguous float64 array and is filled in place. The GIL is released and "
+    "the rows are split across num_threads threads. An optional final argument selects the free titrant "
+    "solver (SOLVER_BRENT or SOLVER_NEWTON).";
+
+static PyObject *bp_ext_workspace(PyObject *self, PyObject *args);
+static PyObject *bp_ext_free_titrant(PyObject *self, PyObject *args);
 static PyObject *bp_ext_dQ(PyObject *self, PyObject *args);
+static PyObject *bp_ext_dQ_batch(PyObject *self, PyObject *args);
 
 // methods
 static PyMethodDef module_methods[] = {
+    {"workspace", bp_ext_workspace, METH_VARARGS, workspace_docstring},
+    {"free_titrant", bp_ext_free_titrant, METH_VARARGS, free_titrant_docstring},
     {"dQ", bp_ext_dQ, METH_VARARGS, dQ_docstring},
+    {"dQ_batch", bp_ext_dQ_batch, METH_VARARGS, dQ_batch_docstring},
     {NULL, NULL}
 };
 
@@ -41,71 +69,254 @@ PyMODINIT_FUNC PyInit_bp_ext(void)
     // Load numpy funcionality.
     import_array();
 
+    // Root finders for the free titrant concentration
+    PyModule_AddIntConstant(module, "SOLVER_BRENT", BP_SOLVER_BRENT);
+    PyModule_AddIntConstant(module, "SOLVER_NEWTON", BP_SOLVER_NEWTON);
+
     return module;
 }
 
+static void bp_ext_workspace_destructor(PyObject *capsule)
+{
+    bp_workspace_free((bp_workspace *)PyCapsule_GetPointer(capsule, WORKSPACE_NAME));
+}
+
+static bp_workspace *get_workspace(PyObject *capsule)
+{
+    if (!PyCapsule_IsValid(capsule, WORKSPACE_NAME)){
+        PyErr_SetString(PyExc_TypeError, "expected a workspace created by bp_ext.workspace");
+        return NULL;
+    }
+
+    return (bp_workspace *)PyCapsule_GetPointer(capsule, WORKSPACE_NAME);
+}
+
+static PyObject *bp_ext_workspace(PyObject *self, PyObject *args)
+{
+    int num_shots;
+    bp_workspace *ws;
+    PyObject *capsule;
+
+    if (!PyArg_ParseTuple(args, "i:workspace", &num_shots)){
+        return NULL;
+    }
+
+    if (num_shots < 1){
+        PyErr_SetString(PyExc_ValueError, "num_shots must be a positive integer");
+        return NULL;
+    }
+
+    ws = bp_workspace_new(num_shots);
+    if (ws == NULL){
+        return PyErr_NoMemory();
+    }
+
+    capsule = PyCapsule_New(ws, WORKSPACE_NAME, bp_ext_workspace_destructor);
+    if (capsule == NULL){
+        bp_workspace_free(ws);
+        return NULL;
+    }
+
+    return capsule;
+}
+
+static PyObject *bp_ext_free_titrant(PyObject *self, PyObject *args)
+{
+    PyObject *capsule, *out;
+    bp_workspace *ws;
+    npy_intp dims[1];
+
+    if (!PyArg_ParseTuple(args, "O:free_titrant", &capsule)){
+        return NULL;
+    }
+
+    ws = get_workspace(capsule);
+    if (ws == NULL){
+        return NULL;
+    }
+
+    dims[0] = ws->num_shots;
+    out = PyArray_SimpleNew(1, dims, NPY_DOUBLE);
+    if (out == NULL){
+        return NULL;
+    }
+    memcpy(PyArray_DATA((PyArrayObject *)out), ws->T_conc_free, ws->num_shots*sizeof(double));
+
+    return out;
+}
+
 static PyObject *bp_ext_dQ(PyObject *self, PyObject *args)
 {   
-    int num_sites, num_shots, size_T_conc;
+    int num_sites, num_shots, solver = BP_SOLVER_BRENT;
     double cell_volume;
-    PyObject *fit_beta_obj, *fit_dH_obj, *S_conc_corr, *T_conc, *T_conc_free, *dilution_heats, *final_array;
+    bp_workspace *ws;
+    PyObject *capsule, *fit_beta_obj, *fit_dH_obj, *S_conc_corr_obj, *T_conc_obj, *dilution_heats_obj;
+    PyObject *final_array_obj;
+    PyArrayObject *final_array;
 
-    if (!PyArg_ParseTuple(args, "diiiOOOOOOO:dQ", &cell_volume, &num_shots, &size_T_conc, &num_sites, 
-                                        &dilution_heats, &fit_beta_obj, &fit_dH_obj, &S_conc_corr, &T_conc, 
-                                        &T_conc_free, &final_array)){
+    if (!PyArg_ParseTuple(args, "OdOOOOOO|i:dQ", &capsule, &cell_volume, &dilution_heats_obj,
+                                        &fit_beta_obj, &fit_dH_obj, &S_conc_corr_obj, &T_conc_obj,
+                                        &final_array_obj, &solver)){
         return NULL;
     }
 
-    // PyObjects to numpy arrays
-    PyObject *fit_beta_array = PyArray_FROM_OTF(fit_beta_obj, NPY_DOUBLE, NPY_IN_ARRAY);
-    PyObject *fit_dH_array = PyArray_FROM_OTF(fit_dH_obj, NPY_DOUBLE, NPY_IN_ARRAY);
-    PyObject *T_conc_array = PyArray_FROM_OTF(T_conc, NPY_DOUBLE, NPY_IN_ARRAY);
-    PyObject *T_conc_free_array = PyArray_FROM_OTF(T_conc_free, NPY_DOUBLE, NPY_IN_ARRAY);
-    PyObject *S_conc_corr_array = PyArray_FROM_OTF(S_conc_corr, NPY_DOUBLE, NPY_IN_ARRAY);
-    PyObject *dilution_heats_array = PyArray_FROM_OTF(dilution_heats, NPY_DOUBLE, NPY_IN_ARRAY);
-    PyObject *final_array_obj = PyArray_FROM_OTF(final_array, NPY_DOUBLE, NPY_IN_ARRAY);
+    ws = get_workspace(capsule);
+    if (ws == NULL){
+        return NULL;
+    }
+    num_shots = ws->num_shots;
 
-    // throw exception if cast failed
-    if (fit_beta_array == NULL || fit_dH_array == NULL || T_conc_array == NULL || T_conc_free_array == NULL || 
-        S_conc_corr_array == NULL || dilution_heats_array == NULL || final_array_obj == NULL) {
-        Py_XDECREF(fit_beta_array);
-        Py_XDECREF(fit_dH_array);
-        Py_XDECREF(T_conc_array);
-        Py_XDECREF(T_conc_free_array);
-        Py_XDECREF(S_conc_corr_array);
-        Py_XDECREF(dilution_heats_array);
-        Py_XDECREF(final_array_obj);
+    // The output is written in place, so it has to be usable as-is
+    if (!PyArray_Check(final_array_obj)){
+        PyErr_SetString(PyExc_TypeError, "final_array must be a numpy array");
+        return NULL;
+    }
+    final_array = (PyArrayObject *)final_array_obj;
+    if (PyArray_TYPE(final_array) != NPY_DOUBLE || !PyArray_ISCARRAY(final_array) ||
+        PyArray_SIZE(final_array) != num_shots - 1){
+        PyErr_SetString(PyExc_ValueError, "final_array must be a writable, C-contiguous float64 array with num_shots - 1 entries");
         return NULL;
     }
 
-    // pointers 
-    double *fit_beta = (double*)PyArray_DATA(fit_beta_array);
-    double *fit_dH = (double*)PyArray_DATA(fit_dH_array);
-    double *T_conc_p = (double*)PyArray_DATA(T_conc_array);
-    double *T_conc_free_p = (double*)PyArray_DATA(T_conc_free_array);
-    double *S_conc_corr_p = (double*)PyArray_DATA(S_conc_corr_array);
-    double *dilution_heats_p = (double*)PyArray_DATA(dilution_heats_array);
-    double *final_array_p = (double*)PyArray_DATA(final_array_obj);
+    // PyObjects to numpy arrays.  These are no-ops for arrays that are
+    // already contiguous doubles.
+    PyArrayObject *fit_beta = (PyArrayObject *)PyArray_FROM_OTF(fit_beta_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *fit_dH = (PyArrayObject *)PyArray_FROM_OTF(fit_dH_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *S_conc_corr = (PyArrayObject *)PyArray_FROM_OTF(S_conc_corr_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *T_conc = (PyArrayObject *)PyArray_FROM_OTF(T_conc_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *dilution_heats = (PyArrayObject *)PyArray_FROM_OTF(dilution_heats_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
 
-    // call function 
-    dQ(fit_beta, fit_dH, S_conc_corr_p, T_conc_p, T_conc_free_p, cell_volume, dilution_heats_p, 
-        num_sites, num_shots, size_T_conc, final_array_p);
+    // throw exception if cast failed
+    if (fit_beta == NULL || fit_dH == NULL || S_conc_corr == NULL || T_conc == NULL ||
+        dilution_heats == NULL){
+        goto fail;
+    }
+
+    num_sites = (int)PyArray_SIZE(fit_beta);
+    if (PyArray_SIZE(fit_dH) != num_sites || PyArray_SIZE(S_conc_corr) != num_shots ||
+        PyArray_SIZE(T_conc) != num_shots || PyArray_SIZE(dilution_heats) != num_shots - 1){
+        PyErr_SetString(PyExc_ValueError, "array sizes are inconsistent with the workspace");
+        goto fail;
+    }
+
+    // call function without holding the GIL, so experiments with different
+    // workspaces can be calculated concurrently from python threads
+    Py_BEGIN_ALLOW_THREADS
+    dQ((double *)PyArray_DATA(fit_beta), (double *)PyArray_DATA(fit_dH),
+       (double *)PyArray_DATA(S_conc_corr), (double *)PyArray_DATA(T_conc), ws->T_conc_free,
+       cell_volume, (double *)PyArray_DATA(dilution_heats), num_sites, num_shots, num_shots,
+       (double *)PyArray_DATA(final_array), solver);
+    Py_END_ALLOW_THREADS
 
     // clean up 
-    Py_DECREF(fit_beta_array);
-    Py_DECREF(fit_dH_array);
-    Py_DECREF(T_conc_array);
-    Py_DECREF(T_conc_free_array);
-    Py_DECREF(S_conc_corr_array);
-    Py_DECREF(dilution_heats_array);
+    Py_DECREF(fit_beta);
+    Py_DECREF(fit_dH);
+    Py_DECREF(S_conc_corr);
+    Py_DECREF(T_conc);
+    Py_DECREF(dilution_heats);
+
+    Py_INCREF(final_array_obj);
+    return final_array_obj;
+
+fail:
+    Py_XDECREF(fit_beta);
+    Py_XDECREF(fit_dH);
+    Py_XDECREF(S_conc_corr);
+    Py_XDECREF(T_conc);
+    Py_XDECREF(dilution_heats);
+    return NULL;
+}
+
+static PyObject *bp_ext_dQ_batch(PyObject *self, PyObject *args)
+{
+    int num_threads, num_samples, num_sites, num_shots, status, solver = BP_SOLVER_BRENT;
+    PyObject *cell_volume_obj, *fit_beta_obj, *fit_dH_obj, *S_conc_corr_obj, *T_conc_obj;
+    PyObject *dilution_heats_obj, *final_array_obj;
+    PyArrayObject *final_array;
 
-    // check errors
-    /*if (value == NULL){
-        PyErr_SetString(PyExc_RuntimeError, "object return null");
+    if (!PyArg_ParseTuple(args, "OOOOOOOi|i:dQ_batch", &cell_volume_obj, &fit_beta_obj, &fit_dH_obj,
+                                        &S_conc_corr_obj, &T_conc_obj, &dilution_heats_obj,
+                                        &final_array_obj, &num_threads, &solver)){
+        return NULL;
+    }
 
+    // The output is written in place, so it has to be usable as-is
+    if (!PyArray_Check(final_array_obj)){
+        PyErr_SetString(PyExc_TypeError, "final_array must be a numpy array");
         return NULL;
-    }*/
+    }
+    final_array = (PyArrayObject *)final_array_obj;
+    if (PyArray_TYPE(final_array) != NPY_DOUBLE || !PyArray_ISCARRAY(final_array) ||
+        PyArray_NDIM(final_array) != 2){
+        PyErr_SetString(PyExc_ValueError, "final_array must be a writable, C-contiguous, 2d float64 array");
+        return NULL;
+    }
+
+    // PyObjects to numpy arrays
+    PyArrayObject *cell_volume = (PyArrayObject *)PyArray_FROM_OTF(cell_volume_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *fit_beta = (PyArrayObject *)PyArray_FROM_OTF(fit_beta_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *fit_dH = (PyArrayObject *)PyArray_FROM_OTF(fit_dH_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *S_conc_corr = (PyArrayObject *)PyArray_FROM_OTF(S_conc_corr_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *T_conc = (PyArrayObject *)PyArray_FROM_OTF(T_conc_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+    PyArrayObject *dilution_heats = (PyArrayObject *)PyArray_FROM_OTF(dilution_heats_obj, NPY_DOUBLE, NPY_ARRAY_IN_ARRAY);
+
+    if (cell_volume == NULL || fit_beta == NULL || fit_dH == NULL || S_conc_corr == NULL ||
+        T_conc == NULL || dilution_heats == NULL){
+        goto fail;
+    }
+
+    // check shapes
+    if (PyArray_NDIM(fit_beta) != 2 || PyArray_NDIM(fit_dH) != 2 || PyArray_NDIM(S_conc_corr) != 2 ||
+        PyArray_NDIM(T_conc) != 2 || PyArray_NDIM(dilution_heats) != 2 || PyArray_NDIM(cell_volume) != 1){
+        PyErr_SetString(PyExc_ValueError, "cell_volume must be 1d; all other arrays must be 2d");
+        goto fail;
+    }
+
+    num_samples = (int)PyArray_DIM(fit_beta, 0);
+    num_sites = (int)PyArray_DIM(fit_beta, 1);
+    num_shots = (int)PyArray_DIM(S_conc_corr, 1);
+
+    if (PyArray_DIM(fit_dH, 0) != num_samples || PyArray_DIM(fit_dH, 1) != num_sites ||
+        PyArray_DIM(S_conc_corr, 0) != num_samples ||
+        PyArray_DIM(T_conc, 0) != num_samples || PyArray_DIM(T_conc, 1) != num_shots ||
+        PyArray_DIM(dilution_heats, 0) != num_samples || PyArray_DIM(dilution_heats, 1) != num_shots - 1 ||
+        PyArray_DIM(final_array, 0) != num_samples || PyArray_DIM(final_array, 1) != num_shots - 1 ||
+        PyArray_DIM(cell_volume, 0) != num_samples || num_shots < 1){
+        PyErr_SetString(PyExc_ValueError, "array shapes are inconsistent");
+        goto fail;
+    }
+
+    // call function without holding the GIL
+    Py_BEGIN_ALLOW_THREADS
+    status = dQ_batch((double *)PyArray_DATA(fit_beta), (double *)PyArray_DATA(fit_dH),
+                      (double *)PyArray_DATA(S_conc_corr), (double *)PyArray_DATA(T_conc),
+                      (double *)PyArray_DATA(cell_volume), (double *)PyArray_DATA(dilution_heats),
+                      num_sites, num_shots, num_samples, num_threads,
+                      (double *)PyArray_DATA(final_array), solver);
+    Py_END_ALLOW_THREADS
+
+    if (status != 0){
+        PyErr_NoMemory();
+        goto fail;
+    }
+
+    // clean up
+    Py_DECREF(cell_volume);
+    Py_DECREF(fit_beta);
+    Py_DECREF(fit_dH);
+    Py_DECREF(S_conc_corr);
+    Py_DECREF(T_conc);
+    Py_DECREF(dilution_heats);
+
+    Py_INCREF(final_array_obj);
+    return final_array_obj;
 
-    // build output and return
-    return Py_BuildValue("O", final_array_obj);
+fail:
+    Py_XDECREF(cell_volume);
+    Py_XDECREF(fit_beta);
+    Py_XDECREF(fit_dH);
+    Py_XDECREF(S_conc_corr);
+    Py_XDECREF(T_conc);
+    Py_XDECREF(dilution_heats);
+    return NULL;
 }
@@ -3,8 +3,47 @@
 #include <stdlib.h>
 #include <stdio.h>
 
+#ifndef _WIN32
+#include <pthread.h>
+#endif
+
 #define MIN(a, b) ((a) < (b) ? (a) : (b))
 
+double bp_eval(double T_free, dqdt_args *args, double *deriv){
+    /*
+    Evaluate 0 = T_free + S_total*(dln(P)/dln(T_free)) - T_total (see dQdT)
+    using Horner's rule.  With P = 1 + sum_i beta_i*T_free**i, define
+
+        N  = sum_i i*beta_i*T_free**i        (so dln(P)/dln(T_free) = N/P)
+        N' = sum_i i*i*beta_i*T_free**(i-1)
+        P' = sum_i i*beta_i*T_free**(i-1)
+
+    If deriv is not NULL, the derivative with respect to T_free,
+    1 + S_total*(N'*P - N*P')/P**2, is written to it.
+    */
+
+    int i;
+    double P_acc = 0.0, N_acc = 0.0, dN_acc = 0.0;
+    double P, N, b;
+
+    for (i = args->num_beta; i > 0; i--){
+        b = args->fit_beta_array[i-1];
+        P_acc  =  P_acc*T_free + b;
+        N_acc  =  N_acc*T_free + i*b;
+        dN_acc = dN_acc*T_free + i*i*b;
+    }
+
+    P = 1 + T_free*P_acc;
+    N = T_free*N_acc;
+
+    if (deriv != NULL){
+        // P' is N_acc
+        *deriv = 1 + args->S_total*(dN_acc*P - N*N_acc)/(P*P);
+    }
+
+    return T_free + args->S_total*N/P - args->T_total;
+}
+
 double dQdT(double T_free, dqdt_args *args){
     /*
     T_total = T_free + S_total*(dln(P)/dln(T_free)), so:
@@ -16,22 +55,59 @@ double dQdT(double T_free, dqdt_args *args){
 
         P = (beta1*T_free**1) *  b2*T**2 
     */
-    int i;
-    double numerator, denominator, bt, P;
 
-    numerator = 0;
-    denominator = 1;
+    return bp_eval(T_free, args, NULL);
+
+}
 
-    for (i = 0; i < args->num_beta; i++){
-        bt = args->fit_beta_array[i]*pow(T_free,(i+1)); 
-        numerator   += (i+1)*bt;
-        denominator +=       bt;
+double newton_func(double x0, double xa, double xb, dqdt_args *args) {
+    /*
+    Safeguarded Newton solve for the free titrant concentration, starting from
+    x0.  The function is increasing in T_free, so the bracket [xa,xb] (with
+    f(xa) < 0 < f(xb)) shrinks with every evaluation.  If a Newton step leaves
+    the bracket, finish the solve with Brent's method on the current bracket.
+    */
+
+    double x = x0, xnew, f, df, step;
+    double xtol = 2e-12;
+    // 4*finfo(float).eps
+    double rtol = 8.8817841970012523e-16;
+    int i;
+
+    if (!(x >= xa && x <= xb)){
+        x = xa;
     }
 
-    P = numerator/denominator;
+    for (i = 0; i < 100; i++){
+
+        f = bp_eval(x, args, &df);
+        if (f == 0){
+            return x;
+        }
+
+        // Tighten bracket
+        if (f < 0){
+            xa = x;
+        } else {
+            xb = x;
+        }
+
+        step = f/df;
+        xnew = x - step;
+
+        // Step left the valid interval; fall back to bracketing
+        if (!(df > 0) || !(xnew > xa && xnew < xb)){
+            return brent_func(dQdT, xa, xb, args);
+        }
 
-    return T_free + args->S_total*P - args->T_total;
+        if (fabs(step) < (xtol + rtol*fabs(xnew))/2){
+            return xnew;
+        }
 
+        x = xnew;
+    }
+
+    return x;
 }
 
 double brent_func(callback_type f, double xa, double xb, dqdt_args *args) {
@@ -126,15 +202,20 @@ double brent_func(callback_type f, double xa, double xb, dqdt_args *args) {
     return xcur;
 }
 
-void *dQ(double *fit_beta_obj, double *fit_dH_obj, double *S_conc_corr, double *T_conc, 
+void dQ(double *fit_beta_obj, double *fit_dH_obj, double *S_conc_corr, double *T_conc, 
             double *T_conc_free, double cell_volume, double *dilution_heats, int num_sites, 
-            int num_shots, int size_T_conc, double *final_array){
+            int num_shots, int size_T_conc, double *final_array, int solver){
+    /*
+    Calculate heats for one parameter set.  T_conc_free (num_shots long) is
+    filled with the free titrant concentration at each shot and final_array
+    (num_shots - 1 long) with the heats.  No memory is allocated, so callers
+    can reuse the same buffers across calls (see bp_workspace).
+    */
 
-    double min_value, max_value, bt, T;
+    double min_value, max_value, bt, T, T_power, T_prev = 0.0;
+    double numerator, denominator, avg_dH, prev_avg_dH = 0.0;
     int i, j, lastT;
-    int num_shots_reduced = num_shots - 1;
     float DELTA = 0.0, TOLERANCE = 1e-12;
-    double *numerator, *denominator, *avg_dH, *subset_first_dH, *subset_last_dH, *X, *subset_s_conc;
 
     dqdt_args args;
     args.S_total = 0.0;
@@ -142,23 +223,6 @@ void *dQ(double *fit_beta_obj, double *fit_dH_obj, double *S_conc_corr, double *
     args.fit_beta_array = fit_beta_obj;
     args.num_beta = num_sites;
 
-    // num and denom arrays
-    numerator = (double *)malloc(num_shots*sizeof(double));
-    if (numerator== NULL){
-        return NULL;
-    }
-    for (i = 0; i < num_shots; i++){
-        numerator[i] = 0.0;
-    }
-    denominator = (double *)malloc(num_shots*sizeof(double));
-    if (denominator == NULL){
-        return NULL;
-    }
-
-    for (i = 0; i < num_shots; i++){
-        denominator[i] = 1.0;
-    }
-    
     for (i = 0; i < num_shots; i++){
 
         if (fabs(T_conc[i] - DELTA) < TOLERANCE){
@@ -195,80 +259,185 @@ void *dQ(double *fit_beta_obj, double *fit_dH_obj, double *S_conc_corr, double *
             continue;
         }
 
-        //double args[2] = {S_conc_corr[i], T_conc[i]};
-        lastT = size_T_conc - 1;
-        T = brent_func(dQdT, 0 , T_conc[lastT], &args);
+        if (solver == BP_SOLVER_NEWTON){
+            // Free titrant rises across the titration, so start from the
+            // root of the previous shot.
+            T = newton_func(MIN(T_prev, T_conc[i]), 0, T_conc[i], &args);
+        } else {
+            //double args[2] = {S_conc_corr[i], T_conc[i]};
+            lastT = size_T_conc - 1;
+            T = brent_func(dQdT, 0 , T_conc[lastT], &args);
+        }
 
         // numerical problems sometimes make T slightly bigger than the total
         // concentration, so bring down to the correct value
         if (T > T_conc[i]) { T = T_conc[i]; }
         T_conc_free[i] = T;
+        T_prev = T;
     }
 
-    // calculate the average enthalpy change
-    for (i = 0; i < num_sites; i++){
-        for(j = 0; j < num_shots; j++){
-            bt = fit_beta_obj[i]*pow(T_conc_free[j],(i+1));
-            numerator[j] += fit_dH_obj[i]*bt;
-            denominator[j] += bt;
+    // calculate the average enthalpy change, building up powers of T_free
+    // rather than calling pow for every site.  The heat for shot j-1 is
+    // cell_volume*S_conc_corr[j]*(avg_dH[j] - avg_dH[j-1]) + dilution_heats[j-1],
+    // written straight into final_array.
+    for (j = 0; j < num_shots; j++){
+        numerator = 0.0;
+        denominator = 1.0;
+        T_power = 1.0;
+        for (i = 0; i < num_sites; i++){
+            T_power *= T_conc_free[j];
+            bt = fit_beta_obj[i]*T_power;
+            numerator += fit_dH_obj[i]*bt;
+            denominator += bt;
         }
+        avg_dH = numerator/denominator;
+
+        if (j > 0){
+            final_array[j-1] = cell_volume*S_conc_corr[j]*(avg_dH - prev_avg_dH) + dilution_heats[j-1];
+        }
+        prev_avg_dH = avg_dH;
     }
+}
 
-    avg_dH = (double *)malloc(num_shots*sizeof(double));
-    if (avg_dH == NULL){
+bp_workspace *bp_workspace_new(int num_shots){
+    /*
+    Allocate a workspace for num_shots shots.  Returns NULL if memory could
+    not be allocated.
+    */
+
+    bp_workspace *ws = (bp_workspace *)malloc(sizeof(bp_workspace));
+    if (ws == NULL){
         return NULL;
     }
 
-    for (i = 0; i < num_shots; i++){
-        avg_dH[i] = numerator[i]/denominator[i];
-    }
-    // avg_dh[1:]
-    subset_first_dH = (double *)malloc(num_shots_reduced*sizeof(double));
-    if (subset_first_dH == NULL){
+    ws->num_shots = num_shots;
+    ws->T_conc_free = (double *)calloc((size_t)num_shots, sizeof(double));
+    if (ws->T_conc_free == NULL){
+        free(ws);
         return NULL;
     }
-    for(i = 0; i < num_shots_reduced; i++){
-        subset_first_dH[i] = avg_dH[i+1];
+
+    return ws;
+}
+
+void bp_workspace_free(bp_workspace *ws){
+
+    if (ws == NULL){
+        return;
     }
 
-    // avg_dh[:-1]
-    subset_last_dH = (double *)malloc(num_shots_reduced*sizeof(double));
-    if (subset_last_dH == NULL){
-        return NULL;
+    free(ws->T_conc_free);
+    free(ws);
+}
+
+static void *dQ_batch_worker(void *ptr){
+    /*
+    Solve the rows [start,stop) of a batch.  Each worker has its own free
+    titrant scratch array, so workers never share writable memory.
+    */
+
+    dQ_batch_args *a = (dQ_batch_args *)ptr;
+    int i;
+    int ns = a->num_sites;
+    int nt = a->num_shots;
+
+    for (i = a->start; i < a->stop; i++){
+        dQ(a->fit_beta + i*ns, a->fit_dH + i*ns, a->S_conc_corr + i*nt,
+           a->T_conc + i*nt, a->T_conc_free, a->cell_volume[i],
+           a->dilution_heats + i*(nt-1), ns, nt, nt, a->final_array + i*(nt-1),
+           a->solver);
+    }
+
+    return NULL;
+}
+
+int dQ_batch(double *fit_beta, double *fit_dH, double *S_conc_corr, double *T_conc,
+             double *cell_volume, double *dilution_heats, int num_sites, int num_shots,
+             int num_samples, int num_threads, double *final_array, int solver){
+    /*
+    Calculate heats for num_samples stacked parameter sets (or experiments).
+    fit_beta and fit_dH are num_samples x num_sites, S_conc_corr and T_conc are
+    num_samples x num_shots, dilution_heats and final_array are num_samples x
+    (num_shots - 1) and cell_volume has one entry per sample.  All arrays are
+    C-contiguous.  Rows are split into contiguous chunks, one per thread.
+    Returns 0 on success, -1 if memory could not be allocated.
+    */
+
+    int i, chunk;
+    double *scratch;
+    dQ_batch_args *args;
+
+    if (num_samples < 1){
+        return 0;
+    }
+    if (num_threads < 1){
+        num_threads = 1;
     }
-    for(i = 0; i < num_shots_reduced; i++){
-        subset_last_dH[i] = avg_dH[i];
+    if (num_threads > num_samples){
+        num_threads = num_samples;
     }
 
-    // avg_dh[1:]-avg_dh[:-1];
-    X = (double *)malloc(num_shots_reduced*sizeof(double));
-    if (X == NULL){
-        return NULL;
+    scratch = (double *)malloc((size_t)num_threads*num_shots*sizeof(double));
+    args = (dQ_batch_args *)malloc((size_t)num_threads*sizeof(dQ_batch_args));
+    if (scratch == NULL || args == NULL){
+        free(scratch);
+        free(args);
+        return -1;
     }
-    for (i = 0; i < num_shots_reduced; i++){
-        X[i] = subset_first_dH[i] - subset_last_dH[i];
+
+    chunk = (num_samples + num_threads - 1)/num_threads;
+    for (i = 0; i < num_threads; i++){
+        args[i].fit_beta = fit_beta;
+        args[i].fit_dH = fit_dH;
+        args[i].S_conc_corr = S_conc_corr;
+        args[i].T_conc = T_conc;
+        args[i].T_conc_free = scratch + (size_t)i*num_shots;
+        args[i].cell_volume = cell_volume;
+        args[i].dilution_heats = dilution_heats;
+        args[i].final_array = final_array;
+        args[i].num_sites = num_sites;
+        args[i].num_shots = num_shots;
+        args[i].solver = solver;
+        args[i].start = MIN(i*chunk, num_samples);
+        args[i].stop = MIN((i+1)*chunk, num_samples);
     }
 
-    // S_conc_corr[1:]
-    subset_s_conc = (double *)malloc(num_shots_reduced*sizeof(double));
-    if (subset_s_conc == NULL){
-        return NULL;
+#ifdef _WIN32
+    // No pthreads; solve every chunk on the calling thread.
+    for (i = 0; i < num_threads; i++){
+        dQ_batch_worker(&args[i]);
     }
-    for(i = 0; i < num_shots_reduced; i++){
-        subset_s_conc[i] = S_conc_corr[i+1];
+#else
+    pthread_t *threads = (pthread_t *)malloc((size_t)num_threads*sizeof(pthread_t));
+    int *started = (int *)calloc((size_t)num_threads, sizeof(int));
+    if (threads == NULL || started == NULL){
+        free(threads);
+        free(started);
+        free(scratch);
+        free(args);
+        return -1;
     }
 
-    for(i = 0; i < num_shots_reduced; i++){
-        final_array[i] = cell_volume*subset_s_conc[i]*X[i] + dilution_heats[i];
+    // Run the first chunk on this thread and the rest on workers.  If a
+    // thread cannot be started, solve its chunk here instead.
+    for (i = 1; i < num_threads; i++){
+        started[i] = (pthread_create(&threads[i], NULL, dQ_batch_worker, &args[i]) == 0);
+    }
+    dQ_batch_worker(&args[0]);
+    for (i = 1; i < num_threads; i++){
+        if (started[i]){
+            pthread_join(threads[i], NULL);
+        } else {
+            dQ_batch_worker(&args[i]);
+        }
     }
 
-    // clean up
-    // free memory
-    free(avg_dH);
-    free(subset_first_dH);
-    free(subset_last_dH);
-    free(X);
-    free(subset_s_conc);
-    free(numerator);
-    free(denominator);
+    free(threads);
+    free(started);
+#endif
+
+    free(scratch);
+    free(args);
+
+    return 0;
 }
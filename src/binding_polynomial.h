@@ -1,3 +1,7 @@
+// Root finders for the free titrant concentration
+#define BP_SOLVER_BRENT 0
+#define BP_SOLVER_NEWTON 1
+
 typedef struct {
 
     double S_total, T_total;
@@ -6,12 +10,40 @@ typedef struct {
 
 } dqdt_args;
 
+typedef struct {
+
+    double *fit_beta, *fit_dH, *S_conc_corr, *T_conc, *T_conc_free;
+    double *cell_volume, *dilution_heats, *final_array;
+    int num_sites, num_shots, start, stop, solver;
+
+} dQ_batch_args;
+
+// Buffers that are reused between dQ calls on the same shot count
+typedef struct {
+
+    int num_shots;
+    double *T_conc_free;
+
+} bp_workspace;
+
 typedef double (*callback_type)(double,dqdt_args *);
 
+double bp_eval(double T_free, dqdt_args *args, double *deriv);
+
 double dQdT(double T_free, dqdt_args *args);
 
-void *dQ(double *fit_beta_obj, double *fit_dH_obj, double *S_conc_corr, double *T_conc, 
+void dQ(double *fit_beta_obj, double *fit_dH_obj, double *S_conc_corr, double *T_conc, 
             double *T_conc_free, double cell_volume, double *dilution_heats, int num_sites, 
-            int num_shots, int size_T_conc, double *final_array);
+            int num_shots, int size_T_conc, double *final_array, int solver);
+
+bp_workspace *bp_workspace_new(int num_shots);
+
+void bp_workspace_free(bp_workspace *ws);
+
+int dQ_batch(double *fit_beta, double *fit_dH, double *S_conc_corr, double *T_conc,
+             double *cell_volume, double *dilution_heats, int num_sites, int num_shots,
+             int num_samples, int num_threads, double *final_array, int solver);
+
+double brent_func(callback_type f, double xa, double xb, dqdt_args *args);
 
-double brent_func(callback_type f, double xa, double xb, dqdt_args *args);
\ No newline at end of file
+double newton_func(double x0, double xa, double xb, dqdt_args *args);
\ No newline at end of file
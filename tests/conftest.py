@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import matplotlib
+matplotlib.use("Agg")
+
+import pytc
+from pytc.indiv_models import SingleSite
+from pytc.global_connectors import VantHoff
+
+# Injection protocol used for the synthetic experiments
+SHOTS = [2.0] + [8.0 for i in range(20)]
+
+def write_dh(path,model_class,param,temperature=25.0,noise=0.0,seed=0,
+             **model_kwargs):
+    """
+    Write the heats calculated by model_class (with the values in param) to
+    an Origin .DH file at path, adding normal noise with standard deviation
+    noise.
+    """
+
+    model = model_class(S_cell=0.1e-3,T_syringe=1.5e-3,cell_volume=1400.0,
+                        shot_volumes=SHOTS,**model_kwargs)
+    model.update_values(param)
+
+    heats = np.array(model.dQ) + np.random.RandomState(seed).normal(0,noise,len(SHOTS))
+
+    with open(path,"w") as f:
+        f.write("header\nheader\n{},{},{},{}\nheader\nheader\n".format(temperature,0.1,1.5,1.4))
+        for shot, heat in zip(SHOTS,heats):
+            f.write("{},{}\n".format(shot,heat))
+
+    return str(path)
+
+def van_t_hoff_K(K_ref,dH,temperature,reference_temp=298.15):
+    """
+    Binding constant at temperature (C) given K at the reference temperature.
+    """
+
+    T = temperature + 273.15
+    return K_ref*np.exp(-(dH/1.9872036)*(1/T - 1/reference_temp))
+
+def build_van_t_hoff_fit(directory,num_expt=3,noise=0.3,**kwargs):
+    """
+    GlobalFit of num_expt single-site experiments at different temperatures,
+    with K and dH linked through a VantHoff connector and fx_competent shared.
+    """
+
+    g = pytc.GlobalFit(**kwargs)
+    vh = VantHoff("vh")
+
+    experiments = []
+    for i, T in enumerate(np.linspace(10,35,num_expt)):
+        param = {"K":van_t_hoff_K(1e6,-6000,T),"dH":-6000,"fx_competent":0.95}
+        path = write_dh(directory/"vh{}.DH".format(i),SingleSite,param,
+                        temperature=T,noise=noise,seed=i)
+        e = pytc.ITCExperiment(path,SingleSite)
+        g.add_experiment(e)
+        g.link_to_global(e,"K",vh.K)
+        g.link_to_global(e,"dH",vh.dH)
+        g.link_to_global(e,"fx_competent","fx")
+        experiments.append(e)
+
+    g.update_guess("vh_K_ref",5e5)
+    g.update_guess("vh_dH_vanthoff",-4000)
+
+    return g, vh, experiments
+
+@pytest.fixture
+def van_t_hoff_fit(tmp_path):
+    """
+    Unfit GlobalFit with three linked single-site experiments.
+    """
+
+    return build_van_t_hoff_fit(tmp_path)
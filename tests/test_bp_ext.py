@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from pytc.indiv_models import BindingPolynomial
+
+bp_ext = pytest.importorskip("pytc.indiv_models.bp_ext")
+
+from conftest import SHOTS
+
+def _model(**kwargs):
+
+    m = BindingPolynomial(num_sites=3,S_cell=1e-4,T_syringe=1.5e-3,
+                          cell_volume=1400.0,shot_volumes=SHOTS,**kwargs)
+    m.update_values({"beta1":1e6,"beta2":1e11,"beta3":1e15,
+                     "dH1":-5000.0,"dH2":-8000.0,"dH3":-9000.0,
+                     "fx_competent":0.9,"dilution_heat":50.0})
+
+    return m
+
+def _samples(m,num_samples):
+
+    values = np.array(list(m.param_values.values()))
+    scale = np.random.RandomState(0).uniform(0.5,1.5,(num_samples,len(values)))
+
+    return values*scale
+
+def test_dQ_batch_threads_match_serial():
+
+    param = _samples(_model(),17)
+
+    serial = _model(num_threads=1).dQ_batch(param)
+    threaded = _model(num_threads=4).dQ_batch(param)
+
+    assert np.array_equal(serial,threaded)
+
+    m = _model()
+    for i in range(len(param)):
+        m.update_values(dict(zip(m.param_names,param[i])))
+        assert np.allclose(serial[i],m.dQ,rtol=1e-12,atol=0)
+
+def test_dQ_batch_rejects_inconsistent_shapes():
+
+    m = _model()
+    num_shots = len(m._S_conc)
+    ones = np.ones((2,num_shots))
+
+    with pytest.raises(ValueError):
+        bp_ext.dQ_batch(np.ones(2),np.ones((2,1)),np.ones((2,1)),ones,ones,
+                        np.ones((2,num_shots - 1)),np.zeros((3,num_shots - 1)),
+                        1,bp_ext.SOLVER_NEWTON)
+
+def test_newton_solver_matches_brent():
+
+    param = _samples(_model(),10)
+
+    newton = _model(solver="newton").dQ_batch(param)
+    brent = _model(solver="brent").dQ_batch(param)
+
+    # Brent's method stops at a looser tolerance than Newton steps
+    assert np.allclose(newton,brent,rtol=1e-5,atol=1e-6)
+
+@pytest.mark.parametrize("solver,rtol",[("newton",1e-10),("brent",1e-5)])
+def test_free_titrant_satisfies_mass_balance(solver,rtol):
+
+    m = _model(solver=solver)
+    m.dQ
+    x = m.T_conc_free
+
+    param = m.param_values
+    beta = np.array([param["beta{}".format(i)] for i in range(1,4)])
+    site = np.arange(1,4)
+    bx = beta*x[:,np.newaxis]**site
+    P = 1 + np.sum(bx,axis=1)
+    N = np.sum(site*bx,axis=1)
+
+    # Free plus bound titrant equals total titrant
+    total = x + param["fx_competent"]*m._S_conc*N/P
+    assert np.allclose(total,m._T_conc,rtol=rtol,atol=1e-15)
+
+def test_reused_workspace_matches_fresh_workspace():
+
+    m = _model()
+    param = _samples(m,5)
+
+    # The model reuses its workspace for every dQ call; a fresh model 
+    # allocates a new one
+    for p in param:
+        values = dict(zip(m.param_names,p))
+        m.update_values(values)
+
+        fresh = _model()
+        fresh.update_values(values)
+
+        assert np.array_equal(m.dQ,fresh.dQ)
+        assert np.array_equal(m.T_conc_free,fresh.T_conc_free)
+
+def test_workspace_checks_sizes():
+
+    with pytest.raises(ValueError):
+        bp_ext.workspace(0)
+
+    m = _model()
+    ws = bp_ext.workspace(len(m._S_conc) - 1)
+    with pytest.raises(ValueError):
+        bp_ext.dQ(ws,1400.0,np.zeros(len(m._S_conc) - 1),np.ones(3),np.ones(3),
+                  m._S_conc,m._T_conc,np.zeros(len(m._S_conc) - 1),
+                  bp_ext.SOLVER_NEWTON)
+
+    with pytest.raises(TypeError):
+        bp_ext.free_titrant(None)
@@ -0,0 +1,72 @@
+import copy
+
+import numpy as np
+import pytest
+
+from pytc.fit_param import FitParameter
+from pytc.indiv_models import SingleSite
+
+def test_parameter_values_live_in_model_array():
+
+    m = SingleSite()
+    K = m.parameters["K"]
+
+    K.value = 2e5
+    assert m._pvals[m._pidx["K"]] == 2e5
+    assert m.param_values["K"] == 2e5
+
+    version = m.param_version
+    m._update_param_array(np.array([m._pidx["K"],m._pidx["dH"]]),np.array([3e5,-100.0]))
+    assert K.value == 3e5
+    assert m.parameters["dH"].value == -100.0
+    assert m.param_version == version + 1
+
+    # Writing the same values again leaves the version (and cached heats) alone
+    m._update_param_array(np.array([m._pidx["K"]]),np.array([3e5]))
+    assert m.param_version == version + 1
+
+def test_copied_parameter_is_detached():
+
+    m = SingleSite()
+    K = copy.copy(m.parameters["K"])
+    version = m.param_version
+
+    K.value = 42.0
+    assert K.value == 42.0
+    assert m.param_values["K"] != 42.0
+    assert m.param_version == version
+
+@pytest.mark.parametrize("transform,bounds,x",[("log",None,[1e-3,1.0,1e6]),
+                                               ("logit",(-2.0,5.0),[-1.9,0.0,4.9]),
+                                               ("softplus",(1.0,None),[1.001,2.0,1e3])])
+def test_transform_round_trip(transform,bounds,x):
+
+    p = FitParameter("p",guess=x[1],bounds=bounds,transform=transform)
+    x = np.array(x)
+
+    u = p.to_fit_space(x)
+    assert np.allclose(p.from_fit_space(u),x,rtol=1e-10)
+
+    # Values stay inside the bounds however far the fitter steps
+    lower, upper = p._numeric_bounds()
+    far = p.from_fit_space(np.array([-1e3,1e3]))
+    assert np.all(far >= lower) and np.all(far <= upper)
+
+    h = 1e-6
+    numeric = (p.from_fit_space(u + h) - p.from_fit_space(u - h))/(2*h)
+    assert np.allclose(p.fit_space_derivative(u),numeric,rtol=1e-5)
+    assert np.allclose(p.fit_space_log_derivative(u),np.log(p.fit_space_derivative(u)))
+
+def test_transform_requirements():
+
+    with pytest.raises(ValueError):
+        FitParameter("p",guess=1.0,transform="exp")
+
+    with pytest.raises(ValueError):
+        FitParameter("p",guess=-1.0,transform="log").to_fit_space(-1.0)
+
+    with pytest.raises(ValueError):
+        FitParameter("p",guess=1.0,transform="logit").to_fit_space(1.0)
+
+    with pytest.raises(ValueError):
+        FitParameter("p",guess=1.0,transform="softplus").to_fit_space(1.0)
@@ -0,0 +1,310 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import pytc
+from pytc.indiv_models import BindingPolynomial
+
+from conftest import write_dh, build_van_t_hoff_fit
+
+def _binding_polynomial_fit(directory):
+    """
+    GlobalFit of one single-site binding polynomial experiment.
+    """
+
+    param = {"beta1":2e6,"dH1":-6000.0,"fx_competent":1.0}
+    path = write_dh(directory/"bp.DH",BindingPolynomial,param,noise=0.3,
+                    num_sites=1)
+
+    g = pytc.GlobalFit()
+    g.add_experiment(pytc.ITCExperiment(path,BindingPolynomial,num_sites=1))
+
+    return g
+
+@pytest.fixture(params=["fork","spawn"])
+def start_method(request):
+    """
+    Start worker processes by forking (workers inherit the fitter) or by
+    spawning (workers unpickle the fitter).
+    """
+
+    if request.param not in multiprocessing.get_all_start_methods():
+        pytest.skip("{} start method not available".format(request.param))
+
+    old = multiprocessing.get_start_method()
+    multiprocessing.set_start_method(request.param,force=True)
+    yield request.param
+    multiprocessing.set_start_method(old,force=True)
+
+@pytest.mark.parametrize("warm_start",[False,True])
+def test_bootstrap_binding_polynomial_independent_of_workers(tmp_path,warm_start,
+                                                             start_method):
+
+    g = _binding_polynomial_fit(tmp_path)
+
+    samples = []
+    for num_workers in [1,2]:
+        f = pytc.fitters.BootstrapFitter(num_bootstrap=6,seed=7,
+                                         num_workers=num_workers,
+                                         warm_start=warm_start)
+        g.fit(f)
+        samples.append(f.samples)
+
+    assert np.allclose(samples[0],samples[1],rtol=1e-10,atol=0)
+
+def _block_residuals(bounds=None):
+    """
+    Residuals of four blocks of observations sharing parameter 0, each with
+    one local parameter, plus the jacobian sparsity pattern and the exact
+    jacobian.  If bounds are given, evaluating the residuals outside them
+    fails.
+    """
+
+    x = np.linspace(0,1,5)
+    rows = np.repeat(np.arange(4),len(x))
+    xx = np.tile(x,4)
+
+    def residuals(p):
+        if bounds is not None:
+            assert np.all(p >= bounds[0]) and np.all(p <= bounds[1])
+        return np.exp(p[0]*xx) + p[1 + rows]*xx**2
+
+    def exact(p):
+        J = np.zeros((len(xx),5))
+        J[:,0] = xx*np.exp(p[0]*xx)
+        J[np.arange(len(xx)),1 + rows] = xx**2
+        return J
+
+    sparsity = np.abs(exact(np.ones(5))) > 0
+    sparsity[:,0] = True
+
+    return residuals, sparsity, exact
+
+@pytest.mark.parametrize("sparse",[False,True])
+def test_grouped_jacobian_matches_exact(sparse):
+
+    residuals, sparsity, exact = _block_residuals()
+    p = np.array([0.5,1.0,-2.0,3.0,4.0])
+
+    fun, jac = pytc.fitters.MLFitter()._grouped_jacobian(residuals,sparsity,
+                                                         [-np.inf*np.ones(5),np.inf*np.ones(5)],
+                                                         sparse=sparse)
+    J = jac(p)
+    if sparse:
+        J = J.toarray()
+
+    assert np.allclose(J,exact(p),rtol=1e-6,atol=1e-6)
+
+def test_grouped_jacobian_steps_stay_in_bounds():
+
+    # Parameter 0 sits on its upper bound, parameters 1 and 2 in a range too 
+    # narrow for a full step either way
+    lower = np.array([0.0,1.0,1.0,-10.0,-10.0])
+    upper = np.array([0.5,1.0 + 1e-9,1.0 + 1e-9,10.0,10.0])
+    p = np.array([0.5,1.0,1.0 + 1e-9,3.0,4.0])
+
+    residuals, sparsity, exact = _block_residuals(bounds=(lower,upper))
+    fun, jac = pytc.fitters.MLFitter()._grouped_jacobian(residuals,sparsity,
+                                                         [lower,upper])
+
+    assert np.allclose(jac(p),exact(p),rtol=1e-6,atol=1e-6)
+
+@pytest.mark.parametrize("sparse",[False,True])
+def test_grouped_jacobian_mixed_scales_at_bounds(sparse):
+
+    # The shared parameter sits on its upper bound.  In the neighbouring 
+    # group, local parameters on very different scales sit on their upper 
+    # bound, on their lower bound and inside a range narrower than a step.
+    lower = np.array([-2.0,-1e3,-1e-6,-10.0,1e-3])
+    upper = np.array([2.0,1e3,1e-6,10.0,1e-3 + 1e-9])
+    p = np.array([2.0,1e3,-1e-6,3.0,1e-3])
+
+    residuals, sparsity, exact = _block_residuals(bounds=(lower,upper))
+    fun, jac = pytc.fitters.MLFitter()._grouped_jacobian(residuals,sparsity,
+                                                         [lower,upper],
+                                                         sparse=sparse)
+    J = jac(p)
+    if sparse:
+        J = J.toarray()
+
+    E = exact(p)
+    for i in range(len(p)):
+        assert np.allclose(J[:,i],E[:,i],rtol=1e-5,atol=1e-5*np.max(np.abs(E[:,i]))), i
+
+def test_grouped_jacobian_reuses_residuals():
+
+    residuals, sparsity, exact = _block_residuals()
+    calls = []
+    def counted(p):
+        calls.append(np.copy(p))
+        return residuals(p)
+
+    fun, jac = pytc.fitters.MLFitter()._grouped_jacobian(counted,sparsity,
+                                                         [-np.inf*np.ones(5),np.inf*np.ones(5)])
+    p = np.array([0.5,1.0,-2.0,3.0,4.0])
+
+    # Parameter 0 touches every block, the local parameters share a group
+    fun(p)
+    jac(p)
+    assert len(calls) == 3
+
+    # Not evaluated at this point yet
+    jac(p + 1)
+    assert len(calls) == 6
+
+def _line(param):
+    """
+    Straight line model taking one set of parameters.
+    """
+
+    return param[0]*np.linspace(0,1,20) + param[1]
+
+def _line_data():
+
+    y_obs = _line([2.0,1.0]) + np.random.RandomState(0).normal(0,0.1,20)
+
+    return y_obs, 0.1*np.ones(20)
+
+def test_bayesian_adaptive_stops_on_long_enough_chains():
+
+    np.random.seed(0)
+    y_obs, y_err = _line_data()
+    f = pytc.fitters.BayesianFitter(num_walkers=10,initial_walker_spread=0.1,
+                                    vectorize=False,target_ess=10,
+                                    check_every=50,max_steps=5000)
+    f.fit(_line,[1.0,1.0],[[-10,-10],[10,10]],y_obs,y_err)
+
+    info = f.fit_info
+    assert info["Converged"]
+
+    # A tiny target_ess is reached early, but the chains must also be long 
+    # compared to tau
+    tau = info["Autocorrelation time"]
+    assert info["Steps run"] - info["Burn in steps"] > 50*tau
+    assert f.samples.shape[1] == 2
+    assert np.allclose(f.estimate,[2.0,1.0],atol=0.2)
+
+def test_bayesian_adaptive_unconverged_after_max_steps():
+
+    np.random.seed(0)
+    y_obs, y_err = _line_data()
+    f = pytc.fitters.BayesianFitter(num_walkers=10,initial_walker_spread=0.1,
+                                    vectorize=False,target_ess=1e6,
+                                    check_every=50,max_steps=200)
+    f.fit(_line,[1.0,1.0],[[-10,-10],[10,10]],y_obs,y_err)
+
+    assert not f.success
+    assert f.fit_info["Steps run"] == 200
+    assert not f.fit_info["Converged"]
+
+def test_bayesian_default_runs_one_dimensional_model():
+
+    np.random.seed(0)
+    y_obs, y_err = _line_data()
+    f = pytc.fitters.BayesianFitter(num_walkers=10,num_steps=20,
+                                    initial_walker_spread=0.1)
+    f.fit(_line,[1.0,1.0],[[-10,-10],[10,10]],y_obs,y_err)
+
+    assert not f.fit_info["Vectorized"]
+    assert f.samples.shape == (10*18,2)
+
+def test_bayesian_vectorized_matches_loop(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    np.random.seed(0)
+    f = pytc.fitters.BayesianFitter(num_walkers=30,num_steps=5)
+    g.fit(f)
+
+    # GlobalFit._y_calc takes 2d arrays, so it is vectorized by default
+    assert f.fit_info["Vectorized"]
+
+    positions = f.samples[:7]
+    vectorized = f.ln_prob(positions)
+    looped = [f.ln_prob(p) for p in positions]
+    assert np.allclose(vectorized,looped,rtol=1e-12,atol=0)
+
+@pytest.mark.parametrize("use_jacobian",[True,False])
+def test_schur_matches_ml_on_linked_fit(tmp_path,use_jacobian):
+
+    ml, vh, experiments = build_van_t_hoff_fit(tmp_path,num_expt=4)
+    ml.fit(use_jacobian=use_jacobian)
+
+    schur, vh, experiments = build_van_t_hoff_fit(tmp_path,num_expt=4)
+    f = pytc.fitters.SchurFitter()
+    schur.fit(f,use_jacobian=use_jacobian)
+
+    # One block per experiment; K_ref, dH and fx are shared
+    assert f.success
+    assert f.fit_info["Num blocks"] == 4
+    assert f.fit_info["Num global params"] == 3
+
+    for k, v in ml.fit_param[0].items():
+        assert np.isclose(schur.fit_param[0][k],v,rtol=1e-5), k
+        assert np.isclose(schur.fit_stdev[0][k],ml.fit_stdev[0][k],rtol=1e-3), k
+
+    for schur_local, ml_local in zip(schur.fit_param[1],ml.fit_param[1]):
+        for k, v in ml_local.items():
+            assert np.isclose(schur_local[k],v,rtol=1e-4,atol=1e-6), k
+
+def test_warm_started_bootstrap_matches_cold_bootstrap(tmp_path):
+
+    g, vh, experiments = build_van_t_hoff_fit(tmp_path)
+
+    results = {}
+    for warm_start in [False,True,"scale"]:
+        f = pytc.fitters.BootstrapFitter(num_bootstrap=8,seed=3,exp_err=True,
+                                         warm_start=warm_start)
+        g.fit(f)
+        results[warm_start] = f
+
+    cold = results[False]
+    for warm_start in [True,"scale"]:
+        warm = results[warm_start]
+        assert warm.fit_info["Warm start"] == warm_start
+        assert warm.fit_info["Mean replicate nfev"] < cold.fit_info["Mean replicate nfev"]
+        assert np.allclose(warm.samples,cold.samples,rtol=1e-4)
+
+    with pytest.raises(ValueError):
+        pytc.fitters.BootstrapFitter(warm_start="hot")
+
+def test_bootstrap_seed_reproducible(tmp_path):
+
+    g, vh, experiments = build_van_t_hoff_fit(tmp_path)
+
+    samples = []
+    for seed in [5,5,6]:
+        f = pytc.fitters.BootstrapFitter(num_bootstrap=3,seed=seed)
+        g.fit(f)
+        samples.append(f.samples)
+        assert f.fit_info["Seed"] == seed
+
+    assert np.array_equal(samples[0],samples[1])
+    assert not np.array_equal(samples[0],samples[2])
+
+def test_bayesian_threads_match_serial(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    y_obs, y_err = _line_data()
+
+    samples = {}
+    for num_threads in [1,2]:
+
+        np.random.seed(2)
+        f = pytc.fitters.BayesianFitter(num_walkers=30,num_steps=6,
+                                        num_threads=num_threads)
+        g.fit(f)
+        samples[("global",num_threads)] = f.samples
+
+        np.random.seed(2)
+        f = pytc.fitters.BayesianFitter(num_walkers=10,num_steps=6,
+                                        num_threads=num_threads)
+        f.fit(_line,[1.0,1.0],[[-10,-10],[10,10]],y_obs,y_err)
+        samples[("line",num_threads)] = f.samples
+        assert f.fit_info["Num threads"] == num_threads
+
+    assert np.array_equal(samples[("global",1)],samples[("global",2)])
+    assert np.array_equal(samples[("line",1)],samples[("line",2)])
+
+    with pytest.raises(ValueError):
+        pytc.fitters.BayesianFitter(num_threads=0)
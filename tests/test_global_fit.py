@@ -0,0 +1,463 @@
+import pickle
+
+import numpy as np
+import pytest
+
+import pytc
+
+from conftest import build_van_t_hoff_fit
+
+def test_plot_samples_match_per_sample_heats(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g.fit(pytc.fitters.BootstrapFitter(num_bootstrap=5,seed=0))
+
+    np.random.seed(1)
+    fig, ax = g.plot(correct_molar_ratio=True,subtract_dilution=True,num_samples=3)
+
+    np.random.seed(1)
+    s = g._fitter.samples
+    these_samples = s[np.random.randint(len(s),size=3)]
+
+    lines = [(l.get_xdata(),l.get_ydata()) for l in ax[0].get_lines()]
+
+    # For each experiment, one fit line per sample, then the data
+    assert len(lines) == 4*len(experiments)
+    for j, name in enumerate(g._expt_list_stable_order):
+        e = g._expt_dict[name]
+        for i, sample in enumerate(these_samples):
+            g._y_calc(sample)
+            mr, calc = lines[j*4 + i]
+            assert np.allclose(calc,e.dQ - e.dilution_heats)
+            assert np.allclose(mr,e.mole_ratio/e.param_values["fx_competent"])
+
+def test_prep_fit_reads_heats_edited_in_place(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g.fit()
+
+    e = experiments[1]
+    e.heats[3] = e.heats[3] + 5.0
+    e.heats_stdev[4] = 2.0
+    g._prep_fit()
+
+    assert g._y_obs[g._expt_slices[e.experiment_id]][3] == e.heats[3]
+    assert g._y_err[g._expt_slices[e.experiment_id]][4] == 2.0
+    assert np.array_equal(g._y_obs,np.concatenate([x.heats for x in experiments]))
+
+def test_y_jac_matches_central_differences(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g._prep_fit()
+    p = np.array(g._flat_param,dtype=float)
+
+    J = g._y_jac(p)
+    for i in range(len(p)):
+        h = 1e-5*max(abs(p[i]),1.0)
+        step = np.zeros(len(p))
+        step[i] = h
+        numeric = (np.array(g._y_calc(p + step)) - np.array(g._y_calc(p - step)))/(2*h)
+        scale = np.max(np.abs(numeric))
+        assert np.allclose(J[:,i],numeric,rtol=1e-4,atol=1e-5*scale), g._flat_param_name[i]
+
+@pytest.mark.parametrize("transform,bounds",[("log",None),("logit",(1e4,1e8))])
+def test_transformed_fit_matches_plain_fit(tmp_path,transform,bounds):
+
+    plain, vh, experiments = build_van_t_hoff_fit(tmp_path)
+    plain.fit()
+
+    g, vh, experiments = build_van_t_hoff_fit(tmp_path)
+    if bounds is not None:
+        g.update_bounds("vh_K_ref",bounds)
+    g.update_transform("vh_K_ref",transform)
+    g.fit()
+
+    # Results are reported untransformed
+    assert g.fit_success
+    assert np.isclose(g.fit_param[0]["vh_K_ref"],plain.fit_param[0]["vh_K_ref"],rtol=1e-4)
+    assert np.isclose(g.fit_param[0]["vh_dH_vanthoff"],
+                      plain.fit_param[0]["vh_dH_vanthoff"],rtol=1e-4)
+
+def test_transformed_sample_fits_stay_in_parameter_space(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g.update_transform("vh_K_ref","log")
+
+    # Bootstrap estimates are arithmetic means of the untransformed samples
+    g.fit(pytc.fitters.BootstrapFitter(num_bootstrap=10,seed=0))
+    i = g._flat_param_name.index("log(vh_K_ref)")
+    K = np.exp(g._fitter.samples[:,i])
+    assert np.isclose(g.fit_param[0]["vh_K_ref"],np.mean(K))
+    assert np.isclose(g.fit_stdev[0]["vh_K_ref"],np.std(K))
+
+    # The Bayesian prior is uniform in K, so it carries the log jacobian d K/d log(K)
+    fitter = pytc.fitters.BayesianFitter(num_walkers=30,num_steps=2)
+    g.fit(fitter)
+    u = np.array(g._flat_param)
+    assert np.isclose(fitter.ln_prior(u),u[i])
+    rows = np.array([u,u + 1.0])
+    assert np.allclose(fitter.ln_prior(rows),rows[:,i])
+
+def _fresh_heats(g,experiments,p):
+    """
+    Heats for flat parameters p, written into the models through their
+    FitParameters rather than the scatter plan.
+    """
+
+    g._y_calc(p)
+    values = [e.model.param_values for e in experiments]
+
+    heats = []
+    for e, v in zip(experiments,values):
+        m = e.model.__class__(S_cell=e.model._S_cell,T_syringe=e.model._T_syringe,
+                              cell_volume=e.model._cell_volume,
+                              shot_volumes=e.model._shot_volumes)
+        m.update_values(v)
+        heats.append(m.dQ[e.shot_start:])
+
+    return np.concatenate(heats)
+
+def test_y_calc_scatters_parameters(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g._prep_fit()
+    p = np.array(g._flat_param)*1.1
+
+    y = np.array(g._y_calc(p))
+    assert np.allclose(y,_fresh_heats(g,experiments,p),rtol=1e-12,atol=0)
+
+    # Connector parameters are written into the connector and every model
+    vh_values = dict(zip(g._flat_param_name,p))
+    assert vh.params["vh_K_ref"].value == vh_values["vh_K_ref"]
+    for e in experiments:
+        assert e.model.param_values["dH"] == vh_values["vh_dH_vanthoff"]
+        assert np.isclose(e.model.param_values["K"],vh.K(e))
+
+def test_y_calc_into_reuses_buffer(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g._prep_fit()
+    p = np.array(g._flat_param)
+
+    first = g._y_calc_into(p)
+    kept = np.array(first)
+    second = g._y_calc_into(p*1.05)
+
+    # Same buffer, overwritten with the new heats
+    assert second is first
+    assert not np.array_equal(second,kept)
+    assert np.allclose(second,_fresh_heats(g,experiments,p*1.05),rtol=1e-12,atol=0)
+
+def test_y_calc_returns_new_arrays(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g._prep_fit()
+    p = np.array(g._flat_param)
+
+    a = g._y_calc(p)
+    b = g._y_calc(p*1.05)
+
+    assert a is not b
+    assert np.allclose(a,_fresh_heats(g,experiments,p),rtol=1e-12,atol=0)
+    assert np.allclose(b,_fresh_heats(g,experiments,p*1.05),rtol=1e-12,atol=0)
+
+    # The fitters are given the buffered version
+    g.fit()
+    assert g._fitter._model == g._y_calc_into
+
+def test_fit_stats_use_fit_heats(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g.fit()
+    stats = g.fit_stats
+
+    y_obs = np.concatenate([e.heats for e in experiments])
+    y_calc = np.concatenate([e.dQ for e in experiments])
+    y_err = np.concatenate([e.heats_stdev for e in experiments])
+
+    sse = np.sum((y_obs - y_calc)**2)
+    sst = np.sum((y_obs - np.mean(y_obs))**2)
+    assert np.isclose(stats["Rsq"],1 - sse/sst)
+
+    sigma2 = y_err**2
+    lnL = -0.5*np.sum((y_obs - y_calc)**2/sigma2 + np.log(sigma2))
+    assert np.isclose(stats["ln(L)"],lnL,rtol=1e-10)
+
+    # Residuals handed to least_squares are never the shared buffer
+    p = g._fitter.estimate
+    r1 = g._fitter.weighted_residuals(p)
+    r2 = g._fitter.weighted_residuals(p)
+    assert r1 is not r2 and np.array_equal(r1,r2)
+
+def test_y_calc_only_recalculates_changed_experiments(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g._prep_fit()
+    p = np.array(g._flat_param)
+    g._y_calc(p)
+
+    def versions():
+        return [e.model.param_version for e in experiments]
+
+    # Nothing changed
+    before = versions()
+    g._y_calc(np.copy(p))
+    assert versions() == before
+
+    # A local parameter of one experiment
+    i = next(i for i in range(len(p)) if g._flat_param_type[i] == 0 and
+             g._flat_param_mapping[i][0] == experiments[1].experiment_id)
+    q = np.copy(p)
+    q[i] += 10.0
+    y = np.array(g._y_calc(q))
+    after = versions()
+    assert after[1] > before[1]
+    assert after[0] == before[0] and after[2] == before[2]
+    assert np.allclose(y,_fresh_heats(g,experiments,q),rtol=1e-12,atol=0)
+
+    # A connector parameter touches every experiment
+    j = g._flat_param_name.index("vh_K_ref")
+    q[j] *= 1.5
+    y = np.array(g._y_calc(q))
+    assert all([a > b for a, b in zip(versions(),after)])
+    assert np.allclose(y,_fresh_heats(g,experiments,q),rtol=1e-12,atol=0)
+
+def test_y_calc_notices_changes_made_on_models(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g._prep_fit()
+    p = np.array(g._flat_param)
+    y = np.array(g._y_calc(p))
+
+    # Change a value behind the GlobalFit's back; the next call rewrites it
+    experiments[0].model.update_values({"dH":-100.0})
+    assert np.array_equal(g._y_calc(p),y)
+
+def test_jacobian_sparsity_covers_jacobian(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g._prep_fit()
+    J = g._y_jac(np.array(g._flat_param))
+
+    pattern = g._jac_sparsity.toarray().astype(bool)
+    assert pattern.shape == J.shape
+    assert not np.any((J != 0) & ~pattern)
+
+    # Local parameters only touch their own experiment
+    assert np.sum(pattern) < pattern.size
+
+def test_finite_difference_fit_matches_analytic_fit(tmp_path):
+
+    analytic, vh, experiments = build_van_t_hoff_fit(tmp_path)
+    analytic.fit()
+
+    numeric, vh, experiments = build_van_t_hoff_fit(tmp_path)
+    numeric.fit(use_jacobian=False)
+
+    for k, v in analytic.fit_param[0].items():
+        assert np.isclose(numeric.fit_param[0][k],v,rtol=1e-5), k
+
+def test_threaded_heats_match_serial(tmp_path):
+
+    serial, vh, experiments = build_van_t_hoff_fit(tmp_path)
+    threaded, vh, experiments = build_van_t_hoff_fit(tmp_path,n_workers=3)
+
+    serial._prep_fit()
+    threaded._prep_fit()
+    for scale in [1.0,1.1,0.9]:
+        p = np.array(serial._flat_param)*scale
+        assert np.array_equal(serial._y_calc(p),threaded._y_calc(p))
+
+    serial.fit()
+    threaded.fit()
+    assert serial.fit_param == threaded.fit_param
+
+    # The thread pool is not pickled with the fit
+    copy = pickle.loads(pickle.dumps(threaded))
+    copy._prep_fit()
+    assert np.array_equal(copy._y_calc(p),serial._y_calc(p))
+
+def test_close_shuts_down_thread_pool(tmp_path):
+
+    g, vh, experiments = build_van_t_hoff_fit(tmp_path,n_workers=3)
+    g.fit()
+    pool = g._executor
+    assert pool is not None
+
+    g.close()
+    assert g._executor is None
+    with pytest.raises(RuntimeError):
+        pool.submit(print)
+
+    # A closed fit starts a new pool when it needs one; the with block
+    # shuts it down again
+    with g:
+        g.fit()
+        pool = g._executor
+        assert pool is not None
+    assert g._executor is None
+    with pytest.raises(RuntimeError):
+        pool.submit(print)
+
+def test_prep_fit_rebuilds_stale_layout(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g.fit()
+    num_param = len(g._flat_param)
+    num_obs = len(g._y_obs)
+
+    # Fixing a parameter directly on the model changes the parameter layout
+    experiments[0].model.update_fixed({"dilution_heat":0.0})
+    g._prep_fit()
+    assert len(g._flat_param) == num_param - 1
+
+    # Changing the starting shot changes the observation layout
+    experiments[2].shot_start = 3
+    g._prep_fit()
+    assert len(g._y_obs) == num_obs - 2
+    assert np.array_equal(g._y_obs[g._expt_slices[experiments[2].experiment_id]],
+                          experiments[2].heats)
+    assert len(g._y_calc(np.array(g._flat_param))) == num_obs - 2
+
+    # Nothing stale: the layout is reused
+    slices = g._expt_slices
+    g._prep_fit()
+    assert g._expt_slices is slices
+
+
+def test_prep_fit_catches_direct_parameter_edits(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g.fit()
+    assert g.fit_num_param == 9
+
+    # Fix a local parameter and a connector parameter on their FitParameters
+    experiments[1].model.parameters["dilution_heat"].fixed = True
+    g.global_param["vh_dH_vanthoff"].fixed = True
+    g.fit()
+    assert g.fit_num_param == 7
+    assert "vh_dH_vanthoff" not in g._flat_param_name
+
+    # Transform a global parameter directly
+    g.global_param["fx"].transform = "log"
+    g._prep_fit()
+    assert [g._flat_param_obj[i] for i in g._flat_transformed] == [g.global_param["fx"]]
+
+    # Unfix them again
+    experiments[1].model.parameters["dilution_heat"].fixed = False
+    g.global_param["vh_dH_vanthoff"].fixed = False
+    g.fit()
+    assert g.fit_num_param == 9
+
+def test_removing_experiments_and_globals_updates_links(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    e0, e1, e2 = experiments
+    g.link_to_global(e0,"dilution_heat","dil")
+    g.link_to_global(e1,"dilution_heat","dil")
+
+    global_to_expt, expt_to_global = g.param_aliases
+    assert sorted(global_to_expt["dil"]) == sorted([(e0.experiment_id,"dilution_heat"),
+                                                    (e1.experiment_id,"dilution_heat")])
+
+    # Linking twice does not add a second link
+    g.link_to_global(e0,"dilution_heat","dil")
+    assert len(g.param_aliases[0]["dil"]) == 2
+
+    g.unlink_from_global(e0,"dilution_heat")
+    assert g.param_aliases[0]["dil"] == [(e1.experiment_id,"dilution_heat")]
+    assert e0.model.parameters["dilution_heat"].alias is None
+
+    # Removing the last experiment linked to a global removes the global
+    g.remove_experiment(e1)
+    assert "dil" not in g.global_param
+    assert e1.experiment_id not in g._expt_dict
+
+    g.remove_global("fx")
+    assert "fx" not in g.global_param
+    assert e0.model.parameters["fx_competent"].alias is None
+    assert e2.model.parameters["fx_competent"].alias is None
+
+    with pytest.raises(ValueError):
+        g.remove_global("fx")
+
+    # The remaining fit still works
+    g.fit()
+    assert g.fit_success
+    assert len(g._y_obs) == len(e0.heats) + len(e2.heats)
+
+def test_warm_start_refit_is_cheaper(van_t_hoff_fit):
+
+    g, vh, experiments = van_t_hoff_fit
+    g.fit()
+    cold = g.fit_param
+    cold_nfev = g._fitter.fit_result.nfev
+
+    for warm_start in [True,"scale"]:
+        g.fit(warm_start=warm_start)
+        assert g._fitter.fit_result.nfev < cold_nfev
+        assert np.isclose(g.fit_param[0]["vh_K_ref"],cold[0]["vh_K_ref"],rtol=1e-6)
+
+    with pytest.raises(ValueError):
+        g.fit(warm_start="hot")
+
+def test_fit_continuation_matches_cold_fits(tmp_path):
+
+    g, vh, experiments = build_van_t_hoff_fit(tmp_path)
+    fx_values = [0.9,0.95,1.0]
+    results = g.fit_continuation([lambda g, fx=fx: g.update_fixed("fx",fx)
+                                  for fx in fx_values])
+
+    assert len(results) == len(fx_values)
+    for fx, result in zip(fx_values,results):
+
+        cold, vh, experiments = build_van_t_hoff_fit(tmp_path)
+        cold.update_fixed("fx",fx)
+        cold.fit()
+
+        assert result["fit_success"]
+        assert np.isclose(result["fit_param"][0]["vh_K_ref"],
+                          cold.fit_param[0]["vh_K_ref"],rtol=1e-4)
+        assert np.isclose(result["fit_param"][0]["vh_dH_vanthoff"],
+                          cold.fit_param[0]["vh_dH_vanthoff"],rtol=1e-4)
+
+def test_save_load_round_trips_fit(van_t_hoff_fit,tmp_path):
+
+    g, vh, experiments = van_t_hoff_fit
+    g.link_to_global(experiments[0],"dilution_intercept","dil")
+    g.update_transform("vh_K_ref","log")
+    g.fit()
+
+    g.save(tmp_path/"saved")
+    loaded = pytc.GlobalFit.load(tmp_path/"saved")
+
+    assert loaded.fit_param == g.fit_param
+    assert loaded.fit_stdev == g.fit_stdev
+    names = lambda aliases: [k if type(k) == str else k.__name__ for k in aliases[0]]
+    assert names(loaded.param_aliases) == names(g.param_aliases)
+    assert loaded.global_param["vh_K_ref"].transform == "log"
+
+    # The loaded fit can be continued
+    fit_param = g.fit_param
+    loaded.fit(warm_start=True)
+    assert np.isclose(loaded.fit_param[0]["vh_K_ref"],fit_param[0]["vh_K_ref"],rtol=1e-6)
+
+    p = np.array(g._flat_param)
+    assert np.array_equal(loaded._y_obs,g._y_obs)
+    assert np.allclose(loaded._y_calc(p),g._y_calc(p),rtol=1e-12,atol=0)
+
+def test_save_load_memory_maps_samples(van_t_hoff_fit,tmp_path,monkeypatch):
+
+    monkeypatch.setattr(pytc.global_fit,"SAVE_MMAP_SIZE",10)
+
+    g, vh, experiments = van_t_hoff_fit
+    g.fit(pytc.fitters.BootstrapFitter(num_bootstrap=4,seed=1))
+
+    g.save(tmp_path/"saved")
+    loaded = pytc.GlobalFit.load(tmp_path/"saved")
+
+    samples = loaded._fitter.samples
+    assert isinstance(samples,np.memmap)
+    assert not samples.flags.writeable
+    assert np.array_equal(samples,g._fitter.samples)
+    assert loaded.fit_param == g.fit_param
@@ -0,0 +1,228 @@
+import copy, pickle
+
+import numpy as np
+import pytest
+
+from pytc.indiv_models import SingleSite, SingleSiteCompetitor, Blank, BindingPolynomial
+from pytc.indiv_models import base
+
+from conftest import SHOTS
+
+PROTOCOL = {"S_cell":1e-4,"T_syringe":1.5e-3,"cell_volume":1400.0,
+            "shot_volumes":SHOTS}
+
+DILUTION = {"dilution_heat":50.0,"dilution_intercept":2.0}
+
+# Model class, keyword arguments and parameter values for each built-in model
+MODELS = {
+    "single_site":(SingleSite,{},
+                   {"K":1e6,"dH":-6000.0,"fx_competent":0.9}),
+    "competitor":(SingleSiteCompetitor,{"C_cell":2e-4},
+                  {"K":1e7,"Kcompetitor":1e5,"dH":-6000.0,"dHcompetitor":-3000.0,
+                   "fx_competent":0.9}),
+    "blank":(Blank,{},{}),
+    "binding_polynomial":(BindingPolynomial,{"num_sites":2},
+                          {"beta1":1e6,"beta2":1e11,"dH1":-5000.0,"dH2":-8000.0,
+                           "fx_competent":0.9}),
+    "binding_polynomial_numpy":(BindingPolynomial,{"num_sites":2,"engine":"numpy"},
+                                {"beta1":1e6,"beta2":1e11,"dH1":-5000.0,"dH2":-8000.0,
+                                 "fx_competent":0.9}),
+}
+
+@pytest.fixture(params=list(MODELS.keys()))
+def model(request):
+    """
+    Each built-in model, set to the values in MODELS.
+    """
+
+    model_class, kwargs, param = MODELS[request.param]
+    m = model_class(**PROTOCOL,**kwargs)
+    m.update_values(param)
+    m.update_values(DILUTION)
+
+    return m
+
+def _perturbed(m,num_samples,seed=0):
+    """
+    num_samples x num_params array of parameter values scattered around the
+    current values of model m.
+    """
+
+    values = np.array(list(m.param_values.values()))
+    scale = np.random.RandomState(seed).uniform(0.8,1.2,(num_samples,len(values)))
+
+    return values*scale
+
+def _titrate_loop(cell_volume,shot_volumes,cell_conc,syringe_conc):
+    """
+    Titration written as the original per-shot loop.
+    """
+
+    out = [cell_conc]
+    shot_ratio = 1 - np.array(shot_volumes)/cell_volume
+    for i in range(len(shot_volumes)):
+        prod = np.prod(shot_ratio[:i+1])
+        out.append(syringe_conc*(1 - prod) + cell_conc*prod)
+
+    return np.array(out)
+
+def test_titration_grid_matches_loop():
+
+    shots = [2.0] + [8.0 for i in range(20)]
+    m = SingleSite(S_cell=1e-4,T_syringe=1.5e-3,cell_volume=1400.0,shot_volumes=shots)
+
+    assert np.allclose(m._S_conc,_titrate_loop(1400.0,shots,1e-4,0.0),rtol=1e-14,atol=0)
+    assert np.allclose(m._T_conc,_titrate_loop(1400.0,shots,0.0,1.5e-3),rtol=1e-14,atol=0)
+
+def test_titration_grid_shared_and_read_only():
+
+    shots = [5.0 for i in range(10)]
+    m1 = SingleSite(S_cell=1e-4,shot_volumes=shots)
+    m2 = SingleSite(S_cell=1e-4,shot_volumes=shots)
+
+    assert m1._T_conc is m2._T_conc
+    with pytest.raises(ValueError):
+        m1._T_conc[0] = 1.0
+
+    # A copy can be modified
+    m1._T_conc = np.array(m1._T_conc)
+    m1._T_conc[0] = 1.0
+    assert m2._T_conc[0] == 0.0
+
+def test_titration_cache_evicts_least_recently_used():
+
+    base._titration_grid.cache_clear()
+
+    first = base._titration_grid(300.0,(1.0,2.0),1e-4,0.0)
+    for i in range(base._titration_grid.cache_info().maxsize - 1):
+        base._titration_grid(300.0,(1.0,2.0),1e-4,float(i + 1))
+
+        # Keep the first grid recently used
+        if i % 100 == 0:
+            base._titration_grid(300.0,(1.0,2.0),1e-4,0.0)
+
+    # Push out the oldest entries; the recently used grid survives
+    base._titration_grid(300.0,(1.0,2.0),2e-4,0.0)
+    assert base._titration_grid(300.0,(1.0,2.0),1e-4,0.0) is first
+
+def _binding_polynomial(**kwargs):
+
+    m = BindingPolynomial(num_sites=2,S_cell=1e-4,T_syringe=1.5e-3,
+                          cell_volume=1400.0,shot_volumes=SHOTS,**kwargs)
+    m.update_values({"beta1":1e6,"beta2":1e11,"dH1":-5000.0,"dH2":-8000.0})
+
+    return m
+
+@pytest.mark.parametrize("copier",[lambda m: pickle.loads(pickle.dumps(m)),
+                                   copy.deepcopy])
+def test_binding_polynomial_copy_resolves(copier):
+
+    m = _binding_polynomial()
+    dQ = m.dQ
+    jac = m.dQ_jacobian
+    T_free = m.T_conc_free
+
+    c = copier(m)
+
+    assert np.array_equal(c.dQ,dQ)
+    assert np.array_equal(c.T_conc_free,T_free)
+    c_jac = c.dQ_jacobian
+    for k in jac:
+        assert np.array_equal(c_jac[k],jac[k])
+
+def test_dQ_batch_matches_dQ(model):
+
+    param = _perturbed(model,5)
+    batch = model.dQ_batch(param)
+
+    assert batch.shape == (5,len(SHOTS))
+    for i in range(len(param)):
+        model.update_values(dict(zip(model.param_names,param[i])))
+        assert np.allclose(batch[i],model.dQ,rtol=1e-9,atol=1e-12)
+
+def test_dQ_batch_does_not_change_values(model):
+
+    before = model.param_values
+    dQ = np.array(model.dQ)
+    model.dQ_batch(_perturbed(model,3))
+
+    assert model.param_values == before
+    assert np.array_equal(model.dQ,dQ)
+
+def test_dQ_jacobian_matches_central_differences(model):
+
+    values = model.param_values
+    jac = model.dQ_jacobian
+
+    assert set(jac.keys()) == set(model.param_names)
+    for p in model.param_names:
+
+        # The cubic root of the competitor model is noisy at smaller steps
+        h = 1e-4*max(abs(values[p]),1.0)
+        model.update_values({p:values[p] + h})
+        forward = np.array(model.dQ)
+        model.update_values({p:values[p] - h})
+        backward = np.array(model.dQ)
+        model.update_values({p:values[p]})
+
+        numeric = (forward - backward)/(2*h)
+        scale = np.max(np.abs(numeric))
+        assert np.allclose(jac[p],numeric,rtol=1e-4,atol=1e-5*scale), p
+
+def test_analytic_jacobian_not_inherited_by_new_dQ():
+
+    class Shifted(SingleSite):
+        def _calc_dQ(self):
+            return super()._calc_dQ() + 1.0
+
+    assert SingleSite(**PROTOCOL).analytic_jacobian
+    assert not Shifted(**PROTOCOL).analytic_jacobian
+
+def test_cached_heats_match_recalculated_heats(model):
+
+    dQ = model.dQ
+    assert model.dQ is dQ
+    with pytest.raises(ValueError):
+        dQ[0] = 1.0
+
+    for p in _perturbed(model,3):
+        version = model.param_version
+        values = dict(zip(model.param_names,p))
+        model.update_values(values)
+        assert model.param_version > version
+
+        # Compare to the heats calculated without the cache
+        assert np.array_equal(model.dQ,model._calc_dQ())
+        assert np.array_equal(model.dilution_heats,model._dilution_heats(values))
+
+def test_fixing_a_parameter_invalidates_cached_heats():
+
+    m = SingleSite(**PROTOCOL)
+    dQ = np.array(m.dQ)
+
+    m.update_fixed({"dH":-1000.0})
+    assert not np.array_equal(m.dQ,dQ)
+    assert np.array_equal(m.dQ,m._calc_dQ())
+
+def test_numpy_engine_matches_compiled_engine():
+
+    pytest.importorskip("pytc.indiv_models.bp_ext")
+
+    kwargs = MODELS["binding_polynomial"][1]
+    param = MODELS["binding_polynomial"][2]
+    c = BindingPolynomial(**PROTOCOL,**kwargs)
+    n = BindingPolynomial(engine="numpy",**PROTOCOL,**kwargs)
+    c.update_values(param)
+    n.update_values(param)
+
+    assert n.engine == "numpy" and c.engine == "c"
+    assert np.allclose(n.dQ,c.dQ,rtol=1e-9,atol=1e-12)
+    assert np.allclose(n.T_conc_free,c.T_conc_free,rtol=1e-9,atol=1e-18)
+
+    samples = _perturbed(c,6)
+    assert np.allclose(n.dQ_batch(samples),c.dQ_batch(samples),rtol=1e-9,atol=1e-12)
+
+def test_unknown_engine_rejected():
+
+    with pytest.raises(ValueError):
+        BindingPolynomial(engine="fortran")